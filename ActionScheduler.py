@@ -0,0 +1,165 @@
+import asyncio
+import collections
+import logging
+import time
+import cozmo
+from Metrics import metrics
+
+'''
+@class ActionScheduler
+Runs the actions queued by the game (head resets, speech, reaction animations) one after the other in a
+task on the event loop of the robot, awaiting each one to complete. Pending actions are kept in one deque
+per priority so a head reset never waits behind a flavour animation, an action already pending is not
+queued twice, and actions that could not start before their deadline are dropped instead of being played
+late. Actions are queued from the loop too (the game update, event handlers and web request calls).
+@author - Wizards of Coz
+'''
+
+log = logging.getLogger(__name__)
+
+# priorities, lower runs first
+HEAD_RESET = 0
+SPEECH = 1
+FLAVOUR = 2
+
+# seconds after which an action that could not start yet is not worth playing anymore, None keeps it
+DEADLINES = {HEAD_RESET: None, SPEECH: 10.0, FLAVOUR: 5.0}
+
+MAX_PENDING = 10            # actions waiting at most, the oldest of the lowest priority goes first
+BUSY_RETRY_DELAY = 0.1      # seconds before trying again when Cozmo is busy with something else
+ACTION_TIMEOUT = 30.0       # seconds to wait for an action to complete
+BUSY_GIVE_UP = 60.0         # seconds an awaited action is tried again while Cozmo stays busy
+
+# Starts an action and waits for it to complete, starting it again while Cozmo is busy with something else.
+# For the game code that awaits its actions instead of queuing them, start_action starts the action and
+# returns it. Once Cozmo was busy for give_up seconds the RobotBusy is raised, or None returned when skip is
+# set for actions the game can do without
+async def run_when_free(start_action, skip=False, give_up=BUSY_GIVE_UP):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + give_up
+    while True:
+        try:
+            return await start_action().wait_for_completed()
+        except cozmo.exceptions.RobotBusy:
+            metrics.count("robot_busy_retries_total", source="awaited")
+            if loop.time() >= deadline:
+                if not skip:
+                    raise
+                log.warning("Cozmo stayed busy for %.0f s, skipping the action", give_up)
+                return None
+            await asyncio.sleep(BUSY_RETRY_DELAY)
+
+class ActionScheduler:
+    def __init__(self):
+        self.queues = [collections.deque() for _ in DEADLINES]
+        self.pending = {}                   # (function, argument) -> entry, to coalesce duplicates
+        self.wakeup = None                  # asyncio.Event set when an action is queued, made on the loop
+        self.running = False
+        self.task = None
+
+        self.started = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.dropped = 0
+
+    # Runs the actions on the loop of the robot, from any thread
+    def start(self, loop):
+        if self.running:
+            return
+        self.running = True
+        self.task = asyncio.run_coroutine_threadsafe(self.run(), loop)
+
+    def stop(self):
+        self.running = False
+        if self.task is not None:
+            self.task.cancel()
+
+    # start_action(argument) starts an SDK action and returns it, or raises RobotBusy.
+    # then is an optional (start_action, argument, priority) submitted once the action has completed
+    def submit(self, start_action, argument, priority=FLAVOUR, deadline=-1, then=None):
+        key = (start_action, argument)
+        if deadline == -1:
+            deadline = DEADLINES[priority]
+        expires = time.time() + deadline if deadline is not None else None
+        entry = self.pending.get(key)
+        if entry is not None:
+            # already waiting, the newer request only extends how long it may wait
+            if entry['expires'] is not None and (expires is None or expires > entry['expires']):
+                entry['expires'] = expires
+            self.coalesced += 1
+            return
+        if len(self.pending) >= MAX_PENDING and not self.drop_lowest(priority):
+            self.dropped += 1
+            return
+        entry = {'key': key, 'priority': priority, 'expires': expires, 'then': then}
+        self.queues[priority].append(entry)
+        self.pending[key] = entry
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    # Actions waiting to run
+    def depth(self):
+        return len(self.pending)
+
+    # Makes room by dropping the oldest action less urgent than priority, returns False if there is none
+    def drop_lowest(self, priority):
+        for queue in reversed(self.queues[priority + 1:]):
+            if queue:
+                entry = queue.popleft()
+                del self.pending[entry['key']]
+                self.dropped += 1
+                return True
+        if self.queues[priority]:
+            entry = self.queues[priority].popleft()
+            del self.pending[entry['key']]
+            self.dropped += 1
+            return True
+        return False
+
+    # Returns the most urgent action that is still worth running, None if there is none
+    def next_entry(self):
+        now = time.time()
+        for queue in self.queues:
+            while queue:
+                entry = queue.popleft()
+                del self.pending[entry['key']]
+                if entry['expires'] is None or entry['expires'] >= now:
+                    return entry
+                self.expired += 1
+        return None
+
+    # Puts a busy action back at the front of its queue, unless a duplicate got queued meanwhile
+    def requeue(self, entry):
+        if entry['key'] not in self.pending:
+            self.queues[entry['priority']].appendleft(entry)
+            self.pending[entry['key']] = entry
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while self.running:
+            entry = self.next_entry()
+            if entry is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            start_action, argument = entry['key']
+            try:
+                with metrics.span("sdk_call_seconds", call=start_action.__name__):
+                    action = start_action(argument)
+            except cozmo.exceptions.RobotBusy:
+                metrics.count("robot_busy_retries_total", source="actions")
+                # something more urgent may come in while waiting, so the action goes back in its queue
+                self.requeue(entry)
+                await asyncio.sleep(BUSY_RETRY_DELAY)
+                continue
+            self.started += 1
+            if action is not None:
+                try:
+                    with metrics.span("action_seconds", action=start_action.__name__):
+                        await action.wait_for_completed(timeout=ACTION_TIMEOUT)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.warning("Action %s(%s) did not complete: %s", start_action.__name__, argument, e)
+            if entry['then'] is not None:
+                self.submit(*entry['then'])
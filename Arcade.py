@@ -2,14 +2,16 @@ import cozmo
 from cozmo.util import degrees, distance_mm, speed_mmps
 import time
 import asyncio
+import logging
 import threading
 import _thread
 import math
 from threading import Timer
 from Common.woc import WOC
-import random
 from Common.colors import Colors
+from ActionScheduler import run_when_free
 
+log = logging.getLogger(__name__)
 
 
 class Arcade:
@@ -41,6 +43,7 @@ class Arcade:
     def __init__(self, robot: cozmo.robot.Robot, instance):
         self.robot = robot
         self.mainInstance = instance;
+        self.rng = instance.rng     # random of the game, recorded with the session
 
     async def startArcadeGame(self):
        self.robot.stop_all_motors();
@@ -51,21 +54,17 @@ class Arcade:
            self.cubes = await self.robot.world.wait_until_observe_num_objects(1, object_type=cozmo.objects.LightCube,
                                                                         timeout=60)
        except asyncio.TimeoutError:
-           print("Didn't find a cube :-(")
+           log.info("Didn't find a cube :-(")
            return
        finally:
-           print("Cube found!!")
+           log.debug("Cube found!!")
 
        if(len(self.cubes) > 0):
             self.arcadeCube = self.cubes[0]
             await self.setUpGame()
 
     async def reset_head_position(self):
-        try:
-            await self.robot.set_head_angle(cozmo.util.Angle(degrees=-10)).wait_for_completed();
-        except cozmo.exceptions.RobotBusy:
-            await asyncio.sleep(0.1);
-            await self.reset_head_position();
+        await run_when_free(lambda: self.robot.set_head_angle(cozmo.util.Angle(degrees=-10)), skip=True)
 
     async def setUpGame(self):
         await self.robot.set_lift_height(1,10,10,0.5).wait_for_completed();
@@ -77,10 +76,9 @@ class Arcade:
         await self.robot.play_anim("anim_hiking_edgesquintgetin_01").wait_for_completed();
 
         self.robot.world.add_event_handler(cozmo.objects.EvtObjectTapped, self.on_object_tapped)
-        self.currentConfig = random.choice(self.tapCombos)
+        self.currentConfig = self.rng.choice(self.tapCombos)
 
-        print(self.currentConfig['speed'])
-        print(self.currentConfig['duration'])
+        log.debug("Tap combo speed %s, duration %s", self.currentConfig['speed'], self.currentConfig['duration'])
         asyncio.ensure_future(self.tap());
         await self.changeDirection()
 
@@ -90,7 +88,7 @@ class Arcade:
         for i in range(0,len(self.lights)):
             self.lights[i] = None
 
-        self.lights[self.flashCtr%4] = random.choice(self.lightColors);
+        self.lights[self.flashCtr%4] = self.rng.choice(self.lightColors);
 
         self.arcadeCube.set_light_corners(self.lights[0],self.lights[1],self.lights[2],self.lights[3]);
         self.flashCtr += 1
@@ -128,7 +126,7 @@ class Arcade:
         if self.tapped is False:
             self.tapped = True;
             self.robot.stop_all_motors();
-            print(tap_intensity)
+            log.debug("Tap intensity %s", tap_intensity)
             for intensity in self.intensities.keys():
                 if tap_intensity<intensity:
                     self.curIntensity = intensity
@@ -138,4 +136,4 @@ class Arcade:
                     break
 
     async def react(self):
-        await self.robot.play_anim(random.choice(self.reactionDict[self.intensities[self.curIntensity]["emo"]]['emo'])).wait_for_completed();
\ No newline at end of file
+        await self.robot.play_anim(self.rng.choice(self.reactionDict[self.intensities[self.curIntensity]["emo"]]['emo'])).wait_for_completed();
\ No newline at end of file
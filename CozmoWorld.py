@@ -1,4 +1,6 @@
 import json
+import logging
+import os
 import sys
 sys.path.append('../')
 from Common.colors import Colors
@@ -6,22 +8,32 @@ from Common.colors import Colors
 sys.path.append('lib/')
 import flask_helpers
 from cozmo.util import distance_mm, speed_mmps
-from pygame import mixer
-import _thread
 import cozmo
 import math
 import random
 import asyncio
-import numpy as np
 import time
+import functools
+import threading
 from cozmo.objects import CustomObjectMarkers, CustomObjectTypes
 from Arcade import Arcade                                       # Class for the arcade game, where Cozmo plays the hammer game by himself
 from Patrol.patrol import Patrol                                # Class for Cozmo's autonomous mode
 from MerryGoRound import MerryGoRound                           # Class for reacting when Cozmo is on the carousel and also calculating how dizzy he is
 from MemCapture import MemCapture                               # Instagram integration to upload gifs from Cozmo's camera to Instagram
+from Patrol.delivery import TIMER_1, TIMER_2, TIMER_3, AUTONOMOUS_COINS    # Seconds after which a pizza cools down once, twice, and is gone, coins of an autonomous delivery
+from Proximity import ProximityEngine                           # Event driven detection of Cozmo getting near the buildings
+from PizzaStore import PizzaStore, COOLED_1, COOLED_2, GONE     # Pizzas waiting at the pizzeria and lit on the cube, with their cooling timers
+from LightCompositor import LightCompositor                     # Sends cube and backpack light changes at most once per update
+from ActionScheduler import ActionScheduler, HEAD_RESET, SPEECH, FLAVOUR, run_when_free   # Runs queued reactions by priority, waiting for each to complete
+from StatusChannel import StatusChannel                         # Pushes status changes to the tablets as server-sent events
+from Ticker import Ticker, TICK_HZ                              # Runs the game update at a fixed rate on the SDK loop
+from InputCoalescer import InputCoalescer, GAME                 # Sends only the latest wheel, lift and head commands, when they matter
+from Fleet import Fleet                                         # All the robots served by this process, and the pizza spawner they share
+from SessionRecorder import SessionRecorder, GAME_STREAM, SPAWN_STREAM     # Records the session to a log that can be replayed
+from Metrics import metrics, profiler                           # Timings and counters served at /metrics, and the sampling profiler
 
 try:
-    from flask import Flask, request, render_template
+    from flask import Flask, Response, request, render_template, g
 except ImportError:
     sys.exit("Cannot import from flask: Do `pip3 install --user flask` to install")
 
@@ -31,8 +43,12 @@ except ImportError:
     sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
 
 
+log = logging.getLogger(__name__)
 flask_app = Flask(__name__)
-remote_control_cozmo = None
+fleet = Fleet()
+recordings = None       # folder the sessions of the robots are recorded to, None to not record them
+memories = False        # whether the robots keep the last seconds of their camera and save memories to Instagram
+tick_hz = TICK_HZ       # game updates per second, the sugar rush and dizziness counts are in updates tuned at 16
 
 # Constants for buildings and building colors
 CColors = ["Green", "Red", "Blue", "Yellow", "Magenta"]
@@ -43,10 +59,9 @@ CArcade = "Arcade"
 CGarage = "Garage"
 CMerryGoRound = "MGR"
 
-TIMER_1 = 120
-TIMER_2 = 180
-TIMER_3 = 240
-pizzaSpawned = False
+
+REQUEST_TIMEOUT = 5.0   # seconds a web request waits for its call to run on the SDK event loop
+FUN_RECHECK_INTERVAL = 0.5  # seconds between checks of a fun thing while Cozmo is near it, as often as the old polling loop
 
 class CozmoWorld:
     # Animation names for different emotions. These are triggered appropriately through the experience
@@ -75,22 +90,15 @@ class CozmoWorld:
     sugar_speed = 0
     sugar_counter = -1
 
-    buildingMaps = {}       # Mapping for custom markers to buildings in the physical world
-
     coins = 0
-    lights_on = []
     turned_lights_on_this_time = False
 
-    currentLights = [None,None,None,None]
     lights = {CColors[0]: Colors.GREEN, CColors[1]: Colors.RED, CColors[2]: Colors.BLUE, CColors[3]: Colors.YELLOW, CColors[4]: Colors.MAGENTA}
     lights_1 = {CColors[0]: Colors.GREEN_1, CColors[1]: Colors.RED_1, CColors[2]: Colors.BLUE_1, CColors[3]: Colors.YELLOW_1, CColors[4]: Colors.MAGENTA_1}
     lights_2 = {CColors[0]: Colors.GREEN_2, CColors[1]: Colors.RED_2, CColors[2]: Colors.BLUE_2, CColors[3]: Colors.YELLOW_2, CColors[4]: Colors.MAGENTA_2}
 
     penalised_this_time = False         # Boolean to ensure that player is not penalised multiple times for the same pizza delivery
 
-    got_this_time = []
-    pizza_queue = []                    # Keeping an array to store all the pizzas generated but ready to be picked up
-
     # Booleans to ensure that there is enough gap between two successive fun activities
     can_have_icecream = True
     can_see_statue = True
@@ -104,7 +112,6 @@ class CozmoWorld:
     dizzy_level = 0
     update_dizzy_count = 0
 
-    arcade_light_done = -1;
 
     is_autonomous_mode = True
     is_auto_switch_on = False
@@ -120,23 +127,33 @@ class CozmoWorld:
 
     is_first_spawn = True
 
-    sad_music_stopped = False
-
-    def __init__(self, coz):
-        mixer.init()
-        self.soundHappy = mixer.Sound('static/sounds/bg.ogg')
-        self.soundSad = mixer.Sound('static/sounds/boring.ogg')
-        self.soundSad.play(loops=-1)
+    def __init__(self, coz, fleet, rng=random, recorder=None):
+        self.fleet = fleet
+        self.rng = rng                  # random of the game, its Patrol, Arcade and MerryGoRound too, recorded or replayed with the session
+        self.recorder = recorder        # SessionRecorder of this robot, None when not recording
+        if self.recorder:
+            self.recorder.attach(coz)
+        self.pizzas = PizzaStore()      # All the pizzas generated and ready to be picked up, and the pizzas lit on the cube
+        self.status = StatusChannel()   # Status pushed to the tablet of this robot
+        self.buildingMaps = {}          # Mapping for custom markers to buildings in the physical world
+        self.currentLights = [None,None,None,None]
+        self.got_this_time = []
+        self.deliveries = 0
+        self.order_state = (False, None, 0)     # (can take an order, distance to the pizzeria, load) at the last update
 
         self.cozmo = coz
+        self.light_compositor = LightCompositor(self.cozmo)
+        self.inputs = InputCoalescer(self.cozmo)
         self.arcadeGame = Arcade(self.cozmo, self)
         self.autonomousInstance = Patrol(self,self.cozmo)
         self.merrygoround = MerryGoRound(self.cozmo, self)
-        # self.instagram = MemCapture(self.cozmo,self);
+        if memories:
+            self.instagram = MemCapture(self.cozmo, self)
+            self.instagram.start_camera()
 
         self.define_custom_objects()
 
-        self.action_queue = []
+        self.actions = ActionScheduler()
 
         self.lift_up = 0
         self.lift_down = 0
@@ -144,7 +161,7 @@ class CozmoWorld:
         self.head_down = 0
 
         self.text_to_say = ""
-        self.cozmo_audio_effect_interval = random.randint(200,1000)
+        self.cozmo_audio_effect_interval = self.rng.randint(200,1000)
         self.update_count = 0
 
         self.anims_for_keys = ["bored",  # 1
@@ -159,16 +176,14 @@ class CozmoWorld:
         self.cozmo.set_lift_height(0,in_parallel=True)
         self.cozmo.set_head_angle(cozmo.util.Angle(degrees=-15),in_parallel=True).wait_for_completed()
 
-        self.visible_objects = []
-        self.measuring_dist = False
-
-        _thread.start_new_thread(self.start_Pizza_Thread, ())
+        self.proximity = ProximityEngine(self.cozmo, self)
+        self.define_proximity_zones()
 
         self.cubes = None
         try:
             self.cubes = self.cozmo.world.wait_until_observe_num_objects(1, object_type = cozmo.objects.LightCube,timeout=10)
         except asyncio.TimeoutError:
-            print("Didn't find a cube :-(")
+            log.warning("Didn't find a cube :-(")
             return
         finally:
             # for cube in self.cubes:
@@ -176,150 +191,160 @@ class CozmoWorld:
             if len(self.cubes) > 0:
                 self.cozmo.camera.image_stream_enabled = True
                 self.cubes[0].set_lights_off()
+                self.light_compositor.set_cube(self.cubes[0], lights_off=True)
                 self.cozmo.drive_straight(distance_mm(10), speed_mmps(50), in_parallel=True).wait_for_completed()
                 self.cozmo.set_head_angle(cozmo.util.Angle(degrees=30),in_parallel=True)
                 self.cozmo.world.add_event_handler(cozmo.objects.EvtObjectAppeared, self.on_object_appeared)
+                self.cozmo.world.add_event_handler(cozmo.objects.EvtObjectObserved, self.on_object_observed)
                 self.cozmo.world.add_event_handler(cozmo.objects.EvtObjectDisappeared, self.on_object_disappeared)
             else:
-                print("Not found")
+                log.warning("Not found")
 
 
     # Burp is called after eating an ice-cream
     async def burp(self):
-        anim_done = False;
-        while anim_done is False:
-            try:
-                await self.cozmo.say_text("burp", use_cozmo_voice=False, duration_scalar=0.6).wait_for_completed()
-                anim_done = True
-            except cozmo.exceptions.RobotBusy:
-                await asyncio.sleep(0.1);
-
-        anim_done = False;
-        while anim_done is False:
-            try:
-                await self.cozmo.say_text("oh, excuse me", duration_scalar=1.3).wait_for_completed()
-                anim_done = True
-            except cozmo.exceptions.RobotBusy:
-                await asyncio.sleep(0.1);
+        await run_when_free(lambda: self.cozmo.say_text("burp", use_cozmo_voice=False, duration_scalar=0.6), skip=True)
+        await run_when_free(lambda: self.cozmo.say_text("oh, excuse me", duration_scalar=1.3), skip=True)
 
         anim_name = "id_poked_giggle";
         self.play_animation(anim_name);
 
 
-    # Pizza spawning happens on another thread and it is independent of Cozmo's state
-    def start_Pizza_Thread(self):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(self.pizzaSpawning())
-
-    # async function to spawn pizzas at random intervals
-    async def pizzaSpawning(self):
-        global pizzaSpawned
-
-        rndTime = random.randint(10, 20)
-        await asyncio.sleep(rndTime)
-
+    # Called by the pizza spawner of the fleet when this robot gets the next order, rng is the seeded random
+    # of the spawner. The order is for a house with no pizza waiting at the pizzeria yet.
+    def spawn_pizza(self, rng=random):
+        if self.recorder:
+            self.recorder.spawn()
+            rng = self.recorder.random(SPAWN_STREAM, rng)
         if self.is_first_spawn:
-            if random.randint(0,1) == 0:
+            if rng.randint(0,1) == 0:
                 rndnum = 2
             else:
                 rndnum = 3
             self.is_first_spawn = False
         else:
-            rndnum = random.randint(0, 4)
-            while self.checkIfPizzaInQueue(rndnum) == True:
-                rndnum = random.randint(0, 4)
+            free = [number for number in range(len(CColors)) if not self.checkIfPizzaInQueue(number)]
+            if len(free) == 0:
+                return
+            rndnum = rng.choice(free)
+
+        if self.can_take_order():
+            log.info("PIZZA SPAWNED")
+            self.status.emit("pizza", "true")
+            self.pizzas.add_to_queue({'time':time.time(), 'pizza':rndnum})
+
+    # Whether the pizza spawner can give this robot an order now. The spawner reads order_state instead, the
+    # robot may be on another loop, and the order is checked again here when it comes
+    def can_take_order(self):
+        return self.pizzas.queue_size() < 4 and self.can_see_arcade
+
+    # Orders waiting at the pizzeria and on the cube
+    def load(self):
+        return self.pizzas.queue_size() + self.pizzas.lit_count()
+
+    # Distance (mm) to the pizzeria, measured if its marker is in view, along the track when driving
+    # autonomously, None if unknown
+    def distance_to_shop(self):
+        for obj in list(self.proximity.visible_objects):
+            if self.proximity.building_of(obj) == CShop:
+                return self.proximity.distance_to_object(obj)
+        if self.is_autonomous_mode and self.autonomousInstance:
+            return self.autonomousInstance.distanceTo("PH")
+        return None
 
-        if len(self.pizza_queue) < 4 and self.can_see_arcade:
-            print("PIZZA SPAWNED")
-            pizzaSpawned = True
-            self.pizza_queue.append({'time':time.time(), 'pizza':rndnum})
+    # Returns True if there is a pizza for that building already generated and not picked up
+    def checkIfPizzaInQueue(self, rndnum):
+        return self.pizzas.in_queue(rndnum)
+
+    # Pizzas lit on the cube, each one a dict with 'color', 'time' and 'light'
+    @property
+    def lights_on(self):
+        return self.pizzas.lit()
+
+    # Zones around the buildings, with the distance (mm) at which Cozmo reacts to them. Shop and houses
+    # are checked on every update while Cozmo is near, as pizzas can be ready or lit while he waits there.
+    # The fun things are checked again every FUN_RECHECK_INTERVAL while he is near, they react once their
+    # cooldown is over or he has the coins
+    def define_proximity_zones(self):
+        self.proximity.add_zone(CShop, self.shop_near, 700, enter_autonomous=1000, repeat=True)
+        for color in CColors:
+            self.proximity.add_zone(color, functools.partial(self.house_near, color), 700, enter_autonomous=1000, repeat=True)
+        self.proximity.add_zone(CIcecream, self.icecream_near, 700, repeat=True, interval=FUN_RECHECK_INTERVAL)
+        self.proximity.add_zone(CStatue, self.statue_near, 700, repeat=True, interval=FUN_RECHECK_INTERVAL)
+        self.proximity.add_zone(CGarage, self.garage_near, math.inf, repeat=True)
+        self.proximity.add_zone(CArcade, self.arcade_near, 800, repeat=True, interval=FUN_RECHECK_INTERVAL)
+        self.proximity.add_zone(CMerryGoRound, self.ride_near, 700, repeat=True, interval=FUN_RECHECK_INTERVAL)
+
+    # Cozmo is near the pizzeria, pizzas ready are lit up on the cube
+    async def shop_near(self, dist):
+        if self.pizzas.queue_size() == 0:
+            return
+        if self.coins > 2:
+            anim_name = self.key_code_to_anim_name(ord('6'))
+            self.play_animation(anim_name);
+            if self.rng.randint(0,1) == 0:
+                self.say_text("I want to Play");
+            else:
+                self.say_text("I don't want to work");
+
+        for pizza in self.pizzas.take_queue():
+            self.light_cube(pizza)
+        if self.autonomousInstance:
+            await self.autonomousInstance.onReactiveAnimationFinished()
+
+    # Cozmo is near the house of one of the colors
+    async def house_near(self, color, dist):
+        if self.is_color_in_lights_on(color):
+            self.got_this_time.append(color)
+            await self.correct_house_reached(color)
+        elif color not in self.got_this_time:
+            await self.incorrect_house_reached()
+
+    async def icecream_near(self, dist):
+        if not self.can_have_icecream:
+            return
+        if self.coins > 0:
+            self.can_have_icecream = False
+            await self.icecream_reached()
+        else:
+            self.not_enough_coins()
 
-        rndTime = random.randint(0,90)
-        await asyncio.sleep(rndTime)
+    async def statue_near(self, dist):
+        if not self.is_autonomous_mode and self.can_see_statue:
+            self.can_see_statue = False
+            await self.statue_reached()
 
-        await self.pizzaSpawning()
+    async def garage_near(self, dist):
+        if self.is_auto_switch_on:
+            await self.start_autonomous_mode()
 
-    # Returns True if there is a pizza for that building already generated and not picked up
-    def checkIfPizzaInQueue(self, rndnum):
-        for pizza in self.pizza_queue:
-            if (pizza['pizza'] == rndnum):
-                return True;
-        return False;
-
-    # measures the distance between a custom marker and Cozmo. If the distance is less than a threshold, Cozmo would perform his behavior
-    async def measure_distance_visible_objects(self):
-        while True:
-            for obj in self.visible_objects:
-                dist = self.robots_distance_to_object(self.cozmo, obj)
-                current_building = self.buildingMaps[obj.object_type]
-                if current_building == CShop:
-                    if (dist < 700 or (self.is_autonomous_mode and dist < 1000)):
-                        if len(self.pizza_queue) == 0:
-                            continue
-                        if self.coins > 2:
-                            anim_name = self.key_code_to_anim_name(ord('6'))
-                            self.play_animation(anim_name);
-                            if random.randint(0,1) == 0:
-                                self.say_text("I want to Play");
-                            else:
-                                self.say_text("I don't want to work");
-
-                        for pizza in self.pizza_queue:
-                            self.light_cube(pizza)
-                        self.pizza_queue = []
-                        if self.autonomousInstance:
-                            await self.autonomousInstance.onReactiveAnimationFinished()
-                elif current_building in CColors:
-                    if (dist < 700 or (self.is_autonomous_mode and dist < 1000)):
-                        if self.is_color_in_lights_on(current_building):
-                            self.got_this_time.append(current_building)
-                            await self.correct_house_reached(current_building)
-                        elif current_building not in self.got_this_time:
-                            await self.incorrect_house_reached()
-                elif current_building == CIcecream:
-                    if dist < 700 and self.can_have_icecream:
-                        if self.coins > 0:
-                            self.can_have_icecream = False
-                            asyncio.ensure_future(self.icecream_reached())
-                        else:
-                            anim_name = self.key_code_to_anim_name(ord('2'))
-                            self.try_play_anim(anim_name)
-                            self.queue_action((self.reset_head_position, 30))
-                            self.update()
-                elif current_building == CStatue and not self.is_autonomous_mode:
-                    if dist < 700 and self.can_see_statue:
-                        self.can_see_statue = False
-                        asyncio.ensure_future(self.statue_reached())
-                elif current_building == CGarage:
-                    if self.is_auto_switch_on:
-                        asyncio.ensure_future(self.start_autonomous_mode())
-                elif current_building == CArcade:
-                    if dist < 800 and self.can_see_arcade:
-                        if self.coins > 0:
-                            self.can_see_arcade = False
-                            asyncio.ensure_future(self.arcade_reached())
-                        else:
-                            anim_name = self.key_code_to_anim_name(ord('2'))
-                            self.try_play_anim(anim_name)
-                            self.queue_action((self.reset_head_position, 30))
-                            self.update()
-                elif current_building == CMerryGoRound:
-                    if dist < 700 and self.can_see_ride:
-                        if self.coins > 1:
-                            self.can_see_ride = False
-                            asyncio.ensure_future(self.ride_reached())
-                        else:
-                            anim_name = self.key_code_to_anim_name(ord('2'))
-                            self.try_play_anim(anim_name)
-                            self.queue_action((self.reset_head_position, 30))
-                            self.update()
-
-            await asyncio.sleep(0.5)
+    async def arcade_near(self, dist):
+        if not self.can_see_arcade:
+            return
+        if self.coins > 0:
+            self.can_see_arcade = False
+            await self.arcade_reached()
+        else:
+            self.not_enough_coins()
+
+    async def ride_near(self, dist):
+        if not self.can_see_ride:
+            return
+        if self.coins > 1:
+            self.can_see_ride = False
+            await self.ride_reached()
+        else:
+            self.not_enough_coins()
+
+    # Cozmo is sad when he cannot afford a fun thing
+    def not_enough_coins(self):
+        anim_name = self.key_code_to_anim_name(ord('2'))
+        self.try_play_anim(anim_name)
+        self.queue_action((self.reset_head_position, 30), HEAD_RESET)
 
     # Called from the arcade game. num is a value from 0-2 based on how hard Cozmo hit the cube
     async def arcade_light_decided(self, num):
-        self.arcade_light_done = num;
+        self.status.emit("arcade", str(num))
 
     # Called when Cozmo reaches the carousel and has enough coins
     async def ride_reached(self):
@@ -331,26 +356,22 @@ class CozmoWorld:
         self.coins -= 2
         if self.coins < 0:
             self.coins = 0
-        back_pack_lights = [None, None, None]
-        for i in range(0, self.coins):
-            if i % 2 == 0:
-                back_pack_lights[int(i / 2)] = Colors.GRAY
-            else:
-                back_pack_lights[int(i / 2)] = Colors.WHITE
-        self.cozmo.set_backpack_lights(None, back_pack_lights[0], back_pack_lights[1], back_pack_lights[2], None)
+        self.show_coins()
 
         self.is_autonomous_mode = True
         await self.cozmo.drive_wheels(0, 0, 0, 0)
 
         await self.merrygoround.start_experience()
 
-    # can be called from anywhere to click gif and upload toinstagram
-    # async def clickPicture(self):
-        # asyncio.ensure_future(self.instagram.start_program());
+    # Can be called from anywhere to save the last seconds of the camera and the next ones as a memory on
+    # Instagram, when the memories are on
+    def save_memory(self):
+        if self.instagram:
+            asyncio.ensure_future(self.instagram.save_moment())
 
     # Called from merry_go_round class when Cozmo starts spinning
     async def ride_started(self):
-        # asyncio.ensure_future(self.instagram.start_program());
+        self.save_memory()
         await asyncio.sleep(10);
         await self.ride_end()
 
@@ -368,7 +389,7 @@ class CozmoWorld:
 
     # Called when the gif is successfully uploaded to Instagram
     async def memory_captured(self):
-        print("MEMORY CAPTURED");
+        log.info("MEMORY CAPTURED")
 
     # Called when Cozmo reaches the arcade and has enough coins to play
     async def arcade_reached(self):
@@ -380,13 +401,7 @@ class CozmoWorld:
         self.coins -= 1
         if self.coins < 0:
             self.coins = 0
-        back_pack_lights = [None, None, None]
-        for i in range(0, self.coins):
-            if i % 2 == 0:
-                back_pack_lights[int(i / 2)] = Colors.GRAY
-            else:
-                back_pack_lights[int(i / 2)] = Colors.WHITE
-        self.cozmo.set_backpack_lights(None, back_pack_lights[0], back_pack_lights[1], back_pack_lights[2], None)
+        self.show_coins()
 
         self.is_autonomous_mode = True
         await self.cozmo.drive_wheels(0, 0, 0, 0)
@@ -395,8 +410,11 @@ class CozmoWorld:
 
     # Called at the end of Arcade game. User gets access to his remote control again
     async def arcadeGameEnd(self):
+        self.save_memory()
         self.is_autonomous_mode = False
         self.fun_thing_just_done = True
+        # the arcade game drove the cube lights itself
+        self.light_compositor.invalidate()
         await asyncio.sleep(10)
         self.can_see_arcade = True
         self.arcadeGame = None
@@ -405,39 +423,12 @@ class CozmoWorld:
     # Cozmo salutes to King Cozmo when he is near the statue
     async def statue_reached(self):
         self.cozmo.stop_all_motors();
-        anim_done = False;
-        while anim_done is False:
-            try:
-                await self.cozmo.play_anim(self.ting).wait_for_completed()
-                anim_done = True
-            except cozmo.exceptions.RobotBusy:
-                await asyncio.sleep(0.1);
-
-        anim_done = False;
-        while anim_done is False:
-            try:
-                await self.cozmo.set_lift_height(1.0, duration=0.2).wait_for_completed()
-                anim_done = True
-            except cozmo.exceptions.RobotBusy:
-                await asyncio.sleep(0.1);
-
-        anim_done = False;
-        while anim_done is False:
-            try:
-                await self.cozmo.say_text("oh, Cozmo", duration_scalar=2).wait_for_completed()
-                anim_done = True
-            except cozmo.exceptions.RobotBusy:
-                await asyncio.sleep(0.1);
-
-        anim_done = False;
-        while anim_done is False:
-            try:
-                await self.cozmo.set_lift_height(0.0, duration=0.2).wait_for_completed()
-                anim_done = True
-            except cozmo.exceptions.RobotBusy:
-                await asyncio.sleep(0.1);
-
-        self.queue_action((self.reset_head_position, 30))
+        await run_when_free(lambda: self.cozmo.play_anim(self.ting), skip=True)
+        await run_when_free(lambda: self.cozmo.set_lift_height(1.0, duration=0.2), skip=True)
+        await run_when_free(lambda: self.cozmo.say_text("oh, Cozmo", duration_scalar=2), skip=True)
+        await run_when_free(lambda: self.cozmo.set_lift_height(0.0, duration=0.2), skip=True)
+
+        self.queue_action((self.reset_head_position, 30), HEAD_RESET)
 
         await asyncio.sleep(60)
         self.can_see_statue = True
@@ -452,23 +443,11 @@ class CozmoWorld:
         self.coins -= 1
         if self.coins < 0:
             self.coins = 0
-        back_pack_lights = [None, None, None]
-        for i in range(0, self.coins):
-            if i % 2 == 0:
-                back_pack_lights[int(i / 2)] = Colors.GRAY
-            else:
-                back_pack_lights[int(i / 2)] = Colors.WHITE
-        self.cozmo.set_backpack_lights(None, back_pack_lights[0], back_pack_lights[1], back_pack_lights[2], None)
+        self.show_coins()
         anim_name = self.key_code_to_anim_name(ord('4'))
         self.say_text("Yummy")
-        anim_done = False;
-        while anim_done is False:
-            try:
-                await self.cozmo.play_anim(anim_name).wait_for_completed()
-                anim_done = True
-            except cozmo.exceptions.RobotBusy:
-                await asyncio.sleep(0.1);
-        if random.randint(0,10) < 4:
+        await run_when_free(lambda: self.cozmo.play_anim(anim_name), skip=True)
+        if self.rng.randint(0,10) < 4:
             self.sugar_counter = 200
             self.say_text("Sugar rush")
         else:
@@ -493,40 +472,25 @@ class CozmoWorld:
 
     # Called when a successful delivery is made
     async def correct_house_reached(self, color):
-        l_index = self.idex_of_color_in_lights_on(color)
-        light = self.lights_on[l_index];
+        self.deliveries += 1
+        light = self.pizzas.get_light(color)
         level = await self.getLevelOfLight(light['light'])
         index = self.currentLights.index(light['light'])
         self.currentLights[index] = None
-        for item in self.lights_on:
-            if item['color'] == color:
-                self.lights_on.remove(item)
-                break
+        self.pizzas.remove_light(color)
 
         add_coins = 0
         if self.is_autonomous_mode:
-            add_coins = 2
+            add_coins = AUTONOMOUS_COINS
         else:
             if level == 3:
-                anim_done = False;
-                while anim_done is False:
-                    try:
-                        await self.cozmo.play_anim(self.key_code_to_anim_name(ord('7'))).wait_for_completed()
-                        anim_done = True
-                    except cozmo.exceptions.RobotBusy:
-                        await asyncio.sleep(0.1);
-                add_coins = random.randint(0,1);
+                await run_when_free(lambda: self.cozmo.play_anim(self.key_code_to_anim_name(ord('7'))), skip=True)
+                add_coins = self.rng.randint(0,1);
             elif level == 2:
-                anim_done = False;
-                while anim_done is False:
-                    try:
-                        await self.cozmo.play_anim(self.key_code_to_anim_name(ord('7'))).wait_for_completed()
-                        anim_done = True
-                    except cozmo.exceptions.RobotBusy:
-                        await asyncio.sleep(0.1);
+                await run_when_free(lambda: self.cozmo.play_anim(self.key_code_to_anim_name(ord('7'))), skip=True)
                 add_coins = 1;
             else:
-                add_coins = random.randint(1, 2);
+                add_coins = self.rng.randint(1, 2);
 
         if add_coins == 0:
             anim_name = self.key_code_to_anim_name(ord('2'))
@@ -536,18 +500,8 @@ class CozmoWorld:
             anim_name = self.key_code_to_anim_name(ord('4'))
 
         self.coins += add_coins;
-        light_coins = self.coins;
-        if light_coins > 6:
-            light_coins = 6;
-
-        back_pack_lights = [None, None, None]
-        for i in range(0, light_coins):
-            if i%2 == 0:
-                back_pack_lights[int(i/2)] = Colors.GRAY
-            else:
-                back_pack_lights[int(i/2)] = Colors.WHITE
-        self.cozmo.set_backpack_lights(None, back_pack_lights[0], back_pack_lights[1], back_pack_lights[2], None)
-        self.cubes[0].set_light_corners(self.currentLights[0], self.currentLights[1],self.currentLights[2], self.currentLights[3])
+        self.show_coins()
+        self.light_compositor.set_corners(self.currentLights)
         self.turned_lights_on_this_time = False
 
         if self.is_autonomous_mode:
@@ -557,64 +511,56 @@ class CozmoWorld:
         else:
             self.play_animation(anim_name)
 
+    # Two coins per backpack light, gray for the first and white for the second, up to 6 coins
+    def show_coins(self):
+        back_pack_lights = [None, None, None]
+        for i in range(0, min(self.coins, 6)):
+            if i % 2 == 0:
+                back_pack_lights[int(i / 2)] = Colors.GRAY
+            else:
+                back_pack_lights[int(i / 2)] = Colors.WHITE
+        self.light_compositor.set_backpack([None, back_pack_lights[0], back_pack_lights[1], back_pack_lights[2], None])
+
     # Called when a successful delivery is made in autonomous mode
     async def play_correct_anim_autonomous(self):
-        try:
-            anim_name = 'anim_reacttoblock_success_01'
-            await self.cozmo.play_anim(name=anim_name).wait_for_completed()
-            await self.cozmo.drive_straight(distance_mm(2), speed_mmps(50)).wait_for_completed()
-        except cozmo.exceptions.RobotBusy:
-            await asyncio.sleep(0.5)
-            await self.play_correct_anim_autonomous()
+        anim_name = 'anim_reacttoblock_success_01'
+        await run_when_free(lambda: self.cozmo.play_anim(name=anim_name), skip=True)
+        await run_when_free(lambda: self.cozmo.drive_straight(distance_mm(2), speed_mmps(50)), skip=True)
 
     # Called when Cozmo reaches an incorrect building for his delivery
     async def incorrect_house_reached(self):
-        if self.penalised_this_time == True or len(self.lights_on)==0:
+        if self.penalised_this_time == True or self.pizzas.lit_count()==0:
             return
         self.penalised_this_time = True
         self.coins -= 1
         if self.coins < 0:
             self.coins = 0
-        back_pack_lights = [None, None, None]
-        for i in range(0, self.coins):
-            if i%2 == 0:
-                back_pack_lights[int(i/2)] = Colors.GRAY
-            else:
-                back_pack_lights[int(i/2)] = Colors.WHITE
-        self.cozmo.set_backpack_lights(None, back_pack_lights[0], back_pack_lights[1], back_pack_lights[2], None)
+        self.show_coins()
         anim_name = self.key_code_to_anim_name(ord('2'))
         self.play_animation(anim_name)
 
     # Called when a custom marker appears in Cozmo's field of view
     async def on_object_appeared(self, event, *, obj, **kw):
         if 'Custom' in str(type(obj)):
-            self.visible_objects.append(obj)
-        if(not self.measuring_dist):
-            self.measuring_dist = True
-            asyncio.ensure_future(self.measure_distance_visible_objects())
+            self.proximity.object_appeared(obj)
+
+    # Called every time a custom marker in view is seen again, with its updated pose
+    async def on_object_observed(self, event, *, obj, **kw):
+        self.proximity.object_observed(obj)
 
     # Called when a custom marker exits Cozmo's field of view
     async def on_object_disappeared(self, event, *, obj, **kw):
-        if obj in self.visible_objects:
-            self.visible_objects.remove(obj)
-
-    def robots_distance_to_object(self,robot, target):
-        """
-        Returns: The distance (mm) between the robot and the target object
-        """
-        object_vector = np.array((target.pose.position.x - robot.pose.position.x,
-                                  target.pose.position.y - robot.pose.position.y))
-        return math.sqrt((object_vector ** 2).sum())
+        self.proximity.object_disappeared(obj)
 
     # Called when a button is released on the remote control
-    def joystick_end(self):
+    def joystick_end(self, client=GAME):
         self.is_moving = False
         self.l_wheel_speed = 0
         self.r_wheel_speed = 0
-        self.cozmo.drive_wheels(self.l_wheel_speed, self.r_wheel_speed, self.l_wheel_speed * 4, self.r_wheel_speed * 4)
+        self.inputs.drive(self.l_wheel_speed, self.r_wheel_speed, client)
 
     # Called when movement buttons are pressed on the remote control
-    def joystick_move(self,angle,force):
+    def joystick_move(self,angle,force, client=GAME):
         if self.is_autonomous_mode:
             return
 
@@ -622,7 +568,7 @@ class CozmoWorld:
             self.checkForRideEnd = False
             self.dizzy_level = self.merrygoround.end_experience()
             # self.say_text("I am so dizzy")
-            self.queue_action((self.reset_head_position, 30))
+            self.queue_action((self.reset_head_position, 30), HEAD_RESET)
 
 
         # forward_speed = 50 + force*30
@@ -657,13 +603,16 @@ class CozmoWorld:
         if drive_dir == -1:
             self.try_play_anim(self.reverse_audio)
 
-        self.cozmo.drive_wheels(self.l_wheel_speed, self.r_wheel_speed, self.l_wheel_speed*4, self.r_wheel_speed*4)
+        self.inputs.drive(self.l_wheel_speed, self.r_wheel_speed, client)
 
     # This is to ensure that no actions are missed when Cozmo is busy performing another action
-    def queue_action(self, new_action):
-        if len(self.action_queue) > 10:
-            self.action_queue.pop(0)
-        self.action_queue.append(new_action)
+    def queue_action(self, new_action, priority=FLAVOUR, then=None):
+        self.actions.submit(new_action[0], new_action[1], priority, then=then)
+
+    # Text typed on the tablet, said at once if Cozmo is free and again whenever space is pressed
+    def text_entered(self, text):
+        self.text_to_say = text
+        return self.try_say_text(text)
 
     # Cozmo will try to say a text and will try recursively if he is busy
     def try_say_text(self, text_to_say):
@@ -691,7 +640,7 @@ class CozmoWorld:
 
     # Called when Cozmo reaches the pizzeria and pizza are ready to be lit up on the cube
     def light_cube(self,pizza,forced=False):
-        if len(self.lights_on) > 3:
+        if self.pizzas.lit_count() > 3:
             return
 
         self.turned_lights_on_this_time = True
@@ -702,35 +651,20 @@ class CozmoWorld:
         if not self.is_color_in_lights_on(color):
             for i in range(0,4):
                 if self.currentLights[i] == None:
-                    self.lights_on.append({'color': color, 'time': pizza['time'], 'light': self.lights[color]})
+                    self.pizzas.light(color, pizza['time'], self.lights[color])
                     self.currentLights[i] = self.lights[color]
                     break
         elif forced == True:
-            index = self.currentLights.index(self.lights[color])
+            index = self.currentLights.index(self.pizzas.get_light(color)['light'])
             self.currentLights[index] = None
-            for item in self.lights_on:
-                if item['color']==color:
-                    self.lights_on.remove(item)
-                    break
+            self.pizzas.remove_light(color)
 
-        self.cubes[0].set_light_corners(self.currentLights[0], self.currentLights[1],self.currentLights[2], self.currentLights[3])
-        print(self.currentLights)
+        self.light_compositor.set_corners(self.currentLights)
+        log.debug("Lights %s", self.currentLights)
 
     # Returns True if that color is already on the cube
     def is_color_in_lights_on(self,color):
-        for item in self.lights_on:
-            if item['color'] == color:
-                return True
-        return False
-
-    # Returns the index of color in the array of pizza lights on the cube
-    def idex_of_color_in_lights_on(self,color):
-        i = 0
-        for item in self.lights_on:
-            if item['color'] == color:
-                return i
-            i += 1
-        return -1
+        return self.pizzas.is_lit(color)
 
     def handle_key(self, key_code, is_key_down):
         '''Called on any key press or release
@@ -756,35 +690,73 @@ class CozmoWorld:
         key_num = key_code - ord('1')
         anim_category = self.anims_for_keys[key_num]
         category_arr = self.reactionDict[anim_category]['emo']
-        anim_name = random.choice (category_arr)
+        anim_name = self.rng.choice (category_arr)
         return anim_name
 
     # Cozmo's head needs to be at a particular angle for him to see the markers, hence after each animation this function is called to reset his head position
     def reset_head_position(self, angle):
-        try:
-            self.cozmo.set_head_angle(cozmo.util.Angle(degrees=angle))
-            return True
-        except cozmo.exceptions.RobotBusy:
-            return False
+        return self.cozmo.set_head_angle(cozmo.util.Angle(degrees=angle))
+
+    # Queued actions return the SDK action so the scheduler can wait for it, RobotBusy is retried there
+    def start_say_text(self, text_to_say):
+        return self.cozmo.say_text(text_to_say)
+
+    def start_play_anim(self, anim_name):
+        return self.cozmo.play_anim(name=anim_name)
 
     def say_text(self, text_to_say):
-        self.queue_action((self.try_say_text, text_to_say))
-        self.update()
+        self.queue_action((self.start_say_text, text_to_say), SPEECH)
 
     def play_animation(self, anim_name):
-        self.queue_action((self.try_play_anim, anim_name))
-        self.update()
-        self.queue_action((self.reset_head_position, 30))
-        self.update()
-
-    # Called every 100ms
+        # the head goes back up once the animation is over
+        self.queue_action((self.start_play_anim, anim_name), then=(self.reset_head_position, 30, HEAD_RESET))
+
+    # Starts updating the game hz times a second and running the queued actions on the event loop of the SDK
+    def start_ticking(self, loop, hz=TICK_HZ):
+        self.loop = loop
+        self.ticker = Ticker(self.tick, hz)
+        asyncio.run_coroutine_threadsafe(self.ticker.run(), loop)
+        self.actions.start(loop)
+
+    # Runs a call from a web request on the SDK event loop, next to the ticker and the event handlers, so the
+    # game state is only ever changed from that one thread. Returns the result of the call, called at once
+    # from the loop itself (the pizza spawner of the simulator shares it).
+    def call_on_loop(self, function, *args):
+        try:
+            on_loop = asyncio.get_event_loop() is self.loop and self.loop.is_running()
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            return self.call_recorded(function, *args)
+        async def call():
+            return self.call_recorded(function, *args)
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result(REQUEST_TIMEOUT)
+
+    # Calls of the requests on this world go into the recording, to be called again when it is replayed
+    def call_recorded(self, function, *args):
+        if self.recorder and getattr(function, '__self__', None) is self:
+            self.recorder.call(function.__name__, args)
+        return function(*args)
+
+    # Called for every update of the game, sends the light changes of this update once
+    def tick(self):
+        if self.recorder:
+            self.recorder.tick()
+        with metrics.span("update_seconds"):
+            self.update()
+        self.inputs.flush()
+        self.light_compositor.flush()
+        self.publish_status()
+        self.order_state = (self.can_take_order(), self.distance_to_shop(), self.load())
+
+    # Pushes mode and coins to the tablets, only sent when they changed
+    def publish_status(self):
+        self.status.set("mode", str(self.is_autonomous_mode))
+        self.status.set("coins", str(self.coins))
+
+    # Called every tick of the ticker
     def update(self):
-        '''Try and execute the next queued action'''
-        if len(self.action_queue) > 0:
-            queued_action, action_args = self.action_queue[0]
-            if queued_action(action_args):
-                self.action_queue.pop(0)
-
+        '''Advance the game by one update, queued actions run on their own in the action scheduler'''
         if not self.can_see_arcade:
             return
 
@@ -838,89 +810,71 @@ class CozmoWorld:
                     self.say_text("I want to do fun things");
 
             if self.dizzy_level != 0:
-                rmultiplier = self.dizzy_level * random.randint(-50, 50)
-                lmultiplier = self.dizzy_level * random.randint(-50, 50)
+                rmultiplier = self.dizzy_level * self.rng.randint(-50, 50)
+                lmultiplier = self.dizzy_level * self.rng.randint(-50, 50)
 
-            self.cozmo.drive_wheels(self.l_wheel_speed+rmultiplier+sugarmultiplier, self.r_wheel_speed+lmultiplier+sugarmultiplier, self.l_wheel_speed * 4, self.r_wheel_speed * 4)
+            self.inputs.drive(self.l_wheel_speed+rmultiplier+sugarmultiplier, self.r_wheel_speed+lmultiplier+sugarmultiplier,
+                              l_wheel_acc=self.l_wheel_speed * 4, r_wheel_acc=self.r_wheel_speed * 4)
 
         if not self.is_autonomous_mode:
             self.update_count += 1
             if self.update_count == self.cozmo_audio_effect_interval:
-                self.cozmo_audio_effect_interval = random.randint(200,1000)
+                self.cozmo_audio_effect_interval = self.rng.randint(200,1000)
                 self.update_count = 0
-                self.try_play_anim_trigger(self.audioEffects['idle'][random.randint(0,len(self.audioEffects['idle'])-1)])
+                self.try_play_anim_trigger(self.audioEffects['idle'][self.rng.randint(0,len(self.audioEffects['idle'])-1)])
 
         if not self.is_autonomous_mode:
-            for pizza in self.pizza_queue:
-                elapsed = time.time() - pizza['time']
-                if elapsed > TIMER_3:
-                    self.pizza_queue.remove(pizza);
-
-            for light in self.lights_on:
-                elapsed = time.time() - light['time']
-                if elapsed > TIMER_3:
-                    index = self.currentLights.index(light['light'])
+            # only the pizzas cooling down or gone since the last update
+            for light in self.pizzas.poll(time.time()):
+                index = self.currentLights.index(light['light'])
+                if light['state'] == GONE:
                     self.currentLights[index] = None
-                    for item in self.lights_on:
-                        if item['color'] == light['color']:
-                            self.lights_on.remove(item)
-                            break
-                    self.cubes[0].set_light_corners(self.currentLights[0], self.currentLights[1], self.currentLights[2], self.currentLights[3])
+                    self.light_compositor.set_corners(self.currentLights)
                     anim_name = self.pizza_gone_anim;
                     self.try_play_anim(anim_name)
-                    self.queue_action((self.reset_head_position, 30))
-                    self.update();
-                elif elapsed > TIMER_2:
-                    if light['light'] == self.lights_1[light['color']]:
-                        continue
-                    index = self.currentLights.index(light['light'])
+                    self.queue_action((self.reset_head_position, 30), HEAD_RESET)
+                    continue
+                elif light['state'] == COOLED_2:
                     light['light'] = self.lights_1[light['color']]
-                    self.currentLights[index] = self.lights_1[light['color']]
-                    self.cubes[0].set_light_corners(self.currentLights[0], self.currentLights[1], self.currentLights[2], self.currentLights[3])
-                elif elapsed > TIMER_1:
-                    if light['light'] == self.lights_2[light['color']]:
-                        continue
-                    index = self.currentLights.index(light['light'])
+                elif light['state'] == COOLED_1:
                     light['light'] = self.lights_2[light['color']]
-                    self.currentLights[index] = self.lights_2[light['color']]
-                    self.cubes[0].set_light_corners(self.currentLights[0], self.currentLights[1], self.currentLights[2], self.currentLights[3])
+                self.currentLights[index] = light['light']
+                self.light_compositor.set_corners(self.currentLights)
 
 
-    def update_lift(self, up_or_down):
+    def update_lift(self, up_or_down, client=GAME):
         if self.is_autonomous_mode:
             return
         lift_speed = 2
         lift_vel = up_or_down * lift_speed
-        self.cozmo.move_lift(lift_vel)
+        self.inputs.move_lift(lift_vel, client)
 
 
-    def update_head(self, up_or_down):
+    def update_head(self, up_or_down, client=GAME):
         head_speed = 1
         head_vel = up_or_down * head_speed
-        self.cozmo.move_head(head_vel)
+        self.inputs.move_head(head_vel, client)
 
     def modechange(self, is_autonomous):
         self.is_auto_switch_on = is_autonomous
         if not self.is_auto_switch_on:
             self.is_autonomous_mode = False
             self.autonomousInstance.disableAuto()
-            self.queue_action((self.reset_head_position, 30))
+            self.queue_action((self.reset_head_position, 30), HEAD_RESET)
         else:
-            print("mode change to Auto")
+            log.info("mode change to Auto")
             self.autonomousInstance.enableAuto()
 
-    # Stop sad music when Cozmo starts throwing tantrums for not wanting to work
+    # Stop sad music when Cozmo starts throwing tantrums for not wanting to work. The music is the city's,
+    # the first robot to stop it stops it for all of them
     async def stopSadMusic(self):
-        self.sad_music_stopped = True
-        self.soundSad.fadeout(2000)
+        if self.fleet.music:
+            self.fleet.music.stop_sad()
 
     # change music from sad music to happy music when Cozmo starts doing happy things in the city
     def changeMusic(self):
-        if self.sad_music_stopped == False:
-            self.sad_music_stopped = True
-            self.soundSad.fadeout(2000)
-
-        self.soundHappy.play(loops=-1)
+        if self.fleet.music:
+            self.fleet.music.play_happy()
 
     def define_custom_objects(self):
 
@@ -1010,129 +964,272 @@ class CozmoWorld:
                                                              100,
                                                              90, 90, True)
 @flask_app.route("/")
-def handle_index_page():
+@flask_app.route('/robot/<int:robot>/')
+def handle_index_page(robot=0):
     return render_template("index.html")
 
 @flask_app.route('/updateCozmo', methods=['POST'])
-def handle_updateCozmo():
-    '''Called very frequently from Javascript to provide an update loop'''
-    if remote_control_cozmo:
-        remote_control_cozmo.update()
+@flask_app.route('/robot/<int:robot>/updateCozmo', methods=['POST'])
+def handle_updateCozmo(robot=0):
+    '''Kept for old pages, the game is updated by the ticker on the server'''
     return ""
 
-@flask_app.route('/checkStatus', methods=['POST'])
-def handle_check_status():
-    obj = {};
-    global pizzaSpawned
-    if pizzaSpawned:
-        pizzaSpawned = False
-        obj["pizza"] = "true"
-    else:
-        obj["pizza"] = "false"
-
-    if remote_control_cozmo:
-        obj["mode"] = str(remote_control_cozmo.is_autonomous_mode)
-    else:
-        obj["mode"] = "false"
-
-    if remote_control_cozmo:
-        obj["coins"] = str(remote_control_cozmo.coins)
-    else:
-        obj["coins"] = str(0)
-
-    if remote_control_cozmo:
-        if remote_control_cozmo.arcade_light_done != -1:
-            l = remote_control_cozmo.arcade_light_done;
-            remote_control_cozmo.arcade_light_done = -1;
-            obj["arcade"] = str(l)
-        else:
-            obj["arcade"] = str(-1)
+@flask_app.route('/tickStats')
+@flask_app.route('/robot/<int:robot>/tickStats')
+def handle_tickStats(robot=0):
+    world = fleet.world(robot)
+    if world:
+        return json.dumps(world.ticker.stats())
+    return "{}"
+
+@flask_app.route('/fleetStats')
+def handle_fleetStats():
+    '''Deliveries of every robot and of the whole fleet per minute'''
+    return json.dumps(fleet.stats())
+
+@flask_app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@flask_app.after_request
+def record_request_latency(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None and request.url_rule is not None:
+        metrics.observe("http_request_seconds", time.perf_counter() - started, route=request.url_rule.rule)
+    return response
+
+@flask_app.route('/metrics')
+def handle_metrics():
+    '''Counters and timings of all the robots in the Prometheus text format'''
+    return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
+@flask_app.route('/profile')
+def handle_profile():
+    '''?on=1 starts the sampling profiler, ?on=0 stops it, the most sampled stacks so far either way'''
+    on = request.args.get('on')
+    if on == '1':
+        profiler.start()
+    elif on == '0':
+        profiler.stop()
+    return Response(profiler.report(), mimetype='text/plain')
+
+# Empty answer telling a polling tablet that the status is still at version
+def not_modified(version):
+    response = Response(status=304)
+    response.set_etag(str(version))
+    return response
+
+@flask_app.route('/checkStatus', methods=['GET', 'POST'])
+@flask_app.route('/robot/<int:robot>/checkStatus', methods=['GET', 'POST'])
+def handle_check_status(robot=0):
+    '''Status as JSON with its version. ?since=<version> waits for a change after that version, the
+       version is also the ETag. Without either, the events are the ones this client has not got yet.'''
+    world = fleet.world(robot)
+    if not world:
+        return "{}"
+    status = world.status
+    client = request.args.get('client', request.remote_addr)
+    versions = [int(tag) for tag in request.if_none_match.as_set(include_weak=True) if tag.isdigit()]
+    since = request.args.get('since', '')
+    if since.isdigit():
+        since = int(since)
+        if status.wait(since) <= since:
+            return not_modified(since)
+    elif versions:
+        version = status.version
+        if request.if_none_match.contains_weak(str(version)):
+            return not_modified(version)
+        since = max(versions)
     else:
-        obj["arcade"] = str(-1)
-
-    return str(obj);
+        since = status.cursor(client)
+
+    obj = status.payload(since, client)
+    response = Response(json.dumps(obj), mimetype='application/json')
+    response.set_etag(str(obj["version"]))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@flask_app.route('/inputStats')
+@flask_app.route('/robot/<int:robot>/inputStats')
+def handle_inputStats(robot=0):
+    '''Commands received from every tablet and how many of them were sent to Cozmo'''
+    world = fleet.world(robot)
+    if world:
+        return json.dumps(world.call_on_loop(world.inputs.stats))
+    return "{}"
+
+@flask_app.route('/status')
+@flask_app.route('/robot/<int:robot>/status')
+def handle_status(robot=0):
+    '''Server-sent events with the status changes, replaces polling /checkStatus'''
+    world = fleet.world(robot)
+    if not world:
+        return ""
+    since = request.headers.get('Last-Event-ID', request.args.get('since', '0'))
+    since = int(since) if since.isdigit() else 0
+    response = Response(world.status.stream(since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @flask_app.route('/sayText', methods=['POST'])
-def handle_sayText():
+@flask_app.route('/robot/<int:robot>/sayText', methods=['POST'])
+def handle_sayText(robot=0):
     '''Called from Javascript whenever the saytext text field is modified'''
+    world = fleet.world(robot)
     message = json.loads(request.data.decode("utf-8"))
-    if remote_control_cozmo:
-        remote_control_cozmo.text_to_say = message['textEntered']
-        remote_control_cozmo.try_say_text(remote_control_cozmo.text_to_say)
+    if world:
+        world.call_on_loop(world.text_entered, message['textEntered'])
     return ""
 
 @flask_app.route('/joystickMove', methods=['POST'])
-def handle_joystickPosition():
+@flask_app.route('/robot/<int:robot>/joystickMove', methods=['POST'])
+def handle_joystickPosition(robot=0):
     '''Called from Javascript whenever the joystick position is modified'''
+    world = fleet.world(robot)
     message = json.loads(request.data.decode("utf-8"))
-    if remote_control_cozmo:
-        remote_control_cozmo.joystick_move(message['angle'],message['force'])
+    if world:
+        world.call_on_loop(world.joystick_move, message['angle'], message['force'], request.remote_addr)
     return ""
 
 @flask_app.route('/joystickEnd', methods=['POST'])
-def handle_joystickEnd():
+@flask_app.route('/robot/<int:robot>/joystickEnd', methods=['POST'])
+def handle_joystickEnd(robot=0):
     '''Called from Javascript whenever the joystick position is modified'''
+    world = fleet.world(robot)
     message = json.loads(request.data.decode("utf-8"))
-    if remote_control_cozmo:
-        remote_control_cozmo.joystick_end()
+    if world:
+        world.call_on_loop(world.joystick_end, request.remote_addr)
     return ""
 
 @flask_app.route('/liftMove', methods=['POST'])
-def handle_liftMove():
+@flask_app.route('/robot/<int:robot>/liftMove', methods=['POST'])
+def handle_liftMove(robot=0):
     '''Called from Javascript whenever the joystick position is modified'''
+    world = fleet.world(robot)
     message = json.loads(request.data.decode("utf-8"))
-    if remote_control_cozmo:
+    if world:
         if(message['angle'] < 180):
-            remote_control_cozmo.update_lift(1)
+            world.call_on_loop(world.update_lift, 1, request.remote_addr)
         else:
-            remote_control_cozmo.update_lift(-1)
+            world.call_on_loop(world.update_lift, -1, request.remote_addr)
     return ""
 
 @flask_app.route('/liftEnd', methods=['POST'])
-def handle_liftEnd():
+@flask_app.route('/robot/<int:robot>/liftEnd', methods=['POST'])
+def handle_liftEnd(robot=0):
     '''Called from Javascript whenever the joystick position is modified'''
+    world = fleet.world(robot)
     message = json.loads(request.data.decode("utf-8"))
-    if remote_control_cozmo:
-        remote_control_cozmo.update_lift(0)
+    if world:
+        world.call_on_loop(world.update_lift, 0, request.remote_addr)
     return ""
 
 @flask_app.route('/keydown', methods=['POST'])
-def handle_keydown():
+@flask_app.route('/robot/<int:robot>/keydown', methods=['POST'])
+def handle_keydown(robot=0):
     '''Called from Javascript whenever a key is down (note: can generate repeat calls if held down)'''
-    return handle_key_event(request, is_key_down=True)
+    return handle_key_event(request, is_key_down=True, world=fleet.world(robot))
 
 @flask_app.route('/keyup', methods=['POST'])
-def handle_keyup():
+@flask_app.route('/robot/<int:robot>/keyup', methods=['POST'])
+def handle_keyup(robot=0):
     '''Called from Javascript whenever a key is down (note: can generate repeat calls if held down)'''
-    return handle_key_event(request, is_key_down=False)
+    return handle_key_event(request, is_key_down=False, world=fleet.world(robot))
 
 
+@flask_app.route('/saveMemory', methods=['POST'])
+@flask_app.route('/robot/<int:robot>/saveMemory', methods=['POST'])
+def handle_saveMemory(robot=0):
+    '''Called from the memory button, saves the last seconds of the camera and the next ones'''
+    world = fleet.world(robot)
+    if world:
+        world.call_on_loop(world.save_memory)
+    return ""
+
 @flask_app.route('/modechange', methods=['POST'])
-def handle_modechange():
+@flask_app.route('/robot/<int:robot>/modechange', methods=['POST'])
+def handle_modechange(robot=0):
+    world = fleet.world(robot)
     message = json.loads(request.data.decode("utf-8"))
-    if remote_control_cozmo:
-        remote_control_cozmo.modechange(message['isRemoteMode'])
+    if world:
+        world.call_on_loop(world.modechange, message['isRemoteMode'])
     return ""
 
-def handle_key_event(key_request, is_key_down):
+def handle_key_event(key_request, is_key_down, world):
     message = json.loads(key_request.data.decode("utf-8"))
-    if remote_control_cozmo:
-        remote_control_cozmo.handle_key(key_code=(message['keyCode']), is_key_down=is_key_down)
+    if world:
+        world.call_on_loop(world.handle_key, message['keyCode'], is_key_down)
     return ""
 
-def run(sdk_conn):
+# Adds the robot of this connection to the fleet, its tablet page is /robot/<number>/
+def join_fleet(sdk_conn):
     robot = sdk_conn.wait_for_robot()
 
-    global remote_control_cozmo
-    remote_control_cozmo = CozmoWorld(robot)
+    recorder = None
+    rng = random
+    if recordings:
+        recorder = SessionRecorder(os.path.join(recordings, "%s-robot-%s.czlog" % (time.strftime("%Y%m%d-%H%M%S"), robot.robot_id)))
+        # a random of its own, so the draws of this robot do not depend on the other robots of the fleet
+        rng = recorder.random(GAME_STREAM, random.Random())
+    world = CozmoWorld(robot, fleet, rng, recorder)
+    world.start_ticking(robot.loop, tick_hz)
+    number = fleet.add(world)
+    metrics.gauge("action_queue_depth", world.actions.depth, "Reactions waiting to run", robot=number)
+    metrics.gauge("tick_overruns", lambda: world.ticker.overruns, "Game updates that took longer than a period", robot=number)
+    if world.instagram:
+        metrics.gauge("preroll_bytes", lambda: world.instagram.preroll.bytes, "Bytes of camera frames kept for memories", robot=number)
+    log.info("Robot %d ready", number)
+    return world
+
+# Robot that serves the web pages, the first one to connect
+def run(sdk_conn):
+    fleet.start_music()
+    world = join_fleet(sdk_conn)
+    fleet.start_spawning(world.loop)
 
     flask_helpers.run_flask(flask_app)
+    fleet.closed.set()
+
+# Any other robot, keeps its connection open as long as the server runs
+def run_fleet_member(sdk_conn):
+    join_fleet(sdk_conn)
+    fleet.closed.wait()
+
+# Connector for a serial number given on the command line, ios:<serial> for an iPhone or iPad
+def connector_for(serial):
+    if serial.startswith("ios:"):
+        return cozmo.run.IOSConnector(serial=serial[4:])
+    return cozmo.run.AndroidConnector(serial=serial)
 
 if __name__ == '__main__':
     cozmo.setup_basic_logging()
     cozmo.robot.Robot.drive_off_charger_on_connect = True  # RC can drive off charger if required
+    # python CozmoWorld.py [--record=folder] [--memories] [--hz=updates per second] [--log=debug|info|warning]
+    # [serial ...], one serial per device for several robots in the same city
+    serials = sys.argv[1:]
+    log_level = "info"
+    while serials and serials[0].startswith("--"):
+        option, _, value = serials.pop(0).partition("=")
+        if option == "--record":
+            recordings = value
+            os.makedirs(recordings, exist_ok=True)
+        elif option == "--memories":
+            memories = True
+        elif option == "--hz":
+            tick_hz = float(value)
+        elif option == "--log":
+            log_level = value
+    logging.basicConfig(level=log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     try:
         # cozmo.connect_with_tkviewer(run)
-        cozmo.connect(run)
+        for serial in serials[1:]:
+            thread = threading.Thread(target=cozmo.connect, args=(run_fleet_member,), kwargs={'connector': connector_for(serial)})
+            thread.daemon = True
+            thread.start()
+        if serials:
+            cozmo.connect(run, connector=connector_for(serials[0]))
+        else:
+            cozmo.connect(run)
     except cozmo.ConnectionError as e:
         sys.exit("A connection error occurred: %s" % e)
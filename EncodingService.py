@@ -0,0 +1,237 @@
+import asyncio
+import concurrent.futures
+import io
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("Cannot import numpy: Do `pip3 install --user numpy` to install")
+
+try:
+    from PIL import Image
+except ImportError:
+    sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None    # before Python 3.8 the frames are pickled to the encoder instead
+
+from FrameRing import FrameRing, VideoStream
+from GifExport import write_animation
+from Filters import write_filtered
+
+'''
+@class EncodingService
+Encodes the memories of MemCapture (video, GIF, thumbnail and the GIFs of the filters) in a process pool,
+away from the event loop of the SDK, so wheel commands, marker events and the game update go on while a
+memory is encoded. The frames of a memory are taken into a Clip, a block of shared memory the encoder
+process reads in place; encode() returns a future the game awaits. The JPEG frames of the PreRoll are sent
+as they are and decoded there.
+@author - Wizards of Coz
+'''
+
+ENCODE_WORKERS = 1          # processes encoding, one memory at a time is captured
+
+# Frames of one memory, in shared memory when there is some
+class Clip:
+    def __init__(self, capacity, frame_shape):
+        self.shape = (capacity,) + tuple(frame_shape)
+        size = int(np.prod(self.shape))
+        if shared_memory is not None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            self.frames = np.ndarray(self.shape, dtype=np.uint8, buffer=self.memory.buf)
+        else:
+            self.memory = None
+            self.frames = np.empty(self.shape, dtype=np.uint8)
+        self.count = 0
+
+    def add(self, frame):
+        if self.count < len(self.frames):
+            self.frames[self.count] = frame
+            self.count += 1
+
+    # what the encoder process needs to find the frames
+    def handle(self):
+        if self.memory is not None:
+            return self.memory.name, self.shape, self.count, None
+        return None, self.shape, self.count, self.frames[:self.count]
+
+    def close(self):
+        self.frames = None
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+# Runs in the encoder process. outputs: {'video', 'gif', 'thumbnail', 'filters'} -> path (a folder for the
+# filtered GIFs), the ones to write. Returns the seconds each output took
+def encode_clip(name, shape, count, frames, outputs):
+    memory = None
+    if name is not None:
+        memory = shared_memory.SharedMemory(name=name)
+        frames = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)[:count]
+    try:
+        return write_outputs(frames, outputs)
+    finally:
+        frames = None
+        if memory is not None:
+            memory.close()
+
+# Runs in the encoder process, the same for JPEG frames
+def encode_compressed(jpegs, outputs):
+    start = time.perf_counter()
+    frames = np.stack([np.asarray(Image.open(io.BytesIO(data)).convert('RGB')) for data in jpegs])
+    timings = write_outputs(frames, outputs)
+    timings['decode'] = time.perf_counter() - start - sum(timings.values())
+    return timings
+
+def write_outputs(frames, outputs):
+    timings = {}
+    if outputs.get('video'):
+        start = time.perf_counter()
+        video = VideoStream(outputs['video'])
+        for frame in frames:
+            video.write(frame)
+        video.release()
+        timings['video'] = time.perf_counter() - start
+    if outputs.get('gif'):
+        start = time.perf_counter()
+        write_animation(frames, outputs['gif'])
+        timings['gif'] = time.perf_counter() - start
+    if outputs.get('thumbnail'):
+        start = time.perf_counter()
+        Image.fromarray(frames[-1]).convert('L').save(outputs['thumbnail'])
+        timings['thumbnail'] = time.perf_counter() - start
+    if outputs.get('filters'):
+        start = time.perf_counter()
+        write_filtered(frames, outputs['filters'])
+        timings['filters'] = time.perf_counter() - start
+    return timings
+
+class EncodingService:
+    def __init__(self, workers=ENCODE_WORKERS):
+        self.workers = workers
+        self.pool = None
+
+    # Starts the encoder processes now rather than with the first memory
+    def start(self):
+        if self.pool is None:
+            if shared_memory is not None:
+                # the encoders share the resource tracker of the game if it runs before they start, otherwise
+                # theirs would unlink the clips the game owns when they exit
+                resource_tracker.ensure_running()
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            self.pool.submit(time.time)
+
+    def clip(self, capacity, frame_shape):
+        return Clip(capacity, frame_shape)
+
+    # Encodes a clip into the outputs given, returns an asyncio future of the timings. The clip is freed
+    # once it is encoded, until then the caller frees it if it does not get this far. free=False keeps it to
+    # encode other outputs from it later
+    def encode(self, clip, video=None, gif=None, thumbnail=None, filters=None, loop=None, free=True):
+        self.start()
+        loop = loop or asyncio.get_event_loop()
+        outputs = {'video': video, 'gif': gif, 'thumbnail': thumbnail, 'filters': filters}
+        future = loop.run_in_executor(self.pool, encode_clip, *clip.handle(), outputs)
+        if free:
+            future.add_done_callback(lambda _: clip.close())
+        return future
+
+    # Encodes JPEG frames (a snapshot of the PreRoll) into the outputs given, returns an asyncio future of the
+    # timings
+    def encode_jpegs(self, jpegs, video=None, gif=None, thumbnail=None, filters=None, loop=None):
+        self.start()
+        loop = loop or asyncio.get_event_loop()
+        outputs = {'video': video, 'gif': gif, 'thumbnail': thumbnail, 'filters': filters}
+        return loop.run_in_executor(self.pool, encode_compressed, list(jpegs), outputs)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+# How long the event loop stalls while a memory is captured, as MemCapture did before (every frame written
+# into the video on the loop, then the thumbnail), and with the encoding service writing the video, GIF and
+# thumbnail of MemCapture now. A probe coroutine measures how late its short sleeps wake up meanwhile.
+PROBE_INTERVAL = 0.005
+
+async def probe(stalls, done):
+    loop = asyncio.get_event_loop()
+    while not done.is_set():
+        start = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        stalls.append(loop.time() - start - PROBE_INTERVAL)
+
+async def capture(camera, frames, interval, folder, service):
+    ring = FrameRing()
+    outputs = {name: os.path.join(folder, name + ext) for name, ext in (('video', '.avi'), ('gif', '.gif'), ('thumbnail', '.jpg'))}
+    ring.push(camera[0])
+    if service is None:
+        video = VideoStream(outputs['video'])
+        for i in range(frames):
+            ring.push(camera[i % len(camera)])
+            video.write(ring.latest())
+            await asyncio.sleep(interval)
+        video.release()
+        Image.fromarray(ring.latest()).convert('L').save(outputs['thumbnail'])
+    else:
+        clip = service.clip(frames, ring.latest().shape)
+        encoding = None
+        try:
+            read = ring.count - 1
+            for i in range(frames):
+                ring.push(camera[i % len(camera)])
+                taken, read = ring.since(read)
+                for frame in taken:
+                    clip.add(frame)
+                await asyncio.sleep(interval)
+            encoding = service.encode(clip, **outputs)
+        finally:
+            if encoding is None:
+                clip.close()
+        await encoding
+
+# camera-like frames, a moving gradient with sensor noise
+def test_frames(count=8, shape=(240, 320)):
+    rng = np.random.RandomState(0)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]]
+    frames = []
+    for i in range(count):
+        base = np.stack(((x + 8 * i) % 256, (y + 4 * i) % 256, (x + y) // 3 % 256), axis=-1)
+        frames.append(Image.fromarray(np.clip(base + rng.randint(-6, 7, base.shape), 0, 255).astype(np.uint8)))
+    return frames
+
+def benchmark(frames=60, interval=0.02, folder="bench_encoding"):
+    camera = test_frames()
+    os.makedirs(folder, exist_ok=True)
+    service = EncodingService()
+    service.start()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for name, encoder in (("before", None), ("service", service)):
+        stalls = []
+        done = asyncio.Event()
+        async def run():
+            prober = asyncio.ensure_future(probe(stalls, done))
+            start = loop.time()
+            await capture(camera, frames, interval, folder, encoder)
+            done.set()
+            await prober
+            return loop.time() - start
+        elapsed = loop.run_until_complete(run())
+        stalls.sort()
+        print("%-12s capture to files %6.1f ms, loop stalls: max %6.1f ms, 99%% %6.1f ms, total %7.1f ms"
+              % (name, elapsed * 1000, stalls[-1] * 1000, stalls[int(len(stalls) * 0.99)] * 1000, sum(stalls) * 1000))
+    loop.close()
+    service.shutdown()
+    for name in os.listdir(folder):
+        os.remove(os.path.join(folder, name))
+    os.rmdir(folder)
+
+if __name__ == '__main__':
+    benchmark()
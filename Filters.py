@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("Cannot import numpy: Do `pip3 install --user numpy` to install")
+
+try:
+    from PIL import Image
+except ImportError:
+    sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
+
+from GifExport import scale, write_animation
+
+'''
+@class FilterEngine
+The 14 photo filters of MemCapture, applied to whole stacks of frames with NumPy. A filter is a saturation,
+a colour grade (contrast, a curve and a black and white level per channel, and posterizing), a vignette and
+a grain. Everything but the saturation is one lookup table per filter, cached: by channel, ring of the
+vignette, level of the grain and value, the value on screen. The rings and grain levels of the pixels of a
+frame are the same for every filter and cached by frame size, so a filter costs one addition and one
+lookup per value. apply() makes all 14 variants of a clip in one pass over its frames: a frame at a time,
+the luma of the frame is computed once and every filter is applied to them while they are still
+in the cache, rather than 14 passes of PIL over the whole clip.
+
+The filters run on one core, in the encoder process. Spreading the frames over more processes is not worth
+it: for the 60 frame test clip write_filtered takes 1.9 s, of which filtering is 0.24 s and writing the 14
+GIFs 1.65 s, so even free filtering would save an eighth of it, and the GIFs are written after the upload.
+@author - Wizards of Coz
+'''
+
+FILTER_SIZE = (160, 120)    # width, height of the filtered GIFs written with a memory
+CHUNK_FRAMES = 1            # frames taken through all the filters together, one frame of 16 bit values fits the cache
+
+# name: saturation, contrast, gamma (r, g, b), black level (r, g, b), white level (r, g, b), posterize levels
+# (0 for none), vignette strength, grain strength (0-255)
+FILTERS = {
+    "warm":      (1.1, 1.05, (0.95, 1.0, 1.1), (8, 4, 0), (255, 240, 215), 0, 0.3, 0),
+    "cool":      (0.95, 1.05, (1.1, 1.0, 0.92), (0, 4, 10), (225, 245, 255), 0, 0.3, 0),
+    "vintage":   (0.7, 0.9, (0.95, 1.0, 1.15), (40, 30, 20), (240, 230, 200), 0, 0.5, 10),
+    "noir":      (0.0, 1.4, (1.0, 1.0, 1.0), (0, 0, 0), (255, 255, 255), 0, 0.6, 14),
+    "sepia":     (0.0, 1.0, (0.9, 1.0, 1.2), (30, 15, 0), (255, 230, 190), 0, 0.4, 6),
+    "faded":     (0.75, 0.8, (1.0, 1.0, 1.0), (45, 45, 50), (235, 235, 235), 0, 0.0, 0),
+    "vivid":     (1.6, 1.2, (1.0, 1.0, 1.0), (0, 0, 0), (255, 255, 255), 0, 0.2, 0),
+    "pop":       (1.5, 1.1, (1.0, 1.0, 1.0), (0, 0, 0), (255, 255, 255), 4, 0.0, 0),
+    "dusk":      (0.9, 1.1, (0.85, 1.05, 1.0), (20, 0, 30), (255, 200, 220), 0, 0.5, 0),
+    "mint":      (0.85, 1.0, (1.1, 0.9, 1.0), (0, 20, 10), (230, 255, 240), 0, 0.2, 0),
+    "rose":      (0.9, 1.0, (0.9, 1.05, 1.0), (25, 5, 15), (255, 225, 235), 0, 0.2, 0),
+    "grainy":    (0.8, 1.15, (1.0, 1.0, 1.0), (10, 10, 10), (250, 250, 250), 0, 0.3, 24),
+    "comic":     (1.3, 1.3, (1.0, 1.0, 1.0), (0, 0, 0), (255, 255, 255), 3, 0.4, 0),
+    "dream":     (1.2, 0.85, (0.9, 0.9, 0.85), (30, 20, 40), (255, 250, 255), 0, 0.7, 4),
+}
+
+LUMA = (77, 150, 29)        # weights of r, g, b in the luma, out of 256
+SATURATION_BITS = 6         # the saturation is applied in fixed point, in 64ths
+VIGNETTE_RINGS = 16         # rings of the vignette, of the same squared distance from the centre
+GRAIN_LEVELS = 4            # values the grain takes, between -2 and 2 deviations. Tables of 3 x rings x
+                            # levels x 256 values are indexed with 16 bits
+GRAIN_SEED = 7              # the grain is the same pattern for every memory
+
+class FilterEngine:
+    def __init__(self, filters=FILTERS):
+        self.filters = filters
+        self.tables = {}        # name -> (3, rings, grain levels, 256) uint8, flattened
+        self.zones = {}         # (height, width) -> (height, width, 3) uint16, offset of each value in a table
+
+    # Colour grade of a filter for every value of every channel, (3, 256) floats
+    def grade(self, name):
+        saturation, contrast, gamma, black, white, levels, vignette, grain = self.filters[name]
+        x = np.arange(256, dtype=np.float64) / 255.0
+        x = np.clip((x - 0.5) * contrast + 0.5, 0.0, 1.0)
+        curves = np.empty((3, 256))
+        for channel in range(3):
+            y = x ** gamma[channel]
+            if levels:
+                y = np.round(y * (levels - 1)) / (levels - 1)
+            curves[channel] = black[channel] + y * (white[channel] - black[channel])
+        return curves
+
+    # Value on screen of a filter, by channel, vignette ring, grain level and value after the saturation
+    def table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            vignette, grain = self.filters[name][6:8]
+            rings = (np.arange(VIGNETTE_RINGS) + 0.5) / VIGNETTE_RINGS
+            gain = 1.0 - vignette * rings
+            noise = (np.arange(GRAIN_LEVELS) + 0.5) * 4.0 / GRAIN_LEVELS - 2.0
+            noise *= grain / 2.0
+            values = self.grade(name)[:, None, None, :] * gain[None, :, None, None] + noise[None, None, :, None]
+            table = np.clip(np.round(values), 0, 255).astype(np.uint8).ravel()
+            self.tables[name] = table
+        return table
+
+    # Where the values of the pixels of a frame are in a table: their channel, vignette ring and grain level
+    def zone(self, height, width):
+        zone = self.zones.get((height, width))
+        if zone is None:
+            y, x = np.ogrid[-1.0:1.0:height * 1j, -1.0:1.0:width * 1j]
+            ring = np.minimum(((x * x + y * y) / 2.0 * VIGNETTE_RINGS).astype(np.int32), VIGNETTE_RINGS - 1)
+            noise = np.random.RandomState(GRAIN_SEED).normal(0.0, 1.0, (height, width))
+            level = np.clip(((noise + 2.0) / 4.0 * GRAIN_LEVELS).astype(np.int32), 0, GRAIN_LEVELS - 1)
+            cells = ring * GRAIN_LEVELS + level
+            channels = np.arange(3, dtype=np.int32) * VIGNETTE_RINGS * GRAIN_LEVELS
+            zone = ((cells[:, :, None] + channels) * 256).astype(np.uint16)
+            self.zones[(height, width)] = zone
+        return zone
+
+    # Variants of the frames (n, height, width, 3) by every filter, name -> (n, height, width, 3)
+    def apply(self, frames, names=None):
+        names = list(names or self.filters)
+        out = np.empty((len(names),) + frames.shape, dtype=np.uint8)
+        self.apply_into(frames, out, names)
+        return dict(zip(names, out))
+
+    # The same into out, (len(names), n, height, width, 3). The saturation is c * s + luma * (1 - s) in 16 bit
+    # fixed point, the value it gives is turned into the index of the table in place
+    def apply_into(self, frames, out, names):
+        zone = self.zone(*frames.shape[1:3])
+        one = 1 << SATURATION_BITS
+        for start in range(0, len(frames), CHUNK_FRAMES):
+            chunk = frames[start:start + CHUNK_FRAMES]
+            # shared by the filters
+            wide = chunk.astype(np.int16)
+            # from 16 bit values, NumPy before 2.0 keeps uint8 * a uint16 scalar in 8 bits and overflows
+            unsigned = wide.view(np.uint16)
+            luma = ((unsigned[..., 0] * np.uint16(LUMA[0]) + unsigned[..., 1] * np.uint16(LUMA[1]) +
+                     unsigned[..., 2] * np.uint16(LUMA[2])) >> 8).astype(np.int16)[..., None]
+            for number, name in enumerate(names):
+                s = int(round(self.filters[name][0] * one))
+                if s == one:
+                    index = wide.view(np.uint16) + zone
+                elif s == 0:
+                    index = luma.view(np.uint16) + zone
+                else:
+                    index = wide * np.int16(s)
+                    index += luma * np.int16(one - s)
+                    index >>= SATURATION_BITS
+                    np.clip(index, 0, 255, out=index)
+                    index = index.view(np.uint16)
+                    index += zone
+                np.take(self.table(name), index, out=out[number, start:start + CHUNK_FRAMES], mode='clip')
+        return out
+
+engine = None               # FilterEngine of this process, its tables built once
+
+def process_engine():
+    global engine
+    if engine is None:
+        engine = FilterEngine()
+    return engine
+
+# Writes a GIF of the memory by every filter into the folder, at size
+def write_filtered(frames, folder, size=FILTER_SIZE):
+    os.makedirs(folder, exist_ok=True)
+    variants = process_engine().apply(scale(np.asarray(frames), size))
+    for name, variant in variants.items():
+        write_animation(variant, os.path.join(folder, name + ".gif"), size=size)
+    return len(variants)
+
+# A filter the way PIL would apply it to one frame, for the benchmark: saturation, the grade, the vignette and
+# the grain, each a pass over the image
+def pil_filter(image, name, engine, vignette, grain):
+    from PIL import ImageChops, ImageEnhance
+    saturation = engine.filters[name][0]
+    image = ImageEnhance.Color(image).enhance(saturation)
+    image = image.point(np.clip(np.round(engine.grade(name)), 0, 255).astype(np.uint8).ravel().tolist())
+    if engine.filters[name][6]:
+        image = ImageChops.multiply(image, vignette[name])
+    if engine.filters[name][7]:
+        image = ImageChops.add(image, grain[name], 1.0, -128)
+    return image
+
+# Seconds of the fastest of a few runs
+def best_of(function, runs=3):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# Frames a second of a memory made into all 14 variants: by PIL a filter at a time and by the engine
+def benchmark(size=(320, 240)):
+    from GifExport import test_clip
+    clip = scale(test_clip(), size)
+    engine = FilterEngine()
+    height, width = clip.shape[1:3]
+    y, x = np.ogrid[-1.0:1.0:height * 1j, -1.0:1.0:width * 1j]
+    vignette = {}
+    grain = {}
+    for name, settings in FILTERS.items():
+        gain = np.clip(255 * (1.0 - settings[6] * (x * x + y * y) / 2.0), 0, 255).astype(np.uint8)
+        vignette[name] = Image.fromarray(np.repeat(gain[:, :, None], 3, axis=2))
+        noise = np.random.RandomState(GRAIN_SEED).normal(128, settings[7] / 2.0 + 1e-9, (height, width, 1))
+        grain[name] = Image.fromarray(np.repeat(np.clip(noise, 0, 255).astype(np.uint8), 3, axis=2))
+
+    images = [Image.fromarray(frame) for frame in clip]
+    pil = len(clip) / best_of(lambda: [pil_filter(image, name, engine, vignette, grain)
+                                       for name in FILTERS for image in images])
+
+    engine.apply(clip[:CHUNK_FRAMES])       # tables built before timing
+    single = len(clip) / best_of(lambda: engine.apply(clip))
+
+    print("%dx%d, %d frames, all %d filters:" % (width, height, len(clip), len(FILTERS)))
+    print("  PIL, a filter at a time   %6.1f fps (%6.0f filtered frames/s)" % (pil, pil * len(FILTERS)))
+    print("  engine                    %6.1f fps (%6.0f filtered frames/s), %.1fx" % (single, single * len(FILTERS), single / pil))
+
+if __name__ == '__main__':
+    benchmark()
+    benchmark(FILTER_SIZE)
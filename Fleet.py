@@ -0,0 +1,97 @@
+import math
+import threading
+import time
+from pygame import mixer
+from SpawnScheduler import SpawnScheduler
+
+'''
+@class Fleet
+All the Cozmos playing in the same city from one server. Every robot has its own CozmoWorld (cube, coins,
+pizzas on the cube, tablet), and the fleet has what the city has once: the pizza spawner and the music.
+Each new order goes to the robot that can take it and is nearest to the pizzeria, the least loaded one
+when the distances tie or are unknown. The spawner reads what every robot published at its last game
+update, never the game state of a robot on another loop.
+@author - Wizards of Coz
+'''
+
+# Music of the city, the sad loop until a Cozmo does something fun, then the happy one
+class Music:
+    def __init__(self):
+        self.lock = threading.Lock()
+        mixer.init()
+        self.happy = mixer.Sound('static/sounds/bg.ogg')
+        self.sad = mixer.Sound('static/sounds/boring.ogg')
+        self.sad_stopped = False
+        self.happy_playing = False
+        self.sad.play(loops=-1)
+
+    def stop_sad(self):
+        with self.lock:
+            if not self.sad_stopped:
+                self.sad_stopped = True
+                self.sad.fadeout(2000)
+
+    def play_happy(self):
+        self.stop_sad()
+        with self.lock:
+            if not self.happy_playing:
+                self.happy_playing = True
+                self.happy.play(loops=-1)
+
+class Fleet:
+    def __init__(self, arrivals=None, seed=None):
+        self.worlds = []                    # CozmoWorld of every robot, the index is the robot number
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.closed = threading.Event()     # set when the server stops, the robots disconnect then
+        self.spawner = SpawnScheduler(self, arrivals, seed)
+        self.music = None                   # Music of the city, None when there is none (the simulator)
+
+    # Starts the music of the city, once for all the robots
+    def start_music(self):
+        if self.music is None:
+            self.music = Music()
+
+    def add(self, world):
+        with self.lock:
+            self.worlds.append(world)
+            return len(self.worlds) - 1
+
+    # CozmoWorld of a robot number, None if there is no such robot (yet)
+    def world(self, robot=0):
+        with self.lock:
+            if 0 <= robot < len(self.worlds):
+                return self.worlds[robot]
+        return None
+
+    # Robot that gets the next order, None if none of them can take one now
+    def dispatch(self):
+        with self.lock:
+            worlds = list(self.worlds)
+        best = None
+        best_key = None
+        for world in worlds:
+            can_take, distance, load = world.order_state
+            if not can_take:
+                continue
+            key = (distance if distance is not None else math.inf, load)
+            if best is None or key < best_key:
+                best, best_key = world, key
+        return best
+
+    # Pizza spawning runs on the loop of the game, the orders of other robots are handed to their loops
+    def start_spawning(self, loop):
+        self.spawner.start(loop)
+
+    def deliveries_per_minute(self):
+        with self.lock:
+            deliveries = sum(world.deliveries for world in self.worlds)
+        return deliveries / (time.time() - self.started) * 60
+
+    def stats(self):
+        with self.lock:
+            worlds = list(self.worlds)
+        return {'robots': len(worlds),
+                'deliveries': [world.deliveries for world in worlds],
+                'deliveries_per_minute': self.deliveries_per_minute(),
+                'spawning': self.spawner.stats()}
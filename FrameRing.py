@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("Cannot import numpy: Do `pip3 install --user numpy` to install")
+
+from cv2 import VideoWriter, VideoWriter_fourcc, imread, resize
+
+'''
+@class FrameRing
+The last frames of Cozmo's camera, kept as raw RGB arrays in one block of memory allocated with the first
+frame, so taking a frame from an EvtNewRawCameraImage handler is one copy into the next slot and nothing is
+encoded or written on the event loop. A reader that comes by now and then (the capture of a memory) takes
+every frame pushed since it last read, as long as it comes before the ring wraps around. VideoStream writes
+frames straight into the video encoder, instead of saving JPEGs and reading them back before encoding.
+@author - Wizards of Coz
+'''
+
+RING_FRAMES = 32            # frames kept, about two seconds of the camera
+VIDEO_SIZE = (320, 240)     # width, height of the video uploaded
+VIDEO_FPS = 24.0
+
+class FrameRing:
+    def __init__(self, capacity=RING_FRAMES):
+        self.capacity = capacity
+        self.frames = None                  # (capacity, height, width, 3) uint8, allocated with the first frame
+        self.times = [0.0] * capacity
+        self.count = 0                      # frames pushed so far, the newest is in slot (count - 1) % capacity
+        self.missed = 0                     # frames overwritten before a reader took them
+
+    # Copies a camera image (PIL image or array) into the next slot
+    def push(self, image, timestamp=None):
+        array = np.asarray(image)
+        if self.frames is None or self.frames.shape[1:] != array.shape:
+            self.frames = np.empty((self.capacity,) + array.shape, dtype=np.uint8)
+            self.count = 0
+        slot = self.count % self.capacity
+        self.frames[slot] = array
+        self.times[slot] = time.monotonic() if timestamp is None else timestamp
+        self.count += 1
+
+    # Newest frame, a view that the next pushes overwrite, None before the first frame
+    def latest(self):
+        if self.count == 0:
+            return None
+        return self.frames[(self.count - 1) % self.capacity]
+
+    # Frames pushed since the reader had read count of them, oldest first, and the count to read from next.
+    # The frames are views that later pushes overwrite
+    def since(self, count):
+        if count > self.count:
+            # the frame size changed and the ring started again
+            count = 0
+        first = max(count, self.count - self.capacity)
+        self.missed += first - count
+        return [self.frames[i % self.capacity] for i in range(first, self.count)], self.count
+
+class VideoStream:
+    def __init__(self, path, size=VIDEO_SIZE, fps=VIDEO_FPS):
+        self.size = size
+        self.writer = VideoWriter(path, VideoWriter_fourcc(*'XVID'), float(fps), size, True)
+        self.frames = 0
+
+    # Encodes an RGB frame, scaled to the size of the video if needed
+    def write(self, frame):
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = resize(frame, self.size)
+        # the encoder takes BGR
+        self.writer.write(np.ascontiguousarray(frame[:, :, ::-1]))
+        self.frames += 1
+
+    def release(self):
+        self.writer.release()
+
+# Time of the old pipeline (a JPEG saved per frame, read back and encoded) and of the stream, for the 60
+# frames of a memory
+def benchmark(frames=60, folder="bench_frames"):
+    from PIL import Image
+
+    rng = np.random.RandomState(0)
+    camera = [Image.fromarray(rng.randint(0, 255, (240, 320, 3), dtype=np.uint8)) for _ in range(8)]
+
+    os.makedirs(folder, exist_ok=True)
+    start = time.perf_counter()
+    longest_save = 0.0
+    for i in range(frames):
+        save_start = time.perf_counter()
+        camera[i % len(camera)].save(os.path.join(folder, "image%d.jpg" % i))
+        longest_save = max(longest_save, time.perf_counter() - save_start)
+    stream = VideoStream(os.path.join(folder, "old.avi"))
+    for i in range(frames):
+        stream.writer.write(imread(os.path.join(folder, "image%d.jpg" % i)))
+    stream.release()
+    old = time.perf_counter() - start
+    written = sum(os.path.getsize(os.path.join(folder, "image%d.jpg" % i)) for i in range(frames))
+
+    # the camera pushes 15 frames a second and the capture reads every 100 ms, as on the robot
+    ring = FrameRing()
+    start = time.perf_counter()
+    longest_take = 0.0
+    stream = VideoStream(os.path.join(folder, "new.avi"))
+    read = 0
+    for i in range(frames):
+        take_start = time.perf_counter()
+        ring.push(camera[i % len(camera)])
+        longest_take = max(longest_take, time.perf_counter() - take_start)
+        if i % 3 == 2 or i == frames - 1:
+            taken, read = ring.since(read)
+            for frame in taken:
+                stream.write(frame)
+    stream.release()
+    new = time.perf_counter() - start
+
+    for name in os.listdir(folder):
+        os.remove(os.path.join(folder, name))
+    os.rmdir(folder)
+    print("JPEG files:   %.1f ms to a video, longest frame %.1f ms, %d KB of frames written and read"
+          % (old * 1000, longest_save * 1000, written // 1024))
+    print("ring, stream: %.1f ms to a video, longest frame %.1f ms, %d of %d frames encoded, no frame files"
+          % (new * 1000, longest_take * 1000, stream.frames, frames))
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("Cannot import numpy: Do `pip3 install --user numpy` to install")
+
+try:
+    from PIL import Image
+except ImportError:
+    sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
+
+'''
+@class GifExport
+Animated GIF (or WebP, by the extension of the path) of the frames of a memory. The frames are scaled to
+the size asked for as one array, frames that barely differ from the last one kept are dropped and the one
+kept is shown for longer, and the whole clip is quantized against one adaptive palette computed once from
+a sample of its pixels. Every pixel of the clip is mapped to the palette at once through a lookup table of
+the colours the clip has. The GIF has a single colour table, and the pixels of a frame still close to what
+is already on screen are left transparent, so the noise of the camera does not make every frame a full
+new image and the frames compress to little more than what moved.
+@author - Wizards of Coz
+'''
+
+GIF_SIZE = (320, 240)       # width, height of the GIF, the camera's
+GIF_COLORS = 256            # colours of the palette shared by the frames
+GIF_FRAME_MS = 100          # duration of a frame as taken, a frame kept for dropped ones lasts longer
+STATIC_THRESHOLD = 8.0      # difference (0-255) of the 8x8 block that changed most, under which a frame is the
+                            # same as the last one kept
+PIXEL_TOLERANCE = 12        # difference (0-255) under which a pixel on screen is left as it is
+PALETTE_SAMPLES = 1 << 16   # pixels of the clip the palette is computed from
+WEBP_QUALITY = 80
+
+LUT_BITS = 5                # bits per channel of the colour lookup table
+THUMB_BLOCK = 8             # frames are compared on the averages of 8x8 blocks, the camera noise averaged out
+
+MEDIANCUT = getattr(getattr(Image, 'Quantize', None), 'MEDIANCUT', 0)
+
+# Frames (n, height, width, 3) scaled to size: an average over blocks for a whole factor down, the nearest
+# pixel otherwise
+def scale(frames, size):
+    height, width = frames.shape[1:3]
+    if (width, height) == tuple(size):
+        return frames
+    if width % size[0] == 0 and height % size[1] == 0:
+        fx, fy = width // size[0], height // size[1]
+        # one addition of a strided view of every frame per pixel of a block, faster than a mean over axes
+        total = np.zeros((len(frames), size[1], size[0], 3), dtype=np.uint16 if fx * fy <= 256 else np.uint32)
+        for dy in range(fy):
+            for dx in range(fx):
+                total += frames[:, dy::fy, dx::fx]
+        return ((total + fx * fy // 2) // (fx * fy)).astype(np.uint8)
+    ys = (np.arange(size[1]) * height // size[1])
+    xs = (np.arange(size[0]) * width // size[0])
+    return frames[:, ys][:, :, xs]
+
+# Indices of the frames to keep, and how many frames as taken each one lasts. A frame is kept when some part
+# of it changed, however small, not when the whole of it changed on average
+def keep_moving(frames, threshold=STATIC_THRESHOLD):
+    height, width = (frames.shape[1] // THUMB_BLOCK) * THUMB_BLOCK, (frames.shape[2] // THUMB_BLOCK) * THUMB_BLOCK
+    thumbs = scale(frames[:, :height, :width], (width // THUMB_BLOCK, height // THUMB_BLOCK)).astype(np.int16)
+    kept = [0]
+    lengths = [1]
+    for i in range(1, len(thumbs)):
+        if np.abs(thumbs[i] - thumbs[kept[-1]]).mean(axis=-1).max() < threshold:
+            lengths[-1] += 1
+        else:
+            kept.append(i)
+            lengths.append(1)
+    return kept, lengths
+
+# Palette (colors, 3) of a sample of the pixels of the clip
+def clip_palette(frames, colors=GIF_COLORS, samples=PALETTE_SAMPLES):
+    pixels = frames.reshape(-1, 3)
+    step = max(1, len(pixels) // samples)
+    sample = np.ascontiguousarray(pixels[::step]).reshape(1, -1, 3)
+    quantized = Image.fromarray(sample).quantize(colors, method=MEDIANCUT)
+    used = len(quantized.getcolors(colors))
+    return np.array(quantized.getpalette()[:used * 3], dtype=np.uint8).reshape(-1, 3)
+
+# Palette index of every pixel of the clip, through a table of the nearest palette colour of every colour
+# (to LUT_BITS bits a channel) the clip has
+def map_to_palette(frames, palette):
+    shift = 8 - LUT_BITS
+    reduced = (frames >> shift).astype(np.int32)
+    codes = (reduced[..., 0] << (2 * LUT_BITS)) | (reduced[..., 1] << LUT_BITS) | reduced[..., 2]
+    present = np.flatnonzero(np.bincount(codes.ravel(), minlength=1 << (3 * LUT_BITS)))
+    mask = (1 << LUT_BITS) - 1
+    centres = np.stack(((present >> (2 * LUT_BITS)) & mask, (present >> LUT_BITS) & mask, present & mask), axis=-1)
+    centres = (centres << shift) + (1 << (shift - 1))
+    distances = ((centres[:, None, :] - palette[None, :, :].astype(np.int32)) ** 2).sum(axis=-1)
+    lut = np.zeros(1 << (3 * LUT_BITS), dtype=np.uint8)
+    lut[present] = distances.argmin(axis=1)
+    return lut[codes]
+
+# Writes the frames (n, height, width, 3) of a clip as an animated GIF, or WebP if the path ends with .webp.
+# Returns the frames taken and kept and the bytes written
+def write_animation(frames, path, size=GIF_SIZE, colors=GIF_COLORS, frame_ms=GIF_FRAME_MS, threshold=STATIC_THRESHOLD):
+    frames = scale(np.asarray(frames), size)
+    kept, lengths = keep_moving(frames, threshold)
+    frames = frames[kept]
+    durations = [length * frame_ms for length in lengths]
+    if path.lower().endswith(".webp"):
+        images = [Image.fromarray(frame) for frame in frames]
+        images[0].save(path, 'WEBP', save_all=True, append_images=images[1:], duration=durations, loop=0,
+                       quality=WEBP_QUALITY)
+    else:
+        # the last index of the palette is the transparent one
+        palette = clip_palette(frames, colors - 1)
+        transparent = len(palette)
+        indices = map_to_palette(frames, palette)
+        flat = palette.ravel().tolist() + [0, 0, 0]
+        images = []
+        shown = indices[0]
+        for frame, frame_indices in zip(frames, indices):
+            if images:
+                same = np.abs(frame.astype(np.int16) - palette[shown]).max(axis=-1) <= PIXEL_TOLERANCE
+                shown = np.where(same, shown, frame_indices)
+                frame_indices = np.where(same, transparent, frame_indices).astype(np.uint8)
+            image = Image.frombytes('P', (frame.shape[1], frame.shape[0]), frame_indices.tobytes())
+            image.putpalette(flat)
+            images.append(image)
+        # not optimized, PIL would give every frame a colour table of its own. Frames are drawn over the
+        # previous ones (disposal 1), through their transparent pixels
+        images[0].save(path, 'GIF', save_all=True, append_images=images[1:], duration=durations, loop=0,
+                       optimize=False, transparency=transparent, disposal=1)
+    return {'frames': sum(lengths), 'kept': len(kept), 'bytes': os.path.getsize(path)}
+
+# A memory to benchmark on: the camera pans over a picture, holds still, and a cube goes by, with the noise
+# of the camera
+def test_clip(frames=60, picture="Media/belt.jpg"):
+    rng = np.random.RandomState(0)
+    scene = np.asarray(Image.open(picture).convert('RGB').resize((640, 315))).astype(np.int16)
+    clip = []
+    x = 0
+    for i in range(frames):
+        if i < frames // 3:
+            x += 8
+        frame = scene[40:280, x:x + 320].copy()
+        if i >= 2 * frames // 3:
+            left = 20 + (i - 2 * frames // 3) * 6
+            frame[100:140, left:left + 40] = (200, 40, 40)
+        clip.append(np.clip(frame + rng.normal(0, 3, frame.shape), 0, 255).astype(np.uint8))
+    return np.stack(clip)
+
+# Time and bytes of a GIF saved by PIL frame by frame, each with its own palette, as the clip was before,
+# and of this export at a few sizes
+def benchmark(folder="bench_gif"):
+    clip = test_clip()
+    os.makedirs(folder, exist_ok=True)
+
+    path = os.path.join(folder, "naive.gif")
+    start = time.perf_counter()
+    images = [Image.fromarray(frame) for frame in clip]
+    images[0].save(path, save_all=True, append_images=images[1:], duration=GIF_FRAME_MS, loop=0)
+    naive = time.perf_counter() - start
+    naive_bytes = os.path.getsize(path)
+    print("%-26s %7.1f ms %8d KB  %d frames" % ("PIL save_all per frame", naive * 1000, naive_bytes // 1024, len(clip)))
+
+    for name, size in (("memory.gif", GIF_SIZE), ("memory.gif", (160, 120)), ("memory.webp", GIF_SIZE)):
+        path = os.path.join(folder, name)
+        start = time.perf_counter()
+        result = write_animation(clip, path, size=size)
+        elapsed = time.perf_counter() - start
+        print("%-26s %7.1f ms %8d KB  %d frames kept, %.1fx faster, %.1fx smaller" % (
+            "%s %dx%d" % (name, size[0], size[1]), elapsed * 1000, result['bytes'] // 1024, result['kept'],
+            naive / elapsed, naive_bytes / result['bytes']))
+
+    for name in os.listdir(folder):
+        os.remove(os.path.join(folder, name))
+    os.rmdir(folder)
+
+if __name__ == '__main__':
+    benchmark()
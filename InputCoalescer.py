@@ -0,0 +1,103 @@
+import asyncio
+import time
+import cozmo
+from Metrics import metrics
+
+'''
+@class InputCoalescer
+Keeps only the latest wheel, lift and head intent coming from the tablets and from the game update, and
+sends it to Cozmo only when it is worth it. Wheel speeds are sent at once when they change by more than a
+threshold or come to a stop; smaller changes wait until some time has passed since the last command, and
+the update sends them then. A stop is always sent. Counts for every tablet how many commands it sent
+and how many of them reached Cozmo.
+@author - Wizards of Coz
+'''
+
+WHEEL_THRESHOLD = 10.0      # mm/s of change in a wheel speed that is sent at once
+MIN_INTERVAL = 0.25         # seconds after which smaller changes of the wheel speeds are sent
+GAME = "game"               # client name of the commands coming from the game update itself
+
+class InputCoalescer:
+    def __init__(self, robot: cozmo.robot.Robot):
+        self.robot = robot
+
+        self.wheels = (0, 0)
+        self.accelerations = (0, 0)
+        self.wheels_client = GAME
+        self.sent_wheels = None
+        self.wheels_sent_at = 0.0
+
+        self.lift = 0
+        self.sent_lift = None
+        self.head = 0
+        self.sent_head = None
+
+        self.clients = {}   # client -> {'received', 'applied'}
+
+    def count(self, client, what):
+        counters = self.clients.get(client)
+        if counters is None:
+            counters = self.clients[client] = {'received': 0, 'applied': 0}
+        counters[what] += 1
+
+    def drive(self, l_wheel_speed, r_wheel_speed, client=GAME, l_wheel_acc=None, r_wheel_acc=None):
+        self.count(client, 'received')
+        self.wheels = (l_wheel_speed, r_wheel_speed)
+        self.accelerations = (l_wheel_speed * 4 if l_wheel_acc is None else l_wheel_acc,
+                              r_wheel_speed * 4 if r_wheel_acc is None else r_wheel_acc)
+        self.wheels_client = client
+        self.flush_wheels(time.time())
+
+    def move_lift(self, speed, client=GAME):
+        self.count(client, 'received')
+        self.lift = speed
+        if self.lift != self.sent_lift:
+            with metrics.span("sdk_call_seconds", call="move_lift"):
+                self.robot.move_lift(self.lift)
+            self.sent_lift = self.lift
+            self.count(client, 'applied')
+
+    def move_head(self, speed, client=GAME):
+        self.count(client, 'received')
+        self.head = speed
+        if self.head != self.sent_head:
+            with metrics.span("sdk_call_seconds", call="move_head"):
+                self.robot.move_head(self.head)
+            self.sent_head = self.head
+            self.count(client, 'applied')
+
+    # Called every update, sends the wheel speeds that were held back
+    def flush(self):
+        self.flush_wheels(time.time())
+
+    def flush_wheels(self, now):
+        l_wheel_speed, r_wheel_speed = self.wheels
+        # something else may have driven the wheels since, a stop always goes through
+        stopping = l_wheel_speed == 0 and r_wheel_speed == 0
+        if not stopping:
+            if self.wheels == self.sent_wheels:
+                return
+            if self.sent_wheels is not None:
+                change = max(abs(l_wheel_speed - self.sent_wheels[0]), abs(r_wheel_speed - self.sent_wheels[1]))
+                if change < WHEEL_THRESHOLD and now - self.wheels_sent_at < MIN_INTERVAL:
+                    return
+        elif self.wheels_client == GAME and self.sent_wheels == self.wheels:
+            return
+        started = time.perf_counter()
+        result = self.robot.drive_wheels(l_wheel_speed, r_wheel_speed, *self.accelerations)
+        if asyncio.iscoroutine(result):
+            # called on the SDK event loop, drive_wheels is a coroutine there, timed while it is awaited
+            asyncio.ensure_future(self.send_wheels(result))
+        else:
+            # the synchronous call of the SDK returns once the speeds are sent
+            metrics.observe("sdk_call_seconds", time.perf_counter() - started, call="drive_wheels")
+        self.sent_wheels = self.wheels
+        self.wheels_sent_at = now
+        self.count(self.wheels_client, 'applied')
+
+    async def send_wheels(self, send):
+        with metrics.span("sdk_call_seconds", call="drive_wheels"):
+            await send
+
+    def stats(self):
+        return {client: dict(counters) for client, counters in self.clients.items()}
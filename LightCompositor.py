@@ -0,0 +1,54 @@
+import cozmo
+
+'''
+@class LightCompositor
+Holds the light state wanted on the cube corners and on Cozmo's backpack, and sends it at most once
+per update, only when it differs from what was sent last. Several changes within one update become
+one message to the cube and one to the robot, and an update without changes sends nothing.
+@author - Wizards of Coz
+'''
+
+class LightCompositor:
+    def __init__(self, robot: cozmo.robot.Robot, cube=None):
+        self.robot = robot
+        self.cube = cube
+
+        self.corners = [None, None, None, None]         # wanted on the four cube corners
+        self.backpack = [None, None, None, None, None]  # wanted on the five backpack lights
+        self.sent_corners = None                        # last sent, None when unknown
+        self.sent_backpack = None
+
+        self.messages_sent = 0
+        self.flushes_skipped = 0
+
+    # lights_off tells that the cube was just switched off, so an all dark state needs no send
+    def set_cube(self, cube, lights_off=False):
+        self.cube = cube
+        self.sent_corners = [None, None, None, None] if lights_off else None
+
+    def set_corners(self, corners):
+        self.corners = list(corners)
+
+    def set_backpack(self, lights):
+        self.backpack = list(lights)
+
+    # Something else changed the lights directly (e.g. the arcade game), send everything on next flush
+    def invalidate(self):
+        self.sent_corners = None
+        self.sent_backpack = None
+
+    # Called once per update, sends what changed since the last flush
+    def flush(self):
+        sent = False
+        if self.cube is not None and self.corners != self.sent_corners:
+            self.cube.set_light_corners(*self.corners)
+            self.sent_corners = list(self.corners)
+            self.messages_sent += 1
+            sent = True
+        if self.backpack != self.sent_backpack:
+            self.robot.set_backpack_lights(*self.backpack)
+            self.sent_backpack = list(self.backpack)
+            self.messages_sent += 1
+            sent = True
+        if not sent:
+            self.flushes_skipped += 1
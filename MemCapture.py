@@ -1,15 +1,19 @@
 import cozmo
 import asyncio
+import logging
 from Common.woc import WOC
 from InstagramAPI import InstagramAPI
 from Common.colors import Colors
 import speech_recognition as sr
 import _thread
+import functools
 import time
 import os
 import sys
 
-from cv2 import VideoWriter, VideoWriter_fourcc, imread, resize
+from FrameRing import FrameRing
+from EncodingService import EncodingService
+from PreRoll import PreRoll, SNAPSHOT_BEFORE, SNAPSHOT_AFTER
 
 try:
     import numpy as np
@@ -22,14 +26,15 @@ try:
 except ImportError:
     print("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
 
+log = logging.getLogger(__name__)
 
 class MemCapture(WOC):
     FILTER_FOLDER_NAME = "Filters"              # Folder name where all the 14 filters generated are saved
-    VIDEO_IMAGES_FOLDER_NAME = "VideoImages"    # Folder name where the images are saved
     OUTPUT_IMAGE_NAME = "thumbnail.jpg"         # Thumbnail Image name
     INSTAGRAM_USER_NAME = "wizardsofcoz"        # Enter your Instagram Username here
     INSTAGRAM_PASSWORD = ""                     # Enter your Instagram Password here or create a file "instagram.txt" and write the password there in the first line
     OUTPUT_VIDEO_NAME = "video.avi"             # Video name
+    OUTPUT_GIF_NAME = "memory.gif"              # GIF of the same memory, an animated WebP if named .webp
     INSTAGRAM_FILE_NAME = "instagram.txt"       # Text file to store your password
 
     def __init__(self, robot=None, instance=None):
@@ -47,6 +52,12 @@ class MemCapture(WOC):
 
         self.minstance = instance
         self.coz = robot
+        self.ring = FrameRing()                 # last camera frames, until the capture takes them
+        self.encoder = EncodingService()        # encodes the memories in another process
+        self.encoder.start()
+        self.preroll = PreRoll()                # last seconds of the camera, compressed, for memories saved after the moment
+        self.handler1 = None
+        self.saving = False
 
         if self.coz is None:
             cozmo.setup_basic_logging()
@@ -67,16 +78,18 @@ class MemCapture(WOC):
         mean_value = np.mean(grayscale_image.getdata())
         return mean_value
 
-    async def start_program(self):
+    # Takes the camera images from now on, into the ring and the pre-roll, until the program ends
+    def start_camera(self):
         self.coz.camera.color_image_enabled = True
         self.coz.camera.image_stream_enabled = True
+        if self.handler1 is None:
+            self.handler1 = self.coz.world.add_event_handler(cozmo.camera.EvtNewRawCameraImage, self.on_raw_cam_image)
 
-        self.latest_Image = None;
-
+    async def start_program(self):
         self.face_dimensions = cozmo.oled_face.SCREEN_WIDTH, cozmo.oled_face.SCREEN_HALF_HEIGHT
         self.image_taken = False;
 
-        self.handler1 = self.coz.world.add_event_handler(cozmo.camera.EvtNewRawCameraImage, self.on_raw_cam_image)
+        self.start_camera()
 
         self.do_final_anim = False;
 
@@ -92,62 +105,80 @@ class MemCapture(WOC):
             else:
                 await asyncio.sleep(0.1);
 
+    # Only copies the frame into the ring and the pre-roll, the frames are encoded elsewhere
     async def on_raw_cam_image(self, event, *, image, **kw):
-        self.latest_Image = image;
+        self.ring.push(image)
+        self.preroll.offer(image)
 
     async def clickPicture(self):
         self.image_taken = True;
 
-        if not os.path.exists(self.VIDEO_IMAGES_FOLDER_NAME):
-            os.makedirs(self.VIDEO_IMAGES_FOLDER_NAME)
         self.max_count = 60;                                                 # Number of images to make the video
-        cur_count = 0;
-        while self.latest_Image is None:
-            print("is none");
+        while self.ring.latest() is None:
+            log.debug("No camera image yet")
             await asyncio.sleep(0.1);
 
-        while cur_count < self.max_count:
-            self.latest_Image.save(self.VIDEO_IMAGES_FOLDER_NAME+"/image" + str(cur_count) + ".jpg");
-            await asyncio.sleep(0.1);
-            cur_count += 1;
-
-        image = self.latest_Image
-        img = image.convert('L')
-        img.save(self.OUTPUT_IMAGE_NAME)
+        # every camera frame from the newest one on goes into shared memory, and is encoded in another process
+        # at the end
+        clip = self.encoder.clip(self.max_count, self.ring.latest().shape)
+        filtering = None
+        try:
+            read = self.ring.count - 1
+            while clip.count < self.max_count:
+                frames, read = self.ring.since(read)
+                for frame in frames:
+                    clip.add(frame)
+                await asyncio.sleep(0.1);
+            await self.encoder.encode(clip, video=self.OUTPUT_VIDEO_NAME, gif=self.OUTPUT_GIF_NAME,
+                                      thumbnail=self.OUTPUT_IMAGE_NAME, free=False)
 
-        self.coz.world.remove_event_handler(cozmo.camera.EvtNewRawCameraImage, self.handler1);
+            # comment this to not upload a video
+            await self.upload_video();
 
-        # comment this to not upload a video
-        await self.make_video_and_upload();
+            filtering = self.write_filters(self.encoder.encode(clip, filters=self.FILTER_FOLDER_NAME))
+        finally:
+            # cancelled or failed before the encoder took the clip for the filters, which frees it once done
+            if filtering is None:
+                clip.close()
 
         self.do_final_anim = True;
 
-    async def make_video_and_upload(self):
-        outvid = self.OUTPUT_VIDEO_NAME
-        fps = 24;
-        size = (320, 240);
-        is_color = 1;
-
-        fourcc = VideoWriter_fourcc(*'XVID')
-        vid = None
-        images = []
-        for i in range(0, self.max_count):
-            images.append(self.VIDEO_IMAGES_FOLDER_NAME+"/image" + str(i) + ".jpg")
-
-        for image in images:
-            if not os.path.exists(image):
-                raise FileNotFoundError(image)
-            img = imread(image)
-            if vid is None:
-                if size is None:
-                    size = img.shape[1], img.shape[0]
-                vid = VideoWriter(outvid, fourcc, float(fps), size, is_color)
-            if size[0] != img.shape[1] and size[1] != img.shape[0]:
-                img = resize(img, size)
-            vid.write(img)
-        vid.release()
-
-        self.insta.uploadVideo("video.avi", thumbnail=self.OUTPUT_IMAGE_NAME, caption="#memorieswithcozmo");
+    # Saves the seconds before now and after as a memory, from the pre-roll, and uploads it. Called after the
+    # moment (the arcade game over, the ride started), a memory asked for while one is being saved is ignored
+    async def save_moment(self, before=SNAPSHOT_BEFORE, after=SNAPSHOT_AFTER):
+        if self.saving:
+            return
+        self.saving = True
+        try:
+            jpegs = await self.preroll.snapshot(before, after)
+            if not jpegs:
+                log.warning("No camera frames to save a memory from")
+                return
+            timings = await self.encoder.encode_jpegs(jpegs, video=self.OUTPUT_VIDEO_NAME, gif=self.OUTPUT_GIF_NAME,
+                                                      thumbnail=self.OUTPUT_IMAGE_NAME)
+            log.info("Memory of %d frames encoded: %s", len(jpegs), timings)
+            await self.upload_video()
+            self.write_filters(self.encoder.encode_jpegs(jpegs, filters=self.FILTER_FOLDER_NAME))
+            if self.minstance is not None:
+                await self.minstance.memory_captured()
+        except Exception as e:
+            log.exception("Saving a memory failed: %s", e)
+        finally:
+            self.saving = False
+
+    # The GIFs of the filters are not uploaded, so they are written once the memory is up, while the game goes
+    # on. Returns the future of the encoder
+    def write_filters(self, encoding):
+        def done(future):
+            if not future.cancelled() and future.exception() is not None:
+                log.warning("Writing the filtered GIFs failed: %s", future.exception())
+        encoding.add_done_callback(done)
+        return encoding
+
+    # the upload waits on the network, on a thread so the loop goes on
+    async def upload_video(self):
+        await asyncio.get_event_loop().run_in_executor(None, functools.partial(
+            self.insta.uploadVideo, self.OUTPUT_VIDEO_NAME, thumbnail=self.OUTPUT_IMAGE_NAME, caption="#memorieswithcozmo"))
 
 
 if __name__ == '__main__':
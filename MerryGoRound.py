@@ -1,10 +1,12 @@
 import numpy as np
 import cozmo
 import asyncio
+import logging
 from PIL import Image
 import _thread
 import os
 import random
+from Metrics import metrics
 
 '''
 @class MerryGoRound
@@ -12,12 +14,15 @@ Play with Cozmo by spinning him aroung on a merry-go-round and watch him get diz
 @author - Wizards of Coz
 '''
 
+log = logging.getLogger(__name__)
+
 class MerryGoRound(): 
     def __init__(self, robot=None, instance=None):
         self.thresh = 5
         self.dizzy = 0      #0 = normal, 1 = tipsy, 2 = drunk, 3 = throwing up, 4 = out of order
         self.robot = robot
         self.mainInstance = instance
+        self.rng = instance.rng if instance else random     # random of the game, recorded with the session
         self.END = False
         if self.robot is None:
             cozmo.connect(self.run)
@@ -43,27 +48,31 @@ class MerryGoRound():
         while self.END is False:
             #is_picked_up value goes true on sudden motions and so he knows he's being spun around
             if self.robot.is_picked_up is True:
-                x = random.randint(1, 4)
+                x = self.rng.randint(1, 4)
                 if x == 1:
                     try:
                         await self.robot.play_anim_trigger(cozmo.anim.Triggers.DroneModeTurboDrivingStart).wait_for_completed()
                     except cozmo.exceptions.RobotBusy:
-                        print("robot busy")
+                        log.debug("robot busy")
+                        metrics.count("robot_busy_retries_total", source="merrygoround")
                 elif x == 2:
                     try:
                         await self.robot.say_text("Faster", duration_scalar=1.2, voice_pitch=0.3).wait_for_completed()
                     except cozmo.exceptions.RobotBusy:
-                        print("robot busy")
+                        log.debug("robot busy")
+                        metrics.count("robot_busy_retries_total", source="merrygoround")
                 elif x == 3:
                     try:
                         await self.robot.play_anim_trigger(cozmo.anim.Triggers.SoundOnlyRamIntoBlock).wait_for_completed()
                     except cozmo.exceptions.RobotBusy:
-                        print("robot busy")
+                        log.debug("robot busy")
+                        metrics.count("robot_busy_retries_total", source="merrygoround")
                 elif x == 4:
                     try:
                         await self.robot.play_anim_trigger(cozmo.anim.Triggers.CubePounceWinHand).wait_for_completed()
                     except cozmo.exceptions.RobotBusy:
-                        print("robot busy")
+                        log.debug("robot busy")
+                        metrics.count("robot_busy_retries_total", source="merrygoround")
             await asyncio.sleep(0.1)    
 
     def end_experience(self):
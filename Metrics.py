@@ -0,0 +1,188 @@
+import bisect
+import collections
+import sys
+import threading
+import time
+import traceback
+
+'''
+@class Metrics
+Counters, gauges and timing spans of the game, served in the Prometheus text format at /metrics. A span
+times a block with time.perf_counter() into a histogram of fixed buckets, a counter counts, a gauge reads
+its value from a function only when the metrics are scraped. Metrics are keyed by name and labels, so
+recording one costs a dictionary lookup and a few additions under a lock, nothing is formatted until a
+scrape. SamplingProfiler is a thread that samples the stacks of the other threads while it is switched on.
+@author - Wizards of Coz
+'''
+
+PREFIX = "cozmoworld_"
+# seconds, from a fast SDK call to an animation
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROFILE_INTERVAL = 0.005    # seconds between two samples of the profiler
+PROFILE_DEPTH = 24          # innermost frames kept of a sampled stack
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}              # name -> (type, help)
+        self.counters = {}          # (name, labels) -> value
+        self.histograms = {}        # (name, labels) -> Histogram
+        self.gauges = {}            # (name, labels) -> function returning the value
+
+    def describe(self, name, kind, text):
+        if name not in self.help:
+            self.help[name] = (kind, text)
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, function, text="", **labels):
+        self.describe(name, "gauge", text)
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = function
+
+    # with metrics.span("update"): ... times the block into the histogram of that name
+    def span(self, name, **labels):
+        return Span(self, name, labels)
+
+    # Prometheus text format of all the metrics
+    def exposition(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(((key, (list(h.counts), h.sum, h.count, h.buckets)) for key, h in self.histograms.items()))
+            gauges = sorted(self.gauges.items(), key=lambda item: item[0])
+
+        lines = []
+        described = set()
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                text = self.help.get(name, (kind, ""))[1]
+                if text:
+                    lines.append("# HELP %s%s %s" % (PREFIX, name, text))
+                lines.append("# TYPE %s%s %s" % (PREFIX, name, kind))
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append("%s%s%s %s" % (PREFIX, name, format_labels(labels), value))
+        for (name, labels), (counts, total, count, buckets) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append("%s%s_bucket%s %d" % (PREFIX, name, format_labels(labels + (("le", le),)), cumulative))
+            lines.append("%s%s_sum%s %r" % (PREFIX, name, format_labels(labels), total))
+            lines.append("%s%s_count%s %d" % (PREFIX, name, format_labels(labels), count))
+        for (name, labels), function in gauges:
+            try:
+                value = function()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            header(name, "gauge")
+            lines.append("%s%s%s %r" % (PREFIX, name, format_labels(labels), float(value)))
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + "}"
+
+class Span:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+# Samples where the other threads are, while switched on. The report is the most frequent stacks, innermost
+# frame last, with the share of the samples they were seen in.
+class SamplingProfiler:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.stacks.clear()
+        self.samples = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        me = threading.get_ident()
+        while self.running:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = traceback.extract_stack(frame, limit=PROFILE_DEPTH)
+                self.stacks[";".join("%s:%s" % (entry.name, entry.lineno) for entry in stack)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def report(self, top=30):
+        lines = ["%d samples every %.1f ms%s" % (self.samples, self.interval * 1000, ", running" if self.running else "")]
+        for stack, count in self.stacks.most_common(top):
+            lines.append("%5.1f%% %s" % (100.0 * count / max(self.samples, 1), stack))
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()         # the metrics of the process, shared by every robot
+profiler = SamplingProfiler()
+
+# Cost of recording, the span is what an instrumented call pays
+if __name__ == '__main__':
+    rounds = 200000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        with metrics.span("bench", route="/x"):
+            pass
+    span_cost = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        metrics.count("bench_total")
+    count_cost = (time.perf_counter() - start) / rounds
+    print("span %.2f us, counter %.2f us" % (span_cost * 1e6, count_cost * 1e6))
+    print(metrics.exposition())
@@ -0,0 +1,93 @@
+'''
+Array backed storage of the track graph, for layouts with thousands of vertices.
+Vertices and edges are numbered by integer ids. Coordinates, edge endpoints, lengths
+and headings are kept in NumPy arrays, with the out edges of every vertex stored
+contiguously (CSR layout), so edge lookups are index operations.
+'''
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+    print("Cannot import numpy: Do `pip3 install --user numpy` to install")
+
+class CompactGraph:
+    # vertices: list of vertex objects, edges: list of edge objects between them
+    def __init__(self, vertices, edges):
+        n = len(vertices)
+        m = len(edges)
+        self.vertexCount = n
+
+        # vertex objects in id order, and vertexId -> integer id
+        self.vertices = vertices
+        self.indexOf = {}
+        for i, v in enumerate(vertices):
+            v.index = i
+            self.indexOf[v.id] = i
+
+        self.x = np.fromiter((v.x for v in vertices), np.float64, n)
+        self.y = np.fromiter((v.y for v in vertices), np.float64, n)
+
+        starts = np.fromiter((e.start.index for e in edges), np.int32, m)
+        ends = np.fromiter((e.end.index for e in edges), np.int32, m)
+        distances = np.fromiter((e.distance for e in edges), np.float64, m)
+        headings = np.fromiter((e.radians for e in edges), np.float64, m)
+
+        # number edges by start vertex, keeping file order among the out edges of one vertex
+        order = np.argsort(starts, kind="stable")
+        self.edges = [edges[i] for i in order]
+        self.edgeStart = starts[order]
+        self.edgeEnd = ends[order]
+        self.distance = distances[order]
+        self.radians = headings[order]
+        for i, e in enumerate(self.edges):
+            e.index = i
+
+        # out edges of vertex v are edge ids offsets[v] to offsets[v + 1] - 1
+        self.offsets = np.zeros(n + 1, np.int64)
+        np.cumsum(np.bincount(starts, minlength=n), out=self.offsets[1:])
+
+        # (start id * vertex count + end id) -> edge id
+        keys = self.edgeStart.astype(np.int64) * n + self.edgeEnd
+        self.lookup = dict(zip(keys.tolist(), range(m)))
+
+    # item() reads a single element as a Python number, much faster than indexing
+    def outDegree(self, v):
+        return self.offsets.item(v + 1) - self.offsets.item(v)
+
+    # id of the edge from vertex v to vertex end
+    def findOutEdge(self, v, end):
+        return self.lookup[v * self.vertexCount + end]
+
+    # id of any edge from vertex v that does not end at vertex end
+    def findOutEdgeNotEndsAt(self, v, end):
+        first = self.offsets.item(v)
+        if self.edgeEnd.item(first) != end:
+            return first
+        if self.outDegree(v) > 1:
+            return first + 1
+        raise KeyError("No edge from vertex %d avoiding vertex %d" % (v, end))
+
+    # id of a random edge from vertex v
+    def randomEdge(self, v):
+        degree = self.outDegree(v)
+        if degree == 0:
+            raise Exception("Initialization not finished")
+        return self.offsets.item(v) + random.randrange(degree)
+
+    # id of a random edge starting where edge e ends, avoiding U turn unless it is the only way
+    def randomNextEdge(self, e):
+        v = self.edgeEnd.item(e)
+        first = self.offsets.item(v)
+        degree = self.offsets.item(v + 1) - first
+        if degree == 0:
+            raise Exception("Initialization not finished")
+        uturn = self.lookup.get(v * self.vertexCount + self.edgeStart.item(e))
+        if uturn is None or degree == 1:
+            return first + int(random.random() * degree)
+        # pick among the other edges and skip over the U turn
+        edge = first + int(random.random() * (degree - 1))
+        if edge >= uturn:
+            edge += 1
+        return edge
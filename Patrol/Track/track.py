@@ -2,25 +2,63 @@
 Track is stored as graph structure. 
 '''
 import json
+import logging
 import random
 import os
+import math
+import heapq
+import itertools
+import hashlib
+import pickle
 from Common.wocmath import tupleMagnitude, tupleRadians
+from Patrol.Track.compact import CompactGraph, np
 from typing import List
 
+log = logging.getLogger(__name__)
+
 TRACK_FILE_PATH = "track.json"
 MAGIC_SCALE = 1.0
+# planning cost of turning one radian at an intersection, in mm of driving
+TURN_COST = 100.0
+# precomputed graph and routes are saved beside the track file with this extension
+CACHE_FILE_EXTENSION = ".cache"
+# bump when the cache layout changes
+CACHE_VERSION = 2
+
+# standard deviation of driven distance per mm commanded to the wheels
+COMMAND_NOISE = 0.1
+# standard deviation of odometry distance per mm measured, and its floor in mm
+ODOMETRY_NOISE = 0.05
+ODOMETRY_NOISE_FLOOR = 2.0
+# standard deviation in mm of the position measured from a marker sighting
+MARKER_NOISE = 30.0
+# a vertex further than this from the line of an edge in mm is not on the edge
+ON_EDGE_TOLERANCE = 20.0
+# the edge is considered passed when the estimated remaining distance is below this, in mm
+EDGE_END_TOLERANCE = 5.0
 
 class Edge:
+    __slots__ = ("start", "end", "distance", "radians", "index")
 
-    def __init__(self, start, end):
+    # distance and radians can be given when restored from the track cache
+    def __init__(self, start, end, distance=None, radians=None):
         self.start = start
         self.end = end
-        direction = (end.x - start.x, end.y - start.y)
-        self.distance = tupleMagnitude(direction, direction)
-        self.radians = tupleRadians(direction)
+        # id in the compact graph, if it is used
+        self.index = None
+        if distance is None or radians is None:
+            direction = (end.x - start.x, end.y - start.y)
+            distance = tupleMagnitude(direction, direction)
+            radians = tupleRadians(direction)
+        self.distance = distance
+        self.radians = radians
 
     # get one edge randomly that starts from the end vertex of current edge
     def randomNextEdge(self):
+        graph = self.start.graph
+        if graph:
+            return graph.edges[graph.randomNextEdge(self.index)]
+
         edge = self.end.randomEdge()
 
         # avoid U turn
@@ -29,7 +67,13 @@ class Edge:
 
         return edge
 
+    # signed angle in [-pi, pi] of the turn from this edge onto the next edge
+    def turnAngle(self, nextEdge):
+        angle = nextEdge.radians - self.radians
+        return math.atan2(math.sin(angle), math.cos(angle))
+
 class Vertex:
+    __slots__ = ("id", "x", "y", "outEdges", "index", "graph")
 
     def __init__(self, id, x, y):
         self.id = id
@@ -37,6 +81,9 @@ class Vertex:
         self.y = y * MAGIC_SCALE
         # blvd edge start at this vertex
         self.outEdges = []
+        # id in the compact graph, and the graph itself, if it is used
+        self.index = None
+        self.graph = None
 
     # record the edge *(objects)* which starts with this vertex
     def addEdge(self, edge: Edge):
@@ -44,6 +91,9 @@ class Vertex:
 
     # get one random edge that starts from this vertex
     def randomEdge(self):
+        if self.graph:
+            return self.graph.edges[self.graph.randomEdge(self.index)]
+
         if not self.outEdges:
             raise Exception("Initialization not finished")
         else:
@@ -51,18 +101,65 @@ class Vertex:
 
     # find the exact one edge that starts from this vertex and ends at vertex with endId
     def findOutEdge(self, endId):
+        if self.graph:
+            return self.graph.edges[self.graph.findOutEdge(self.index, self.graph.indexOf[endId])]
+
         edge = next((e for e in self.outEdges if e.end.id == endId))
         return edge
 
     # find any one edge that starts from this vertex and NOT ends at vertex with endId
     def findOutEdgeNotEndsAt(self, endId):
+        if self.graph:
+            return self.graph.edges[self.graph.findOutEdgeNotEndsAt(self.index, self.graph.indexOf[endId])]
+
         edge = next((e for e in self.outEdges if e.end.id != endId))
         return edge
 
 class BldgVertex(Vertex):
-    def __init__(self, id, x, y, d):
+    __slots__ = ("d", "lane")
+
+    # lane: direction pointing from the road into the building's small lane
+    def __init__(self, id, x, y, d, lane):
         super(BldgVertex, self).__init__(id, x, y)
         self.d = d * MAGIC_SCALE
+        self.lane = lane
+
+    # whether the vertex is on the left hand side when facing into the small lane
+    def isOnLeft(self, vertex: Vertex):
+        cross = self.lane[0] * (vertex.y - self.y) - self.lane[1] * (vertex.x - self.x)
+        return cross > 0
+
+# Kalman filter of the distance travelled along the current edge, in mm.
+# wheel commands predict the motion, odometry and marker sightings correct it
+class EdgeEstimator:
+
+    def __init__(self):
+        self.reset()
+
+    # back to the start of an edge, position known exactly
+    def reset(self):
+        self.position = 0.0
+        self.variance = 0.0
+
+    # move forward by the distance commanded to the wheels
+    def predict(self, commanded):
+        self.position += commanded
+        self.variance += (COMMAND_NOISE * commanded) ** 2
+
+    # fuse one measurement of the position with the given variance
+    def correct(self, measured, variance):
+        gain = self.variance / (self.variance + variance)
+        self.position += gain * (measured - self.position)
+        self.variance *= 1.0 - gain
+
+    # distance along the edge measured by robot odometry
+    def updateOdometry(self, measured):
+        noise = max(ODOMETRY_NOISE * abs(measured), ODOMETRY_NOISE_FLOOR)
+        self.correct(measured, noise ** 2)
+
+    # distance along the edge derived from a marker at a known place on the map
+    def updateMarker(self, measured):
+        self.correct(measured, MARKER_NOISE ** 2)
 
 class PoseTrack:
 
@@ -85,7 +182,7 @@ class PoseTrack:
         # time passed moving on current edge
         self.movedTime = 0.0
         self.maxTime = (edge.distance + offset) / speed
-        print("edge length: %s" % edge.distance)
+        log.debug("edge length: %s", edge.distance)
 
         if self.edge:
             self.angleDiff = edge.radians - self.edge.radians
@@ -150,12 +247,19 @@ class Path:
                 elif i == len(nodes) - 1:
                     self.lastTurnRight = False
                 else:
-                    print("Invalid path in file")
+                    log.warning("Invalid path in file")
             self.nodes.append(vertices[nodeId])
 
+        # total driving distance along the path
+        self.distance = 0.0
+        for i in range(len(self.nodes) - 1):
+            self.distance += self.nodes[i].findOutEdge(self.nodes[i + 1].id).distance
+
 # pose track data structure specified with paths
 class PathPoseTrack(PoseTrack):
     def __init__(self, path: Path, speed):
+        # continuous position along the current edge
+        self.estimator = EdgeEstimator()
         self.setPath(path)
         v0 = path.nodes[0]
         v1 = path.nodes[1]
@@ -169,8 +273,8 @@ class PathPoseTrack(PoseTrack):
         
         self.movedTime += deltaTime
 
-        # when Cozmo passed current edge
-        if self.movedTime > self.maxTime:
+        # when Cozmo passed current edge, by time or by estimated position
+        if self.movedTime > self.maxTime or self.remainingDistance() < EDGE_END_TOLERANCE:
             self.edgeChanged = True
             # the current path node list is not exhausted
             if self.index < self.length - 2:
@@ -184,6 +288,26 @@ class PathPoseTrack(PoseTrack):
 
             self.index += 1
 
+    def switchEdge(self, edge: Edge, speed, offset = 0.0):
+        super(PathPoseTrack, self).switchEdge(edge, speed, offset)
+        self.estimator.reset()
+
+    # estimated distance left to drive on the current edge
+    def remainingDistance(self):
+        return self.distance - self.estimator.position
+
+    # position of the given vertex along the current edge, in the frame of the estimator
+    # which starts where Cozmo started the edge. None if the vertex is not on the edge
+    def distanceAlongEdge(self, vertex: Vertex):
+        edge = self.edge
+        dx = vertex.x - edge.start.x
+        dy = vertex.y - edge.start.y
+        along = dx * math.cos(edge.radians) + dy * math.sin(edge.radians)
+        across = dy * math.cos(edge.radians) - dx * math.sin(edge.radians)
+        if along < 0 or along > edge.distance or abs(across) > ON_EDGE_TOLERANCE:
+            return None
+        return along + self.distance - edge.distance
+
     def setPath(self, path: Path):
         self.index = 0
         self.path = path
@@ -203,7 +327,8 @@ class PathPoseTrack(PoseTrack):
         
 
 class Track:
-    def __init__(self, path = TRACK_FILE_PATH):
+    # compact: keep the graph in NumPy arrays for constant time edge lookups on large layouts
+    def __init__(self, path = TRACK_FILE_PATH, compact = False):
         path = os.path.join(os.path.dirname(__file__), path)
         
         # vertexId -> vertex object
@@ -212,11 +337,37 @@ class Track:
         self.edges = []
         # (start vertexId, end vertexId) -> path object
         self.paths = {}
-
-        d = None
-        with open(path) as track_data:
-            d = json.load(track_data)
-
+        # (start vertexId, end vertexId) -> (list of vertex ids, firstTurnLeft, lastTurnRight)
+        # precomputed for every pair of buildings
+        self.routes = {}
+
+        with open(path, "rb") as track_data:
+            raw = track_data.read()
+        digest = self.computeDigest(raw)
+        cachePath = os.path.splitext(path)[0] + CACHE_FILE_EXTENSION
+
+        if not self.loadCache(cachePath, digest):
+            self.loadJson(json.loads(raw.decode("utf-8")))
+            self.planRoutes()
+            self.saveCache(cachePath, digest)
+
+        # array backed graph, the vertex and edge objects delegate lookups to it
+        self.graph = None
+        if compact:
+            if np is None:
+                log.warning("Compact track graph needs numpy, using plain objects")
+            else:
+                self.graph = CompactGraph(list(self.vertices.values()), self.edges)
+                for v in self.vertices.values():
+                    v.graph = self.graph
+
+    # the cache is only valid for the same track file content and planner settings
+    def computeDigest(self, raw):
+        h = hashlib.sha1(raw)
+        h.update(("%s %s %s" % (CACHE_VERSION, MAGIC_SCALE, TURN_COST)).encode("utf-8"))
+        return h.hexdigest()
+
+    def loadJson(self, d):
         vertices = d["blvd"]["vertices"]
         for vertexData in vertices:
             v = Vertex(**vertexData)
@@ -232,9 +383,74 @@ class Track:
         for edgeData in edges:
             self.createEdgePair(**edgeData)
 
-        routes = d["routes"]
-        for pathData in routes:
-            self.createPath(**pathData)
+    # restore vertices, edges and routes from the binary cache file
+    # return False if the cache is missing, unreadable, stale or not shaped as saveCache writes it,
+    # the track is then left empty to be planned again
+    def loadCache(self, cachePath, digest):
+        try:
+            with open(cachePath, "rb") as cache_data:
+                d = pickle.load(cache_data)
+            if not isinstance(d, dict) or d.get("version") != CACHE_VERSION or d.get("digest") != digest:
+                return False
+            vertices, edges, routes = self.restoreCache(d)
+        except Exception as e:
+            log.warning("Ignoring track cache %s: %r", cachePath, e)
+            return False
+        self.vertices = vertices
+        self.edges = edges
+        self.routes = routes
+        return True
+
+    # vertices, edges and routes of a loaded cache, raises if it does not hold what saveCache writes
+    def restoreCache(self, d):
+        # vertices are stored in index order, edges and routes refer to them by index
+        vertices = {}
+        ids = []
+        for vertexData in d["vertices"]:
+            if len(vertexData) > 3:
+                v = BldgVertex(*vertexData)
+            else:
+                v = Vertex(*vertexData)
+            vertices[v.id] = v
+            ids.append(v.id)
+
+        edges = []
+        for startIndex, endIndex, distance, radians in d["edges"]:
+            startV = vertices[ids[startIndex]]
+            e = Edge(startV, vertices[ids[endIndex]], distance, radians)
+            edges.append(e)
+            startV.addEdge(e)
+
+        routes = {}
+        for nodeIndices, firstTurnLeft, lastTurnRight in d["routes"]:
+            nodes = [ids[i] for i in nodeIndices]
+            routes[(nodes[0], nodes[-1])] = (nodes, firstTurnLeft, lastTurnRight)
+        return vertices, edges, routes
+
+    # write vertices, edges and routes as plain tuples, keyed by the track digest.
+    # failure is not fatal, the track will be planned again on next start
+    def saveCache(self, cachePath, digest):
+        vertices = list(self.vertices.values())
+        indices = {v.id: i for i, v in enumerate(vertices)}
+        d = {
+            "version": CACHE_VERSION,
+            "digest": digest,
+            "vertices": [self.vertexData(v) for v in vertices],
+            "edges": [(indices[e.start.id], indices[e.end.id], e.distance, e.radians) for e in self.edges],
+            "routes": [([indices[n] for n in nodes], firstTurnLeft, lastTurnRight)
+                       for nodes, firstTurnLeft, lastTurnRight in self.routes.values()]
+        }
+        try:
+            with open(cachePath, "wb") as cache_data:
+                pickle.dump(d, cache_data, pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            log.warning("Unable to write track cache: %s", cachePath)
+
+    # constructor arguments of a vertex, before scaling
+    def vertexData(self, v: Vertex):
+        if isinstance(v, BldgVertex):
+            return (v.id, v.x / MAGIC_SCALE, v.y / MAGIC_SCALE, v.d / MAGIC_SCALE, v.lane)
+        return (v.id, v.x / MAGIC_SCALE, v.y / MAGIC_SCALE)
 
     def createEdgePair(self, start, end, oneway):
         startV = self.vertices[start]
@@ -249,15 +465,88 @@ class Track:
             self.edges.append(e2)
             endV.addEdge(e2)
 
-    def createPathPair(self, nodes):
-        path = Path(nodes, self.vertices)
-        path2 = Path(list(reversed(nodes)), self.vertices)
-        self.storePath(path)
-        self.storePath(path2)
+    # run Dijkstra over edges from startId, so that turning costs and the no U turn rule
+    # can be taken into account. buildings are never passed through, they are only start or destination.
+    # return the edge -> previous edge links, and vertexId -> last edge of the cheapest path reaching it.
+    # stop early once endId is reached, if it is given
+    def searchEdges(self, startId, endId=None):
+        start = self.vertices[startId]
+
+        # edge -> cheapest cost found so far of arriving at its end vertex
+        costs = {}
+        # edge -> edge driven right before it on the cheapest path
+        previous = {}
+        # vertexId -> last edge of the cheapest path arriving at this vertex
+        reached = {}
+        # tie breaker, edges are not comparable in the heap
+        counter = itertools.count()
+        heap = []
+        for e in start.outEdges:
+            costs[e] = e.distance
+            previous[e] = None
+            heapq.heappush(heap, (e.distance, next(counter), e))
+
+        visited = set()
+        while heap:
+            cost, _, edge = heapq.heappop(heap)
+            if edge in visited:
+                continue
+            visited.add(edge)
+
+            if edge.end.id not in reached:
+                reached[edge.end.id] = edge
+                if edge.end.id == endId:
+                    break
+            if isinstance(edge.end, BldgVertex):
+                continue
+
+            for nextEdge in edge.end.outEdges:
+                # avoid U turn
+                if nextEdge.end is edge.start or nextEdge in visited:
+                    continue
+                nextCost = cost + nextEdge.distance + TURN_COST * abs(edge.turnAngle(nextEdge))
+                if nextCost < costs.get(nextEdge, math.inf):
+                    costs[nextEdge] = nextCost
+                    previous[nextEdge] = edge
+                    heapq.heappush(heap, (nextCost, next(counter), nextEdge))
+
+        return previous, reached
+
+    # find the cheapest path from startId to endId
+    def planPath(self, startId, endId) -> Path:
+        previous, reached = self.searchEdges(startId, endId)
+        if endId not in reached:
+            raise KeyError("No path from %s to %s" % (startId, endId))
+        return self.buildPath(reached[endId], previous)
+
+    # fill the route table with the cheapest path between every pair of buildings,
+    # one search per starting building
+    def planRoutes(self):
+        bldgIds = [v.id for v in self.vertices.values() if isinstance(v, BldgVertex)]
+        for startId in bldgIds:
+            previous, reached = self.searchEdges(startId)
+            for endId in bldgIds:
+                if endId != startId and endId in reached:
+                    path = self.buildPath(reached[endId], previous)
+                    self.routes[(startId, endId)] = ([v.id for v in path.nodes], path.firstTurnLeft, path.lastTurnRight)
+
+    # walk back the chain of edges ending with lastEdge, and build the path object
+    # with turning directions decided by the lanes of start and end buildings
+    def buildPath(self, lastEdge, previous) -> Path:
+        nodes = [lastEdge.end.id]
+        edge = lastEdge
+        while edge:
+            nodes.append(edge.start.id)
+            edge = previous[edge]
+        nodes.reverse()
 
-    def createPath(self, nodes):
         path = Path(nodes, self.vertices)
-        self.storePath(path)
+        first, last = path.nodes[0], path.nodes[-1]
+        if isinstance(first, BldgVertex):
+            path.firstTurnLeft = first.isOnLeft(path.nodes[1])
+        if isinstance(last, BldgVertex):
+            path.lastTurnRight = not last.isOnLeft(path.nodes[-2])
+        return path
 
     def storePath(self, path):
         # store this path
@@ -276,9 +565,21 @@ class Track:
         return PoseTrack(self.edges[0], speed)
 
     def getPathPoseTrack(self, speed):
-        return PathPoseTrack(self.paths["GA"]["PH"][0], speed)
+        return PathPoseTrack(self.getPath("GA", "PH", None), speed)
 
     def getPath(self, start, end, second) -> Path:
+        if start not in self.paths or end not in self.paths[start]:
+            route = self.routes.get((start, end))
+            if route:
+                # look up the precomputed route
+                nodes, firstTurnLeft, lastTurnRight = route
+                path = Path(nodes, self.vertices)
+                path.firstTurnLeft = firstTurnLeft
+                path.lastTurnRight = lastTurnRight
+            else:
+                # not between two buildings, plan it now
+                path = self.planPath(start, end)
+            self.storePath(path)
         l = self.paths[start][end]
         # path = next((p for p in l if p.nodes[1].id == second), None)
         return l[0]
@@ -0,0 +1,115 @@
+'''
+Ordering of multiple deliveries in the bag. Autonomous mode, the only mode the planner
+drives in, pays the same tip for a pizza whatever its age as long as it is not gone, so
+the order only minimises the pizzas that miss TIMER_3, finishing earliest among orders
+that miss as few. Cooling once or twice does not change the tip there.
+'''
+import itertools
+import random
+import time
+from Patrol.Track.track import Track, BldgVertex
+
+# seconds after a pizza is spawned when it cools down once, twice, and is gone. The cooling
+# states are shown on the cube (PizzaStore), the planner only looks at TIMER_3
+TIMER_1 = 120
+TIMER_2 = 180
+TIMER_3 = 240
+
+# coins for a pizza delivered in autonomous mode, the only mode the planner drives in.
+# CozmoWorld.correct_house_reached gives them whatever the age of the pizza, as long as
+# it is delivered before it is gone
+AUTONOMOUS_COINS = 2
+
+# approximate seconds spent at a building: turning in, dropping the bag, reacting and backing out
+STOP_DURATION = 12.0
+
+# up to this many stops every visiting order is tried, above it a greedy order is used
+MAX_EXACT_STOPS = 4
+
+# expected tip of a pizza delivered at the given age in seconds, nothing once it is gone
+def expectedTip(age):
+    if age > TIMER_3:
+        return 0.0
+    return float(AUTONOMOUS_COINS)
+
+class DeliveryPlanner:
+    def __init__(self, track: Track):
+        self.track = track
+
+    # seconds needed to drive from one building to another and finish the stop there
+    def travelTime(self, startId, endId, speed):
+        return self.track.getPath(startId, endId, None).distance / speed + STOP_DURATION
+
+    # expected total tip and time when visiting the stops in the given order.
+    # stops: list of (building id, spawn time of the pizza)
+    def evaluate(self, startId, stops, speed, now):
+        tip = 0.0
+        elapsed = 0.0
+        position = startId
+        for bldgId, spawnTime in stops:
+            elapsed += self.travelTime(position, bldgId, speed)
+            tip += expectedTip(now + elapsed - spawnTime)
+            position = bldgId
+        return tip, elapsed
+
+    # order the stops to deliver as many pizzas as possible before they are gone, finishing
+    # earliest among equally good orders
+    def plan(self, startId, stops, speed, now=None):
+        if now is None:
+            now = time.time()
+        if len(stops) <= 1:
+            return list(stops)
+        if len(stops) <= MAX_EXACT_STOPS:
+            return list(max(itertools.permutations(stops), key=lambda order: self.score(startId, order, speed, now)))
+        return self.planGreedy(startId, stops, speed, now)
+
+    def score(self, startId, stops, speed, now):
+        tip, elapsed = self.evaluate(startId, stops, speed, now)
+        return tip, -elapsed
+
+    # repeatedly pick the stop with the best expected tip per second of driving to it,
+    # preferring the oldest pizza, the closest to being gone, on ties
+    def planGreedy(self, startId, stops, speed, now):
+        remaining = list(stops)
+        order = []
+        position = startId
+        elapsed = 0.0
+        while remaining:
+            def rate(stop):
+                duration = self.travelTime(position, stop[0], speed)
+                return expectedTip(now + elapsed + duration - stop[1]) / duration, -stop[1]
+            stop = max(remaining, key=rate)
+            remaining.remove(stop)
+            order.append(stop)
+            elapsed += self.travelTime(position, stop[0], speed)
+            position = stop[0]
+        return order
+
+# compare the expected tips of delivering in bag order, as the first color policy does,
+# with the planned order on seeded random bags
+def benchmark(rounds=2000, seed=0, speed=50):
+    track = Track()
+    planner = DeliveryPlanner(track)
+    rng = random.Random(seed)
+    customers = [v.id for v in track.vertices.values() if isinstance(v, BldgVertex) and v.id not in ("GA", "PH")]
+
+    firstColorTip = 0.0
+    plannedTip = 0.0
+    planTime = 0.0
+    for _ in range(rounds):
+        count = rng.randint(1, min(4, len(customers)))
+        stops = [(bldgId, -rng.uniform(0, TIMER_3)) for bldgId in rng.sample(customers, count)]
+        firstColorTip += planner.evaluate("PH", stops, speed, 0.0)[0]
+
+        start = time.perf_counter()
+        order = planner.plan("PH", stops, speed, 0.0)
+        planTime += time.perf_counter() - start
+        plannedTip += planner.evaluate("PH", order, speed, 0.0)[0]
+
+    print("rounds: %d, speed: %d mm/s" % (rounds, speed))
+    print("first color policy: %.3f expected tip per bag" % (firstColorTip / rounds))
+    print("planned order:      %.3f expected tip per bag" % (plannedTip / rounds))
+    print("planning time:      %.3f ms per bag" % (planTime / rounds * 1000))
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,14 +1,20 @@
 import cozmo
 import cozmo.event
 import asyncio
+import logging
 import time
 import threading
 import random
-from Patrol.Track.track import Track, BldgVertex
+import math
+from Patrol.Track.track import Track, BldgVertex, EDGE_END_TOLERANCE
+from Patrol.delivery import DeliveryPlanner
+from ActionScheduler import run_when_free
 from cozmo.util import radians, degrees, distance_mm, speed_mmps
 from cozmo.objects import CustomObjectMarkers, CustomObjectTypes
 from cozmo.anim import Triggers
 
+log = logging.getLogger(__name__)
+
 # time of updating frame
 FRAME_DURATION = 0.08
 # forward speed when Cozmo is unhappy
@@ -20,6 +26,8 @@ EPSILON = 0.00001
 
 # approximate scale from real world distance to pixel numbers in vision
 DISTANCE_TO_PIXEL_SCALE = 4.0
+# longest drive along an edge between two position corrections, in mm
+SEGMENT_LENGTH = 150.0
 
 # mapping from color name to building id, note some building ids are switched intentionally
 COLOR_TO_BLDG = {
@@ -29,6 +37,11 @@ COLOR_TO_BLDG = {
     "Yellow": "YB",
     "Magenta": "MB"
 }
+# building ids of the markers which are not pizza buyers
+MARKER_NAME_TO_BLDG = {
+    "Shop": "PH",
+    "Garage": "GA"
+}
 DELIVERY_UNIVERSE = [{"color": "Blue"},{"color": "Red"},{"color": "Green"},{"color": "Yellow"},{"color": "Magenta"}]
 # normal (unhappy) autonomous delivery, at most once
 MAX_DELIVERY = 0
@@ -44,7 +57,11 @@ ATTENTION_TRIGGERS = [cozmo.anim.Triggers.CantHandleTallStack, cozmo.anim.Trigge
 class Patrol:
     def __init__(self, remote=None, robot=None):
         self.remote = remote
+        # random of the game when run from CozmoWorld, recorded with the session
+        self.rng = remote.rng if remote else random
         self.track = Track()
+        # orders the deliveries when the bag holds several pizzas
+        self.deliveryPlanner = DeliveryPlanner(self.track)
         
         self.robot = robot
 
@@ -56,6 +73,7 @@ class Patrol:
         
         # pose track, about the map data structure
         self.poseTrack = None
+        self.pathPoseTrack = None
         # starting pose, about the real world
         self.initialPose = None
         
@@ -73,6 +91,13 @@ class Patrol:
         # whether offset updating is accepted, ignoring markers in vision in cirtain cases
         self.acceptOffset = False
 
+        # whether Cozmo is driving along an edge, markers seen are then used to correct the position
+        self.drivingEdge = False
+        # robot pose when the current edge was started, odometry is measured from it
+        self.edgeStartPose = None
+        # difference between the position from the last marker seen and odometry, used after the segment
+        self.markerFix = None
+
         # variable related to self termination
         self.deliveryCount = 0
         self.attentionCount = 0
@@ -83,7 +108,7 @@ class Patrol:
         self.maxDelivery = MAX_DELIVERY
 
         if remote:
-            remote.cozmo.world.add_event_handler(cozmo.objects.EvtObjectAppeared, self.onMarkerSeen)
+            remote.cozmo.world.add_event_handler(cozmo.objects.EvtObjectObserved, self.onMarkerSeen)
         
     # entrance of cozmo connection if directly run in main function
     async def run(self, coz_conn: cozmo.conn.CozmoConnection):
@@ -132,9 +157,9 @@ class Patrol:
 
         try:
             obj = await self.waitForObservedCustomObject(robot, timeout=30)
-            print("Found custom obj: %s" % obj)
+            log.debug("Found custom obj: %s", obj)
         except asyncio.TimeoutError:
-            print("Didn't find a custom object")
+            log.info("Didn't find a custom object")
         finally:
             lookAround.stop()
 
@@ -173,7 +198,7 @@ class Patrol:
         self.stopped = False
 
         await robot.drive_wheels(self.forwardSpeed, self.forwardSpeed)
-        print(self.poseTrack.edge.end.id)
+        log.debug("Towards %s", self.poseTrack.edge.end.id)
         
         while not self.stopped:
 
@@ -193,8 +218,8 @@ class Patrol:
                 self.poseTrack.consumeEdgeChangeSignal()
                 self.driveOnRoad = True
                 
-                print("fix position at initial pose")
-                print(self.poseTrack.edge.end.id)
+                log.debug("fix position at initial pose")
+                log.debug("Towards %s", self.poseTrack.edge.end.id)
             # at any other cross or corner
             elif self.poseTrack.consumeEdgeChangeSignal():
                 self.driveOnRoad = False
@@ -207,12 +232,12 @@ class Patrol:
                     # make a turn
                     angle = radians(angleAbs + self.initialPose.rotation.angle_z.radians - robot.pose.rotation.angle_z.radians)
                     await robot.turn_in_place(angle).wait_for_completed()
-                    print("make a turn")
+                    log.debug("make a turn")
                     # restart motion
                     await robot.drive_wheels(self.forwardSpeed, self.forwardSpeed)
                 self.driveOnRoad = True
                 
-                print(self.poseTrack.edge.end.id)
+                log.debug("Towards %s", self.poseTrack.edge.end.id)
 
             # let Cozmo drive straight for a short time before updates
             await asyncio.sleep(FRAME_DURATION)
@@ -236,11 +261,11 @@ class Patrol:
         self.deliveryCount = 0
         self.attentionCount = 0
 
-        print("start drive")
+        log.debug("start drive")
 ##        await robot.drive_wheels(FORWARD_SPEED, FORWARD_SPEED)
-        print(self.pathPoseTrack.distance)
-        await robot.drive_straight(distance_mm(self.pathPoseTrack.distance), speed_mmps(self.forwardSpeed)).wait_for_completed()
-        print(self.pathPoseTrack.edge.end.id)
+        log.debug("Path distance %s", self.pathPoseTrack.distance)
+        await self.driveEdge(robot)
+        log.debug("Towards %s", self.pathPoseTrack.edge.end.id)
         
         while not self.stopped:
 
@@ -248,12 +273,12 @@ class Patrol:
             # picking next edge if the current is finished
             if self.driveOnRoad:
 ##                self.pathPoseTrack.update(FRAME_DURATION, FORWARD_SPEED)
-                # finish this path, because drive_straight is used and waited to finish
-                self.pathPoseTrack.update(999, self.forwardSpeed)
+                # the edge is finished once driveEdge brought the estimated position to its end
+                self.pathPoseTrack.update(0.0, self.forwardSpeed)
 
             # did the last auto delivery
             if self.deliveryCount > self.maxDelivery:
-                await robot.play_anim_trigger(random.choice(ATTENTION_TRIGGERS)).wait_for_completed()
+                await run_when_free(lambda: robot.play_anim_trigger(self.rng.choice(ATTENTION_TRIGGERS)))
                 self.attentionCount = self.attentionCount + 1
             # end of the path
             elif self.pathPoseTrack.consumeRouteEndSignal():
@@ -279,7 +304,7 @@ class Patrol:
                 if self.deliveryCount <= self.maxDelivery:
                     await self.depart(robot)
 
-                print("Move towards: %s" % self.pathPoseTrack.edge.end.id)
+                log.debug("Move towards: %s", self.pathPoseTrack.edge.end.id)
                 
             # at any road intersection
             elif self.pathPoseTrack.consumeEdgeChangeSignal():
@@ -292,22 +317,16 @@ class Patrol:
                     robot.stop_all_motors()
                     # make a turn
                     angle = radians(angleAbs + self.initialPose.rotation.angle_z.radians - robot.pose.rotation.angle_z.radians)
-                    await robot.turn_in_place(angle).wait_for_completed()
-                    print("turn of angle: ", angle.degrees)
+                    await run_when_free(lambda: robot.turn_in_place(angle))
+                    log.debug("turn of angle: %s", angle.degrees)
                     # restart motion
 ##                    await robot.drive_wheels(FORWARD_SPEED, FORWARD_SPEED)
 
-                anim_done = False;
-                while anim_done is False:
-                    try:
-                        await robot.drive_straight(distance_mm(self.pathPoseTrack.distance), speed_mmps(self.forwardSpeed)).wait_for_completed()
-                        anim_done = True
-                    except cozmo.exceptions.RobotBusy:
-                        await asyncio.sleep(0.1);
+                await self.driveEdge(robot)
 
                 self.driveOnRoad = True
                 
-                print("Move towards: %s" % self.pathPoseTrack.edge.end.id)
+                log.debug("Move towards: %s", self.pathPoseTrack.edge.end.id)
 
             # let Cozmo drive straight for a short time before updates
             await asyncio.sleep(FRAME_DURATION)
@@ -315,10 +334,71 @@ class Patrol:
         robot.stop_all_motors()
 
     async def depart(self, robot: cozmo.robot.Robot):
-        await robot.drive_straight(distance_mm(self.pathPoseTrack.distance), speed_mmps(self.forwardSpeed)).wait_for_completed()    
+        await self.driveEdge(robot)
         self.driveOnRoad = True
         self.waitForOrder = False
 
+    # drive along the current edge in short segments. after each segment the estimated position
+    # is corrected with odometry and the last building marker seen, and the rest of the edge
+    # is driven from the estimate instead of the planned length
+    async def driveEdge(self, robot: cozmo.robot.Robot):
+        estimator = self.pathPoseTrack.estimator
+        self.edgeStartPose = robot.pose
+        self.markerFix = None
+        self.drivingEdge = True
+        try:
+            while not self.stopped:
+                remaining = self.pathPoseTrack.remainingDistance()
+                if remaining < EDGE_END_TOLERANCE:
+                    break
+                segment = min(remaining, SEGMENT_LENGTH)
+
+                await run_when_free(lambda: robot.drive_straight(distance_mm(segment), speed_mmps(self.forwardSpeed)))
+
+                estimator.predict(segment)
+                travelled = self.odometryAlongEdge(robot.pose)
+                estimator.updateOdometry(travelled)
+                if self.markerFix is not None:
+                    estimator.updateMarker(travelled + self.markerFix)
+                    self.markerFix = None
+        finally:
+            self.drivingEdge = False
+
+    # distance from the edge start pose to the given pose, along the heading at the edge start
+    def odometryAlongEdge(self, pose):
+        heading = self.edgeStartPose.rotation.angle_z.radians
+        dx = pose.position.x - self.edgeStartPose.position.x
+        dy = pose.position.y - self.edgeStartPose.position.y
+        return dx * math.cos(heading) + dy * math.sin(heading)
+
+    # building id of a custom marker, None if unknown
+    def markerBuildingId(self, obj):
+        if not self.remote:
+            return None
+        name = self.remote.buildingMaps.get(obj.object_type)
+        return COLOR_TO_BLDG.get(name, MARKER_NAME_TO_BLDG.get(name))
+
+    # measure the position along the current edge from a marker of a building on that edge,
+    # and keep it relative to odometry until the current segment is finished
+    def fuseMarker(self, obj):
+        bldgId = self.markerBuildingId(obj)
+        if bldgId is None:
+            return
+        markerAlong = self.pathPoseTrack.distanceAlongEdge(self.track.vertices[bldgId])
+        if markerAlong is None:
+            return
+        heading = self.edgeStartPose.rotation.angle_z.radians
+        # use the distance and bearing measured by the proximity engine for all markers in view
+        measured = self.remote.proximity.measurement(obj)
+        if measured:
+            dist, bearing = measured
+            ahead = dist * math.cos(bearing + self.robot.pose.rotation.angle_z.radians - heading)
+        else:
+            dx = obj.pose.position.x - self.robot.pose.position.x
+            dy = obj.pose.position.y - self.robot.pose.position.y
+            ahead = dx * math.cos(heading) + dy * math.sin(heading)
+        self.markerFix = markerAlong - ahead - self.odometryAlongEdge(self.robot.pose)
+
     def findAndUpdatePath(self, startId, endId, nextId):
         path = self.track.getPath(startId, endId, nextId)
         # offset = -(self.offsetPixel / DISTANCE_TO_PIXEL_SCALE)
@@ -333,7 +413,7 @@ class Patrol:
         else:
             # Mock the colors in bag-----------------
             if bldgId == "PH":
-                deliveryBag.append(random.choice(DELIVERY_UNIVERSE))
+                deliveryBag.append(self.rng.choice(DELIVERY_UNIVERSE))
                 pass
             elif bldgId == "RB":
                 # deliveryBag.append({"color":"Blue"})
@@ -341,12 +421,15 @@ class Patrol:
             # mock finish-------------------------------
 
         destId = None
-        colorName = next((n["color"] for n in deliveryBag if n is not None), None)
-        print("Color: %s" % colorName)
+        # (building id, spawn time of the pizza) for every pizza to deliver elsewhere
+        now = time.time()
+        stops = [(COLOR_TO_BLDG[n["color"]], n.get("time", now)) for n in deliveryBag
+                 if n is not None and COLOR_TO_BLDG[n["color"]] != bldgId]
+        log.info("Deliveries: %s", stops)
         
-        # bag contains some pizza
-        if colorName:
-            destId = COLOR_TO_BLDG[colorName]
+        # bag contains some pizza, go to the first stop of the best delivery order
+        if stops:
+            destId = self.deliveryPlanner.plan(bldgId, stops, self.forwardSpeed, now)[0][0]
         # bas is empty
         else:
             if robot.battery_voltage < 3.5:
@@ -372,31 +455,27 @@ class Patrol:
     async def deliverItem(self, robot: cozmo.robot.Robot, bldg: BldgVertex, destTurnRight=True):
         pose = robot.pose
         # turn to the lane
-        await robot.turn_in_place(degrees(-90 * self.flagToScale(destTurnRight))).wait_for_completed()
+        await run_when_free(lambda: robot.turn_in_place(degrees(-90 * self.flagToScale(destTurnRight))))
         # approach the marker
-        await robot.drive_straight(distance_mm(bldg.d), speed_mmps(self.forwardSpeed / 2)).wait_for_completed()
+        await run_when_free(lambda: robot.drive_straight(distance_mm(bldg.d), speed_mmps(self.forwardSpeed / 2)))
         
-        # protected action
-        anim_done = False;
-        while anim_done is False:
-            try:
-                await robot.set_head_angle(degrees(30)).wait_for_completed();
-                anim_done = True
-            except cozmo.exceptions.RobotBusy:
-                await asyncio.sleep(0.1);
-
-        self.waitForAnimation = True
+        await run_when_free(lambda: robot.set_head_angle(degrees(30)))
+
+        bldgId = self.pathPoseTrack.edge.start.id
+        # at the pizzeria wait for pizzas lit on the cube, they may have been lit already as Cozmo came near
+        atShop = bldgId == "PH" and self.remote
+        self.waitForAnimation = not atShop
         # open offset window
         self.acceptOffset = True
         # drop bag
-        await robot.set_lift_height(0.0 + EPSILON).wait_for_completed()
+        await run_when_free(lambda: robot.set_lift_height(0.0 + EPSILON))
         await asyncio.sleep(0.1)
         self.acceptOffset = False
 
-        print("Start waiting for animation")
+        log.debug("Start waiting for animation")
         if self.remote:
             waitingTime = 0.0
-            while self.waitForAnimation:
+            while self.waitForAnimation or (atShop and not self.remote.lights_on):
                 await asyncio.sleep(0.1)
                 # autonomous turned off
                 if self.stopped:
@@ -409,15 +488,14 @@ class Patrol:
         # remote controller not present, mock the behavior
         else:
             await asyncio.sleep(5)
-        print("Finish waiting for animation")
+        log.debug("Finish waiting for animation")
 
-        bldgId = self.pathPoseTrack.edge.start.id
         # sad reaction before picking up cube
         if bldgId == "PH" and self.mood < 0:
-            await robot.play_anim_trigger(cozmo.anim.Triggers.FrustratedByFailureMajor).wait_for_completed()
+            await run_when_free(lambda: robot.play_anim_trigger(cozmo.anim.Triggers.FrustratedByFailureMajor))
             await asyncio.sleep(1);
 
-        await robot.set_lift_height(1.0 - EPSILON).wait_for_completed()
+        await run_when_free(lambda: robot.set_lift_height(1.0 - EPSILON))
 
         # parameters for path finding
         nextId = self.pathPoseTrack.edge.end.id
@@ -428,23 +506,23 @@ class Patrol:
 
 
         # back to road
-        await robot.drive_straight(distance_mm(-bldg.d), speed_mmps(self.forwardSpeed / 2)).wait_for_completed()
+        await run_when_free(lambda: robot.drive_straight(distance_mm(-bldg.d), speed_mmps(self.forwardSpeed / 2)))
         
         # delivery count not at max, drive normally
         if self.deliveryCount <= self.maxDelivery:
-            await robot.turn_in_place(degrees(90 * self.flagToScale(initTurnLeft))).wait_for_completed()
+            await run_when_free(lambda: robot.turn_in_place(degrees(90 * self.flagToScale(initTurnLeft))))
             offset = -(self.offsetPixel / DISTANCE_TO_PIXEL_SCALE)
             if abs(offset) < 200:
                 self.pathPoseTrack.updateOffset(offset * self.flagToScale(initTurnLeft))
         # the very first attention reaction
         elif self.attentionCount == 0 and self.mood < 0:
             await self.remote.stopSadMusic()
-            await robot.turn_in_place(degrees(180)).wait_for_completed()
-            await robot.say_text("I don't want to work").wait_for_completed()
+            await run_when_free(lambda: robot.turn_in_place(degrees(180)))
+            await run_when_free(lambda: robot.say_text("I don't want to work"))
         
     # turn and drive backwards to return to garage
     async def backInGarage(self, robot: cozmo.robot.Robot, ccrflag: bool):
-        await robot.turn_in_place(degrees(90 * self.flagToScale(ccrflag))).wait_for_completed()
+        await run_when_free(lambda: robot.turn_in_place(degrees(90 * self.flagToScale(ccrflag))))
         await robot.drive_wheels(-self.forwardSpeed / 2, -self.forwardSpeed / 2)
         await asyncio.sleep(2)
         robot.stop_all_motors()
@@ -453,6 +531,16 @@ class Patrol:
     def change_mood(self, value):
         self.mood = value;
 
+    # distance (mm) left to drive to a building along the track, None when not driving a path
+    def distanceTo(self, bldgId):
+        if not self.started or self.pathPoseTrack is None:
+            return None
+        edge = self.pathPoseTrack.edge
+        remaining = self.pathPoseTrack.remainingDistance()
+        if edge.end.id == bldgId:
+            return remaining
+        return remaining + self.track.getPath(edge.end.id, bldgId, None).distance
+
     # disable autonomous mode. terminate autonomous execution if running
     def disableAuto(self):
         if not self.stopped:
@@ -476,10 +564,12 @@ class Patrol:
     def onMarkerSeen(self, evt: cozmo.objects.EvtObjectObserved, image_box=None, obj=None, pose=None, **kwargs):
         if self.acceptOffset and isinstance(obj, cozmo.objects.CustomObject):
             self.offsetPixel = image_box.top_left_x + image_box.width * 0.5 - 160
-            print("custom marker offset in pixels: ", self.offsetPixel)
+            log.debug("custom marker offset in pixels: %s", self.offsetPixel)
+        elif self.drivingEdge and isinstance(obj, cozmo.objects.CustomObject):
+            self.fuseMarker(obj)
 
     async def onReactiveAnimationFinished(self):
-        print("ANIMATION FINISHED");
+        log.debug("ANIMATION FINISHED")
         self.waitForAnimation = False
 
     # define custom objects. Is called only when remote controller not present
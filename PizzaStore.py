@@ -0,0 +1,107 @@
+import heapq
+import itertools
+from Patrol.delivery import TIMER_1, TIMER_2, TIMER_3
+
+'''
+@class PizzaStore
+Keeps the pizzas waiting at the pizzeria and the pizzas lit on the cube, indexed by pizza number and
+color, together with a heap of the time each of them next changes state (cools once, cools twice, is
+gone). Every update only looks at the pizzas whose time has come, and every change happens once. The
+store is only used on the event loop of the robot (game update, spawner, event handlers and web request
+calls), so it takes no lock.
+@author - Wizards of Coz
+'''
+
+# states of a pizza, in the order they happen
+HOT = 0
+COOLED_1 = 1
+COOLED_2 = 2
+GONE = 3
+
+# seconds after spawning when each state starts
+STATE_TIMES = [0, TIMER_1, TIMER_2, TIMER_3]
+
+def state_at(elapsed):
+    if elapsed > TIMER_3:
+        return GONE
+    elif elapsed > TIMER_2:
+        return COOLED_2
+    elif elapsed > TIMER_1:
+        return COOLED_1
+    return HOT
+
+class PizzaStore:
+    def __init__(self):
+        self.queue = {}                 # pizza number -> {'time', 'pizza'}, ready to be picked up at the pizzeria
+        self.lights = {}                # color -> {'color', 'time', 'light', 'state'}, lit on the cube
+        self.deadlines = []             # heap of (time of next state, tie breaker, pizza or light)
+        self.counter = itertools.count()
+
+    def schedule(self, item, state):
+        if state < GONE:
+            deadline = item['time'] + STATE_TIMES[state + 1]
+            heapq.heappush(self.deadlines, (deadline, next(self.counter), item))
+
+    # Pizzas ready at the pizzeria
+    def add_to_queue(self, pizza):
+        self.queue[pizza['pizza']] = pizza
+        # only going away matters while waiting in the queue
+        heapq.heappush(self.deadlines, (pizza['time'] + TIMER_3, next(self.counter), pizza))
+
+    def in_queue(self, number):
+        return number in self.queue
+
+    def queue_size(self):
+        return len(self.queue)
+
+    # Returns all the pizzas in the queue and empties it
+    def take_queue(self):
+        pizzas = list(self.queue.values())
+        self.queue = {}
+        return pizzas
+
+    # Pizzas lit on the cube
+    def light(self, color, pizza_time, light):
+        item = {'color': color, 'time': pizza_time, 'light': light, 'state': HOT}
+        self.lights[color] = item
+        self.schedule(item, HOT)
+        return item
+
+    def is_lit(self, color):
+        return color in self.lights
+
+    def get_light(self, color):
+        return self.lights.get(color)
+
+    def remove_light(self, color):
+        return self.lights.pop(color, None)
+
+    def lit_count(self):
+        return len(self.lights)
+
+    # Lit pizzas, in the order they were lit
+    def lit(self):
+        return list(self.lights.values())
+
+    # Moves every pizza whose time has come to its current state. Pizzas gone are removed.
+    # Returns the lit pizzas which changed state, with their new state in item['state']
+    def poll(self, now):
+        changed = []
+        while self.deadlines and self.deadlines[0][0] < now:
+            _, _, item = heapq.heappop(self.deadlines)
+            if 'color' in item:
+                # skip pizzas delivered or removed since they were scheduled
+                if self.lights.get(item['color']) is not item:
+                    continue
+                state = state_at(now - item['time'])
+                if state <= item['state']:
+                    continue
+                item['state'] = state
+                if state == GONE:
+                    del self.lights[item['color']]
+                else:
+                    self.schedule(item, state)
+                changed.append(item)
+            elif self.queue.get(item['pizza']) is item:
+                del self.queue[item['pizza']]
+        return changed
@@ -0,0 +1,159 @@
+import asyncio
+import collections
+import concurrent.futures
+import io
+import sys
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("Cannot import numpy: Do `pip3 install --user numpy` to install")
+
+try:
+    from PIL import Image
+except ImportError:
+    sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
+
+'''
+@class PreRoll
+The last seconds of Cozmo's camera, always on, so a memory can be saved after the moment it is about (the
+hit of the arcade, the start of the ride): snapshot() gives the frames from some seconds before it was
+called to some seconds after. Frames are kept JPEG compressed, at most PREROLL_FPS of them a second, and
+the oldest are dropped once they are older than the seconds kept or the bytes kept are over the limit, so
+the memory used stays the same however long the game runs. Compression runs on a thread of its own; the
+camera handler only copies the frame, and drops it while the previous one is still being compressed.
+@author - Wizards of Coz
+'''
+
+PREROLL_SECONDS = 8.0       # seconds of camera kept, the furthest back a memory can start
+PREROLL_BYTES = 4 << 20     # most bytes of compressed frames kept, whatever the seconds
+PREROLL_FPS = 10.0          # frames kept a second, the rate memories were always taken at
+PREROLL_QUALITY = 80        # JPEG quality of the frames kept
+
+SNAPSHOT_BEFORE = 6.0       # seconds of a memory before it is saved
+SNAPSHOT_AFTER = 2.0        # and after
+
+# JPEG of an RGB frame
+def compress(frame, quality=PREROLL_QUALITY):
+    out = io.BytesIO()
+    Image.fromarray(frame).save(out, 'JPEG', quality=quality)
+    return out.getvalue()
+
+class PreRoll:
+    def __init__(self, seconds=PREROLL_SECONDS, max_bytes=PREROLL_BYTES, fps=PREROLL_FPS, quality=PREROLL_QUALITY):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.interval = 1.0 / fps
+        self.quality = quality
+        self.frames = collections.deque()   # (time, JPEG), oldest first
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.compressor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.busy = False                   # a frame is being compressed
+        self.taken_at = -float("inf")
+
+        self.taken = 0
+        self.dropped = 0                    # frames due while the previous one was still being compressed
+        self.evicted = 0
+
+    # Called with every camera image (PIL image or array), keeps one every interval
+    def offer(self, image, timestamp=None):
+        now = time.monotonic() if timestamp is None else timestamp
+        if now - self.taken_at < self.interval:
+            return False
+        if self.busy:
+            self.dropped += 1
+            return False
+        self.taken_at = now
+        self.busy = True
+        self.compressor.submit(self.compress_frame, np.array(image), now)
+        return True
+
+    # Runs on the compressor thread
+    def compress_frame(self, frame, timestamp):
+        try:
+            self.add(timestamp, compress(frame, self.quality))
+        finally:
+            self.busy = False
+
+    def add(self, timestamp, data):
+        with self.lock:
+            self.frames.append((timestamp, data))
+            self.bytes += len(data)
+            self.taken += 1
+            while self.frames and (timestamp - self.frames[0][0] > self.seconds or self.bytes > self.max_bytes):
+                self.bytes -= len(self.frames.popleft()[1])
+                self.evicted += 1
+
+    # Frames kept taken after start and up to end, as (time, JPEG)
+    def between(self, start, end):
+        with self.lock:
+            return [(t, data) for t, data in self.frames if start < t <= end]
+
+    # JPEGs of the frames from before seconds ago to after seconds from now. The frames already kept are held
+    # at once, so the ones dropped from the buffer meanwhile are still in the memory.
+    async def snapshot(self, before=SNAPSHOT_BEFORE, after=SNAPSHOT_AFTER):
+        trigger = time.monotonic()
+        frames = self.between(trigger - before, trigger + after)
+        # one interval more for the last frame to be compressed
+        await asyncio.sleep(after + self.interval)
+        start = frames[-1][0] if frames else trigger - before
+        frames += self.between(start, trigger + after)
+        return [data for t, data in frames]
+
+    def stats(self):
+        with self.lock:
+            seconds = self.frames[-1][0] - self.frames[0][0] if self.frames else 0.0
+            return {'frames': len(self.frames), 'bytes': self.bytes, 'seconds': seconds,
+                    'taken': self.taken, 'dropped': self.dropped, 'evicted': self.evicted}
+
+    def shutdown(self):
+        self.compressor.shutdown()
+
+# Memory of the buffer over hours of camera in simulated time, and what keeping a frame costs the camera
+# handler and the compressor thread
+if __name__ == '__main__':
+    import resource
+    import tracemalloc
+    from EncodingService import test_frames
+
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0
+    camera = [np.asarray(frame) for frame in test_frames()]
+
+    preroll = PreRoll()
+    offer_cost = 0.0
+    for i in range(200):
+        start = time.perf_counter()
+        preroll.offer(camera[i % len(camera)], i * preroll.interval)
+        offer_cost += time.perf_counter() - start
+        while preroll.busy:
+            time.sleep(0.0005)
+    start = time.perf_counter()
+    compressed = [compress(frame) for frame in camera]
+    compress_cost = (time.perf_counter() - start) / len(camera)
+    preroll.shutdown()
+
+    # the frames go in as new copies of the JPEGs of the test frames, compressing each one again is the same
+    # memory but hours of compressing
+    preroll = PreRoll()
+    tracemalloc.start()
+    frames = int(hours * 3600 / preroll.interval)
+    for i in range(frames):
+        t = i * preroll.interval
+        preroll.add(t, bytes(bytearray(compressed[i % len(camera)])))
+        if i % int(1800 / preroll.interval) == 0:
+            current, peak = tracemalloc.get_traced_memory()
+            stats = preroll.stats()
+            print("%5.0f min: %3d frames, %4.1f s, %5d KB kept, traced %5d KB (peak %5d KB), max RSS %d MB" % (
+                t / 60, stats['frames'], stats['seconds'], stats['bytes'] // 1024, current // 1024, peak // 1024,
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+    stats = preroll.stats()
+    print("%d frames in %.1f hours, %.1f us per frame on the camera handler, %.2f ms per frame on the compressor,"
+          " %d KB kept, raw frames would be %d KB" % (frames, hours, offer_cost / 200 * 1e6, compress_cost * 1000,
+                                                   stats['bytes'] // 1024, stats['frames'] * camera[0].nbytes // 1024))
+    start = time.perf_counter()
+    held = preroll.between(t - SNAPSHOT_BEFORE, t)
+    print("snapshot of %d frames, %d KB, held in %.1f us" % (len(held), sum(len(data) for _, data in held) // 1024,
+                                                          (time.perf_counter() - start) * 1e6))
@@ -0,0 +1,187 @@
+import asyncio
+import math
+import time
+import types
+import cozmo
+from Metrics import metrics
+import numpy as np
+
+'''
+@class ProximityEngine
+Tells the experience when Cozmo gets near a building, reacting to marker and robot pose events
+instead of polling. Every building has a zone entered below a distance and left above that distance
+plus a hysteresis margin, and a handler from a table is dispatched when Cozmo enters the zone. Zones
+that repeat dispatch it again while he stays inside, so a handler whose guard could not pass yet (a
+cooldown, not enough coins) reacts once it can, without Cozmo having to leave and come back.
+@author - Wizards of Coz
+'''
+
+# extra distance (mm) Cozmo has to move away before leaving a zone, so he doesn't flicker on its border
+HYSTERESIS = 100
+# initial number of markers the position buffers hold, doubled when more are in view
+INITIAL_CAPACITY = 16
+
+class Zone:
+    def __init__(self, handler, enter, enter_autonomous=None, repeat=False, interval=0.0):
+        self.handler = handler                  # coroutine function called with the distance to the building
+        self.enter = enter                      # distance (mm) below which the zone is entered
+        self.enter_autonomous = enter_autonomous if enter_autonomous is not None else enter
+        self.repeat = repeat                    # dispatch again while inside, not only on entering
+        self.interval = interval                # seconds at least between two dispatches while inside
+        self.dispatched = 0.0                   # time of the last dispatch
+
+    def enter_distance(self, is_autonomous):
+        return self.enter_autonomous if is_autonomous else self.enter
+
+class ProximityEngine:
+    def __init__(self, robot: cozmo.robot.Robot, instance):
+        self.robot = robot
+        self.mainInstance = instance            # provides buildingMaps and is_autonomous_mode
+        self.zones = {}                         # building name -> Zone
+        self.visible_objects = []               # custom markers currently in view
+        self.inside = set()                     # buildings whose zone Cozmo is in
+        self.running = set()                    # buildings whose handler has not finished yet
+        self.pose_handler = None                # robot state handler, only registered while markers are in view
+
+        # buffers reused by every measure() call, row i belongs to visible_objects[i]
+        self.positions = np.empty((INITIAL_CAPACITY, 2))
+        self.distances = np.empty(INITIAL_CAPACITY)
+        self.bearings = np.empty(INITIAL_CAPACITY)
+        self.measured_objects = []              # markers of the last measure(), in row order
+
+    def add_zone(self, building, handler, enter, enter_autonomous=None, repeat=False, interval=0.0):
+        self.zones[building] = Zone(handler, enter, enter_autonomous, repeat, interval)
+
+    def object_appeared(self, obj):
+        if obj in self.visible_objects:
+            return
+        self.visible_objects.append(obj)
+        if self.pose_handler is None:
+            self.pose_handler = self.robot.add_event_handler(cozmo.robot.EvtRobotStateUpdated, self.on_robot_state_updated)
+        self.check(obj)
+
+    def object_disappeared(self, obj):
+        if obj not in self.visible_objects:
+            return
+        self.visible_objects.remove(obj)
+        self.inside.discard(self.building_of(obj))
+        # nothing left to watch, stop listening to pose updates
+        if len(self.visible_objects) == 0 and self.pose_handler is not None:
+            self.pose_handler.disable()
+            self.pose_handler = None
+
+    # the marker pose was updated
+    def object_observed(self, obj):
+        if obj in self.visible_objects:
+            self.check(obj)
+
+    # Cozmo moved, check all markers in view
+    def on_robot_state_updated(self, event, **kw):
+        with metrics.span("proximity_update_seconds"):
+            count = self.measure()
+            for i in range(count):
+                self.check(self.visible_objects[i], self.distances.item(i))
+
+    # distances (mm) and bearings (radians, relative to Cozmo's heading) of all the markers in view,
+    # computed in one go into the reused buffers. Returns the number of markers measured
+    def measure(self):
+        count = len(self.visible_objects)
+        if count > len(self.distances):
+            capacity = max(count, 2 * len(self.distances))
+            self.positions = np.empty((capacity, 2))
+            self.distances = np.empty(capacity)
+            self.bearings = np.empty(capacity)
+
+        pose = self.robot.pose
+        positions = self.positions[:count]
+        positions[:] = [(obj.pose.position.x, obj.pose.position.y) for obj in self.visible_objects]
+        positions -= (pose.position.x, pose.position.y)
+        distances = self.distances[:count]
+        bearings = self.bearings[:count]
+        np.hypot(positions[:, 0], positions[:, 1], out=distances)
+        np.arctan2(positions[:, 1], positions[:, 0], out=bearings)
+        # relative to the heading, wrapped to [-pi, pi)
+        bearings -= pose.rotation.angle_z.radians - math.pi
+        np.mod(bearings, 2 * math.pi, out=bearings)
+        bearings -= math.pi
+
+        self.measured_objects = list(self.visible_objects)
+        return count
+
+    # last (distance, bearing) measured for a marker, None if it was not in view then
+    def measurement(self, obj):
+        for i, measured in enumerate(self.measured_objects):
+            if measured is obj:
+                return self.distances.item(i), self.bearings.item(i)
+        return None
+
+    def building_of(self, obj):
+        return self.mainInstance.buildingMaps.get(obj.object_type)
+
+    def distance_to_object(self, obj):
+        return math.hypot(obj.pose.position.x - self.robot.pose.position.x,
+                          obj.pose.position.y - self.robot.pose.position.y)
+
+    # update the zone state of the building of this marker and dispatch its handler
+    def check(self, obj, dist=None):
+        metrics.count("proximity_checks_total")
+        building = self.building_of(obj)
+        zone = self.zones.get(building)
+        if zone is None:
+            return
+
+        if dist is None:
+            dist = self.distance_to_object(obj)
+        enter = zone.enter_distance(self.mainInstance.is_autonomous_mode)
+        if building not in self.inside:
+            if dist < enter:
+                self.inside.add(building)
+                self.dispatch(building, zone, dist)
+        elif dist > enter + HYSTERESIS:
+            self.inside.discard(building)
+        elif zone.repeat and time.time() - zone.dispatched >= zone.interval:
+            self.dispatch(building, zone, dist)
+
+    # run the handler unless the previous one for this building is still running
+    def dispatch(self, building, zone, dist):
+        if building in self.running:
+            return
+        self.running.add(building)
+        zone.dispatched = time.time()
+        asyncio.ensure_future(self.run_handler(building, zone, dist))
+
+    async def run_handler(self, building, zone, dist):
+        try:
+            await zone.handler(dist)
+        finally:
+            self.running.discard(building)
+
+# compare the distance computation per marker, as it was done before with a fresh array for every
+# marker, with the batched measure() at 1, 10 and 100 markers in view
+def benchmark(rounds=2000):
+    def pose(x, y, angle=0.0):
+        return types.SimpleNamespace(position=types.SimpleNamespace(x=x, y=y),
+                                     rotation=types.SimpleNamespace(angle_z=types.SimpleNamespace(radians=angle)))
+
+    robot = types.SimpleNamespace(pose=pose(10.0, -20.0, 0.3))
+    for count in (1, 10, 100):
+        engine = ProximityEngine(robot, None)
+        engine.visible_objects = [types.SimpleNamespace(pose=pose(i * 37.0, 500.0 - i * 11.0)) for i in range(count)]
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for obj in engine.visible_objects:
+                object_vector = np.array((obj.pose.position.x - robot.pose.position.x,
+                                          obj.pose.position.y - robot.pose.position.y))
+                math.sqrt((object_vector ** 2).sum())
+        per_object = (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            engine.measure()
+        batched = (time.perf_counter() - start) / rounds
+
+        print("%3d markers: per object %7.1f us, batched %7.1f us" % (count, per_object * 1e6, batched * 1e6))
+
+if __name__ == '__main__':
+    benchmark()
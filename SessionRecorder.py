@@ -0,0 +1,218 @@
+import json
+import os
+import struct
+import sys
+import time
+import cozmo
+
+'''
+@class SessionRecorder
+Writes everything that comes into one CozmoWorld to an append-only binary log, so a session that went wrong
+at an event can be played again at the desk (Simulator/replay.py). Recorded are the calls of the web
+requests, marker and cube events, robot poses, cube taps, the completions of the actions, the game updates
+and the random draws of the game (CozmoWorld with its Patrol, Arcade and MerryGoRound) and of the pizza
+spawner, each with the monotonic time since the recording started. Records are packed with struct into a buffered file and flushed about once a second, so recording
+costs a few microseconds per record. A log holds one session, an existing one is never written to again.
+
+A log is the MAGIC header and then records of: time (double), kind (byte), and the payload
+of that kind.
+@author - Wizards of Coz
+'''
+
+MAGIC = b'CZLOG\x02'
+FLUSH_INTERVAL = 1.0        # seconds between writes of the buffer to the disk
+BUFFER_SIZE = 1 << 16
+
+# kinds of records
+TICK = 1            # game update, no payload
+CALL = 2            # web request call on the world: name and arguments as JSON
+APPEARED = 3        # object events: object, pose and image box
+OBSERVED = 4
+DISAPPEARED = 5
+POSE = 6            # robot state update: x, y, heading
+TAP = 7             # cube tap: count, duration, intensity
+RNG = 8             # random draw: stream and value
+SPAWN = 9           # the spawner gave this robot an order, no payload
+ACTION = 10         # an action completed: class name of the action and whether it succeeded
+
+# random streams
+GAME_STREAM = 0     # draws of CozmoWorld, Patrol, Arcade and MerryGoRound
+SPAWN_STREAM = 1    # draws of the pizza spawner for this robot
+
+HEADER = struct.Struct('<dB')
+LENGTH = struct.Struct('<H')
+OBJECT = struct.Struct('<fff ffff')      # pose x, y, heading, image box x, y, width, height
+XYH = struct.Struct('<fff')
+TAPPED = struct.Struct('<Bff')
+DRAW = struct.Struct('<Bi')
+SUCCEEDED = struct.Struct('<?')
+
+CUBE = "cube"       # name of the light cube in object records
+
+# name of an object in the log, the custom object type for markers
+def object_name(obj):
+    if isinstance(obj, cozmo.objects.CustomObject):
+        return obj.object_type.name
+    return CUBE
+
+# Random of the game drawing through another random and recording every draw in the log. choice() records
+# the index it took.
+class RecordingRandom:
+    def __init__(self, recorder, stream, rng):
+        self.recorder = recorder
+        self.stream = stream
+        self.rng = rng
+
+    def randint(self, a, b):
+        value = self.rng.randint(a, b)
+        self.recorder.draw(self.stream, value)
+        return value
+
+    def choice(self, seq):
+        index = self.rng.randint(0, len(seq) - 1)
+        self.recorder.draw(self.stream, index)
+        return seq[index]
+
+# clock: seconds of the recording, the loop time of the simulator when recording a simulated session
+class SessionRecorder:
+    def __init__(self, path, clock=time.monotonic):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # the times of a second session would go back to 0 in the middle of the log
+            raise FileExistsError("%s already holds a session" % path)
+        self.file = open(path, 'wb', buffering=BUFFER_SIZE)
+        self.file.write(MAGIC)
+        self.path = path
+        self.clock = clock
+        self.started = clock()
+        self.flushed = self.started
+        self.records = 0
+        self.handlers = []
+
+    # Records the events of a robot, its state updates and the events of its world
+    def attach(self, robot):
+        self.handlers = [robot.add_event_handler(cozmo.robot.EvtRobotStateUpdated, self.on_robot_state_updated),
+                         robot.world.add_event_handler(cozmo.objects.EvtObjectAppeared, self.on_object_appeared),
+                         robot.world.add_event_handler(cozmo.objects.EvtObjectObserved, self.on_object_observed),
+                         robot.world.add_event_handler(cozmo.objects.EvtObjectDisappeared, self.on_object_disappeared),
+                         robot.world.add_event_handler(cozmo.objects.EvtObjectTapped, self.on_object_tapped),
+                         robot.add_event_handler(cozmo.action.EvtActionCompleted, self.on_action_completed)]
+
+    def random(self, stream, rng):
+        return RecordingRandom(self, stream, rng)
+
+    def write(self, kind, payload=b''):
+        now = self.clock()
+        self.file.write(HEADER.pack(now - self.started, kind))
+        if payload:
+            self.file.write(payload)
+        self.records += 1
+        if now - self.flushed > FLUSH_INTERVAL:
+            self.file.flush()
+            self.flushed = now
+
+    def tick(self):
+        self.write(TICK)
+
+    def call(self, name, args):
+        data = json.dumps([name, list(args)], separators=(',', ':')).encode()
+        self.write(CALL, LENGTH.pack(len(data)) + data)
+
+    def draw(self, stream, value):
+        self.write(RNG, DRAW.pack(stream, value))
+
+    def spawn(self):
+        self.write(SPAWN)
+
+    def object_event(self, kind, obj, image_box=None):
+        name = object_name(obj).encode()
+        pose = obj.pose
+        box = (image_box.top_left_x, image_box.top_left_y, image_box.width, image_box.height) if image_box else (0, 0, 0, 0)
+        self.write(kind, bytes((len(name),)) + name + OBJECT.pack(pose.position.x, pose.position.y,
+                                                                 pose.rotation.angle_z.radians, *box))
+
+    def on_robot_state_updated(self, event, *, robot, **kw):
+        pose = robot.pose
+        self.write(POSE, XYH.pack(pose.position.x, pose.position.y, pose.rotation.angle_z.radians))
+
+    def on_object_appeared(self, event, *, obj, image_box=None, **kw):
+        self.object_event(APPEARED, obj, image_box)
+
+    def on_object_observed(self, event, *, obj, image_box=None, **kw):
+        self.object_event(OBSERVED, obj, image_box)
+
+    def on_object_disappeared(self, event, *, obj, **kw):
+        self.object_event(DISAPPEARED, obj)
+
+    def on_object_tapped(self, event, *, obj, tap_count, tap_duration, tap_intensity, **kw):
+        self.write(TAP, TAPPED.pack(tap_count, tap_duration, tap_intensity))
+
+    # when an action completes decides where the coroutines waiting for it go next, so it is replayed as recorded
+    def on_action_completed(self, event, *, action, state, **kw):
+        name = type(action).__name__.encode()
+        self.write(ACTION, bytes((len(name),)) + name + SUCCEEDED.pack(state == cozmo.action.ACTION_SUCCEEDED))
+
+    def close(self):
+        for handler in self.handlers:
+            handler.disable()
+        self.file.close()
+
+# Records of a log as (time, kind, payload), the payload unpacked: None, [name, args], (name, x, y, heading,
+# box x, box y, box width, box height), (x, y, heading), (count, duration, intensity), (stream, value),
+# (action name, succeeded)
+def read_records(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a session log" % path)
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            t, kind = HEADER.unpack(header)
+            if kind == CALL:
+                length, = LENGTH.unpack(f.read(LENGTH.size))
+                payload = json.loads(f.read(length).decode())
+            elif kind in (APPEARED, OBSERVED, DISAPPEARED):
+                name = f.read(f.read(1)[0]).decode()
+                payload = (name,) + OBJECT.unpack(f.read(OBJECT.size))
+            elif kind == POSE:
+                payload = XYH.unpack(f.read(XYH.size))
+            elif kind == TAP:
+                payload = TAPPED.unpack(f.read(TAPPED.size))
+            elif kind == RNG:
+                payload = DRAW.unpack(f.read(DRAW.size))
+            elif kind == ACTION:
+                name = f.read(f.read(1)[0]).decode()
+                payload = (name,) + SUCCEEDED.unpack(f.read(SUCCEEDED.size))
+            else:
+                payload = None
+            yield t, kind, payload
+
+# Cost of recording a busy session, against the period of the game update
+if __name__ == '__main__':
+    import tempfile
+    from Ticker import TICK_HZ
+    from Simulator.robot import SimCustomObject
+
+    class Box:
+        top_left_x, top_left_y, width, height = 100.0, 20.0, 40.0, 40.0
+
+    marker = SimCustomObject(cozmo.objects.CustomObjectTypes.CustomType09, 217, 455)
+    robot = type('Robot', (), {'pose': cozmo.util.pose_z_angle(0, 0, 0, cozmo.util.degrees(90))})()
+
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    path = os.path.join(tempfile.mkdtemp(), 'bench.czlog')
+    recorder = SessionRecorder(path)
+    start = time.perf_counter()
+    for i in range(ticks):
+        # about what a tick sees while driving past a marker: the update, a pose, a sighting and a draw
+        recorder.tick()
+        recorder.on_robot_state_updated(None, robot=robot)
+        recorder.on_object_observed(None, obj=marker, image_box=Box)
+        recorder.draw(GAME_STREAM, i % 7)
+    elapsed = time.perf_counter() - start
+    recorder.close()
+    per_tick = elapsed / ticks
+    print("%d ticks, %.1f us per tick, %.3f%% of a %.1f ms tick, %d bytes per tick" % (
+        ticks, per_tick * 1e6, per_tick * TICK_HZ * 100, 1000 / TICK_HZ, os.path.getsize(path) / ticks))
+    count = sum(1 for _ in read_records(path))
+    print("%d records read back" % count)
@@ -0,0 +1,3 @@
+'''
+Headless simulator of the city, the robots and their cubes, running the game code under a virtual clock.
+'''
@@ -0,0 +1,55 @@
+import asyncio
+import contextlib
+import selectors
+import time
+
+'''
+@class VirtualClock
+Time of the simulation. The event loop made by new_virtual_loop() reads its time from the clock, and
+whenever the loop would sleep until its next timer, the clock jumps there instead. The loop keeps real
+IO (and wake ups from other threads), it only never waits for time to pass.
+@author - Wizards of Coz
+'''
+
+START_TIME = 1500000000.0   # wall clock time the simulation starts at, for time.time()
+
+class VirtualClock:
+    def __init__(self, start=START_TIME):
+        self.start = start
+        self.now = 0.0          # seconds since the start of the simulation
+
+    def advance(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    # replaces time.time() while patched
+    def time(self):
+        return self.start + self.now
+
+    # time.time() returns the simulated time while in this context, for the game code using it
+    @contextlib.contextmanager
+    def patched(self):
+        real_time = time.time
+        time.time = self.time
+        try:
+            yield self
+        finally:
+            time.time = real_time
+
+# Selector of the virtual loop, a wait for a timer advances the clock instead of blocking
+class VirtualSelector(selectors.DefaultSelector):
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        # only really wait when there is no timer at all, e.g. for another thread to hand over work
+        ready = super().select(0 if timeout is not None else None)
+        if not ready and timeout is not None:
+            self.clock.advance(timeout)
+        return ready
+
+def new_virtual_loop(clock):
+    loop = asyncio.SelectorEventLoop(VirtualSelector(clock))
+    loop.time = lambda: clock.now
+    return loop
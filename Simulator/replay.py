@@ -0,0 +1,195 @@
+import asyncio
+import collections
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')     # no sound card needed for the music of the game
+
+import cozmo
+from cozmo.objects import CustomObjectTypes
+from cozmo.util import pose_z_angle, radians
+from Simulator.clock import VirtualClock, new_virtual_loop
+from Simulator.robot import SimRobot, SimCustomObject, SimEvent
+from Simulator.simulation import simulate, make_happy, SIMULATED_SECONDS
+from SessionRecorder import read_records, TICK, CALL, APPEARED, OBSERVED, DISAPPEARED, POSE, TAP, RNG, SPAWN, \
+    ACTION, GAME_STREAM, SPAWN_STREAM, CUBE
+from Fleet import Fleet
+from CozmoWorld import CozmoWorld
+
+'''
+@class Replayer
+Plays a session log of SessionRecorder into a new CozmoWorld driving a simulated robot, under the virtual
+clock of the simulator, so a day of recorded play goes by in seconds. The web request calls, marker and cube
+events, poses and taps are fed in at the time they were recorded, the game updates run where they ran, the
+actions complete when they completed, and the random draws of the game and of the spawner give back the
+recorded values. Replaying up to a time (until) and
+looking at the state then is how a session is bisected. check() records a simulated session and replays it.
+
+Run from the top folder:  python -m Simulator.replay session.czlog [until seconds]
+                          python -m Simulator.replay --check
+@author - Wizards of Coz
+'''
+
+OBJECT_EVENTS = {APPEARED: cozmo.objects.EvtObjectAppeared,
+                 OBSERVED: cozmo.objects.EvtObjectObserved,
+                 DISAPPEARED: cozmo.objects.EvtObjectDisappeared}
+
+# Random giving back the draws of a recording, in the order they were drawn
+class ReplayRandom:
+    def __init__(self, draws):
+        self.draws = draws
+
+    def next(self):
+        if not self.draws:
+            raise RuntimeError("The replay drew more random numbers than the recorded session")
+        return self.draws.popleft()
+
+    def randint(self, a, b):
+        return self.next()
+
+    def choice(self, seq):
+        return seq[self.next()]
+
+# happy: the robot was made happy outside of the log, as simulate(happy=True) does
+class Replayer:
+    def __init__(self, path, durations=None, happy=False):
+        self.path = path
+        self.durations = durations
+        self.happy = happy
+        self.draws = {GAME_STREAM: collections.deque(), SPAWN_STREAM: collections.deque()}
+        self.objects = {}       # object name -> SimCustomObject, the same one for every event of a marker
+        self.records = 0
+        self.session_seconds = 0.0
+
+    # Plays the log up to until (seconds since the start of the recording), all of it if None
+    def replay(self, until=None):
+        for t, kind, payload in read_records(self.path):
+            if kind == RNG:
+                self.draws[payload[0]].append(payload[1])
+
+        clock = VirtualClock()
+        loop = new_virtual_loop(clock)
+        asyncio.set_event_loop(loop)
+        started = time.perf_counter()
+        try:
+            with clock.patched():
+                self.sim = SimRobot(loop, [], durations=self.durations)
+                self.sim.loop_thread = threading.get_ident()
+                self.world = CozmoWorld(self.sim, Fleet(), ReplayRandom(self.draws[GAME_STREAM]))
+                self.world.loop = loop
+                self.world.actions.start(loop)
+                if self.happy:
+                    make_happy(self.world)
+                self.spawn_rng = ReplayRandom(self.draws[SPAWN_STREAM])
+                # the set up of the world above is in the recording too, its actions complete after their
+                # duration and the records from while it ran are played at once
+                self.sim.recorded_completions = True
+                loop.run_until_complete(self.play(loop, until))
+
+                self.world.actions.stop()
+                all_tasks = asyncio.all_tasks if hasattr(asyncio, 'all_tasks') else asyncio.Task.all_tasks
+                for task in all_tasks(loop):
+                    task.cancel()
+                loop.run_until_complete(asyncio.sleep(0))
+        finally:
+            loop.close()
+
+        real_seconds = time.perf_counter() - started
+        world = self.world
+        return {'records': self.records,
+                'session_seconds': self.session_seconds,
+                'real_seconds': real_seconds,
+                'speedup': self.session_seconds / real_seconds if real_seconds > 0 else 0.0,
+                'coins': world.coins,
+                'deliveries': world.deliveries,
+                'pizzas_waiting': world.pizzas.queue_size(),
+                'pizzas_lit': world.pizzas.lit_count(),
+                'autonomous': world.is_autonomous_mode,
+                'draws_left': {stream: len(draws) for stream, draws in self.draws.items()}}
+
+    # Records are applied from a timer at exactly their time, as the timers of the recorded actions fired, so
+    # they come before the timers of the game due a little later (a sleep until then could land just after)
+    async def play(self, loop, until):
+        records = read_records(self.path)
+        finished = loop.create_future()
+
+        def step(record, due=False):
+            while record is not None:
+                t, kind, payload = record
+                if until is not None and t > until:
+                    break
+                if not due and t > loop.time():
+                    loop.call_at(t, step, record, True)
+                    return
+                due = False
+                self.apply(kind, payload)
+                self.records += 1
+                self.session_seconds = t
+                record = next(records, None)
+            finished.set_result(None)
+
+        step(next(records, None))
+        await finished
+
+    def apply(self, kind, payload):
+        if kind == TICK:
+            self.world.tick()
+        elif kind == CALL:
+            name, args = payload
+            getattr(self.world, name)(*args)
+        elif kind in OBJECT_EVENTS:
+            name, x, y, heading, box_x, box_y, box_width, box_height = payload
+            obj = self.object(name, x, y, heading)
+            image_box = SimEvent(top_left_x=box_x, top_left_y=box_y, width=box_width, height=box_height)
+            self.sim.world.dispatch_event(OBJECT_EVENTS[kind], obj=obj, pose=obj.pose, image_box=image_box,
+                                          updated=set())
+        elif kind == POSE:
+            self.sim.x, self.sim.y, self.sim.heading = payload
+            self.sim.dispatch_event(cozmo.robot.EvtRobotStateUpdated, robot=self.sim)
+        elif kind == TAP:
+            tap_count, tap_duration, tap_intensity = payload
+            self.sim.world.dispatch_event(cozmo.objects.EvtObjectTapped, obj=self.sim.cube, tap_count=tap_count,
+                                          tap_duration=tap_duration, tap_intensity=tap_intensity)
+        elif kind == SPAWN:
+            self.world.spawn_pizza(self.spawn_rng)
+        elif kind == ACTION:
+            name, succeeded = payload
+            self.sim.complete_recorded(name, succeeded)
+
+    # the cube, or the marker of a custom object type where it was seen
+    def object(self, name, x, y, heading):
+        if name == CUBE:
+            self.sim.cube.pose = pose_z_angle(x, y, 0, radians(heading))
+            return self.sim.cube
+        marker = self.objects.get(name)
+        if marker is None:
+            marker = self.objects[name] = SimCustomObject(getattr(CustomObjectTypes, name), x, y)
+        marker.move(x, y, heading)
+        return marker
+
+# Records a simulated session, replays it and tells whether the replay used up every recorded draw and
+# ended with the coins and deliveries of the session
+def check(seconds=SIMULATED_SECONDS, seed=0, happy=True, **kw):
+    path = os.path.join(tempfile.mkdtemp(), 'check.czlog')
+    session = simulate(seconds, seed, happy=happy, record=path, **kw)
+    replayed = Replayer(path, happy=happy).replay()
+    same = (replayed['coins'] == session['coins'][0] and replayed['deliveries'] == session['deliveries'][0]
+            and not any(replayed['draws_left'].values()))
+    return {'same': same,
+            'session': {'coins': session['coins'][0], 'deliveries': session['deliveries'][0]},
+            'replay': {'coins': replayed['coins'], 'deliveries': replayed['deliveries'],
+                       'draws_left': replayed['draws_left'], 'speedup': replayed['speedup']}}
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--check']:
+        result = check()
+        print(json.dumps(result, sort_keys=True))
+        sys.exit(0 if result['same'] else 1)
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python -m Simulator.replay session.czlog [until seconds]")
+    until = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    print(json.dumps(Replayer(sys.argv[1]).replay(until), sort_keys=True))
@@ -0,0 +1,455 @@
+import asyncio
+import math
+import threading
+import cozmo
+from cozmo.util import pose_z_angle, radians
+
+'''
+@class SimRobot
+Stand-in for cozmo.robot.Robot driven by the virtual clock. Wheel speeds and actions move the pose, which
+is integrated at the rate the robot reports its state; markers of the city are seen when they are in front
+of the camera and close enough, and the world sends the same appeared, observed and disappeared events as
+the SDK. Actions take simulated time, and starting one while another runs raises RobotBusy like the robot.
+Methods work from the event loop (awaitable actions) and from other threads or before the loop runs
+(blocking wait_for_completed), like the SDK with its synchronous proxy.
+@author - Wizards of Coz
+'''
+
+STATE_HZ = 15.0                     # robot state updates per second
+WHEEL_BASE = 48.0                   # mm between the treads
+TURN_SPEED = math.radians(90)       # radians per second of turn_in_place
+GO_TO_SPEED = 80.0                  # mm/s of go_to_pose and go_to_object
+HEAD_LIFT_DURATION = 0.3            # seconds to move the head or the lift
+ANIMATION_DURATION = 2.0            # seconds of any animation without a duration of its own
+SPEECH_DURATION = 0.08              # seconds per character of say_text
+VIEW_DISTANCE = 1500.0              # mm up to which a marker is recognized
+VIEW_ANGLE = math.radians(29)       # half of the horizontal field of view of the camera
+CAMERA_WIDTH = 320                  # pixels, for the image box of a marker
+
+class SimEvent:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class SimHandler:
+    def __init__(self, handlers, event_type, f):
+        self.handlers = handlers
+        self.event_type = event_type
+        self.f = f
+
+    def disable(self):
+        if self in self.handlers:
+            self.handlers.remove(self)
+
+# Event handlers registered on a robot or a world, called on the loop like the SDK does
+class SimDispatcher:
+    def __init__(self, sim):
+        self.sim = sim
+        self.handlers = []
+
+    def add_event_handler(self, event_type, f):
+        handler = SimHandler(self.handlers, event_type, f)
+        self.handlers.append(handler)
+        return handler
+
+    def has_handler(self, event_type):
+        return any(handler.event_type is event_type for handler in self.handlers)
+
+    def dispatch_event(self, event_type, **kw):
+        event = SimEvent(**kw)
+        for handler in list(self.handlers):
+            if handler.event_type is event_type:
+                result = handler.f(event, **kw)
+                if asyncio.iscoroutine(result):
+                    self.sim.loop.create_task(result)
+
+class SimAction:
+    def __init__(self, sim, duration, end_pose=None, in_parallel=False):
+        self.sim = sim
+        self.duration = duration
+        self.end_pose = end_pose        # (x, y, heading) set when the action completes
+        self.in_parallel = in_parallel
+        self.done = threading.Event()
+        self.future = None
+        self.timer = None
+        self.state = cozmo.action.ACTION_RUNNING
+
+    # completes after its duration, or when the replayed session says so
+    def start(self):
+        self.future = self.sim.loop.create_future()
+        if not self.sim.recorded_completions:
+            self.timer = self.sim.loop.call_later(self.duration, self.complete)
+
+    def complete(self, state=cozmo.action.ACTION_SUCCEEDED):
+        if self.done.is_set():
+            return
+        self.state = state
+        if self.timer is not None:
+            self.timer.cancel()
+        self.sim.action_finished(self, state == cozmo.action.ACTION_SUCCEEDED)
+        self.done.set()
+        self.sim.dispatch_event(cozmo.action.EvtActionCompleted, action=self, state=state)
+        if not self.future.done():
+            self.future.set_result(self)
+
+    def abort(self):
+        self.complete(cozmo.action.ACTION_FAILED)
+
+    @property
+    def is_running(self):
+        return not self.done.is_set()
+
+    @property
+    def is_completed(self):
+        return self.done.is_set()
+
+    async def wait_async(self, timeout):
+        await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        return self
+
+    def wait_for_completed(self, timeout=None):
+        if self.sim.on_loop():
+            return self.wait_async(timeout)
+        if not self.sim.loop.is_running():
+            # before the simulation runs, e.g. in CozmoWorld.__init__, let simulated time pass
+            self.sim.loop.run_until_complete(self.wait_async(timeout))
+        else:
+            self.done.wait()
+        return self
+
+# Actions named like the ones of the SDK, the session recorder keeps the class name of every completed action
+class DriveStraight(SimAction): pass
+class TurnInPlace(SimAction): pass
+class GoToPose(SimAction): pass
+class GoToObject(SimAction): pass
+class SetHeadAngle(SimAction): pass
+class SetLiftHeight(SimAction): pass
+class Animation(SimAction): pass
+class AnimationTrigger(SimAction): pass
+class SayText(SimAction): pass
+class DisplayOledFaceImage(SimAction): pass
+
+class SimBehavior:
+    def stop(self):
+        pass
+
+class SimCamera:
+    image_stream_enabled = False
+
+class SimCube:
+    def __init__(self, x, y):
+        self.object_id = 1
+        self.pose = pose_z_angle(x, y, 0, radians(0))
+        self.corners = [None, None, None, None]
+        self.light_messages = 0
+
+    def set_light_corners(self, light1, light2, light3, light4):
+        self.corners = [light1, light2, light3, light4]
+        self.light_messages += 1
+
+    def set_lights(self, light):
+        self.set_light_corners(light, light, light, light)
+
+    def set_lights_off(self):
+        self.set_light_corners(None, None, None, None)
+
+# A marker of the city, an instance of CustomObject so the game treats it as one (it also checks the class name)
+class SimCustomObject(cozmo.objects.CustomObject):
+    def __init__(self, object_type, x, y):
+        self._sim_object_type = object_type
+        self._sim_pose = pose_z_angle(x, y, 0, radians(0))
+        self.x = x
+        self.y = y
+
+    def move(self, x, y, heading=0.0):
+        self._sim_pose = pose_z_angle(x, y, 0, radians(heading))
+        self.x = x
+        self.y = y
+
+    @property
+    def object_type(self):
+        return self._sim_object_type
+
+    @property
+    def pose(self):
+        return self._sim_pose
+
+    def __repr__(self):
+        return "<SimCustomObject %s at (%.0f, %.0f)>" % (self.object_type, self.x, self.y)
+
+class SimWorld(SimDispatcher):
+    def __init__(self, sim, cube):
+        super().__init__(sim)
+        self.cube = cube
+
+    def define_custom_cube(self, custom_object_type, *args, **kw):
+        return SimEvent(object_type=custom_object_type)
+
+    def wait_until_observe_num_objects(self, num, object_type=None, timeout=None, include_existing=True):
+        cubes = [self.cube]
+        if self.sim.on_loop():
+            return self.sim.completed(cubes)
+        return cubes
+
+    async def wait_for(self, event_or_filter, timeout=None):
+        await asyncio.sleep(timeout or 0)
+        raise asyncio.TimeoutError()
+
+class SimRobot(SimDispatcher):
+    def __init__(self, loop, markers, x=0.0, y=0.0, heading=0.0, cube=None, durations=None):
+        super().__init__(self)
+        self.loop = loop
+        self._loop = loop
+        self.loop_thread = None
+        self.markers = markers              # SimCustomObject of the city
+        self.visible = []                   # markers in view at the last state update
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.l_wheel_speed = 0.0
+        self.r_wheel_speed = 0.0
+        self.motion = None                  # (forward mm/s, radians/s) of the running action
+        self.lock = threading.Lock()
+        self.actions = []                   # running actions
+        self.durations = durations or {}    # animation name or trigger -> seconds
+        self.recorded_completions = False   # actions complete when the replayed session says, not after their duration
+
+        self.cube = cube if cube is not None else SimCube(x, y)
+        self.world = SimWorld(self, self.cube)
+        self.camera = SimCamera()
+        self.backpack = [None, None, None, None, None]
+        self.backpack_messages = 0
+        self.wheel_messages = 0
+        self.is_picked_up = False
+        self.is_on_charger = False
+        self.battery_voltage = 4.0
+        self.gyro = SimEvent(x=0.0, y=0.0, z=0.0)
+        self.accelerometer = SimEvent(x=0.0, y=0.0, z=9810.0)
+        self.updater = None
+
+    # Starts the state updates, call on the loop or before it runs
+    def start(self):
+        self.updater = self.loop.create_task(self.run())
+
+    def on_loop(self):
+        return self.loop_thread == threading.get_ident() and self.loop.is_running()
+
+    def completed(self, result):
+        future = self.loop.create_future()
+        future.set_result(result)
+        return future
+
+    @property
+    def pose(self):
+        return pose_z_angle(self.x, self.y, 0, radians(self.heading))
+
+    async def run(self):
+        self.loop_thread = threading.get_ident()
+        period = 1.0 / STATE_HZ
+        while True:
+            await asyncio.sleep(period)
+            self.integrate(period)
+            # the new pose first, as the robot state comes before the markers seen from it
+            self.dispatch_event(cozmo.robot.EvtRobotStateUpdated, robot=self)
+            self.update_view()
+
+    def integrate(self, dt):
+        with self.lock:
+            if self.motion is not None:
+                forward, turn = self.motion
+            else:
+                forward = (self.l_wheel_speed + self.r_wheel_speed) / 2
+                turn = (self.r_wheel_speed - self.l_wheel_speed) / WHEEL_BASE
+            self.heading += turn * dt / 2
+            self.x += forward * dt * math.cos(self.heading)
+            self.y += forward * dt * math.sin(self.heading)
+            self.heading += turn * dt / 2
+
+    # markers in front of the camera and close enough, with appeared and disappeared events
+    def update_view(self):
+        visible = []
+        for marker in self.markers:
+            dx = marker.x - self.x
+            dy = marker.y - self.y
+            distance = math.hypot(dx, dy)
+            bearing = math.atan2(dy, dx) - self.heading
+            bearing = (bearing + math.pi) % (2 * math.pi) - math.pi
+            if distance < VIEW_DISTANCE and abs(bearing) < VIEW_ANGLE:
+                visible.append((marker, distance, bearing))
+
+        now_visible = [marker for marker, _, _ in visible]
+        for marker in self.visible:
+            if marker not in now_visible:
+                self.world.dispatch_event(cozmo.objects.EvtObjectDisappeared, obj=marker)
+        for marker, distance, bearing in visible:
+            width = max(4.0, CAMERA_WIDTH * 40.0 / max(distance, 1.0))
+            center = CAMERA_WIDTH / 2 - bearing / VIEW_ANGLE * CAMERA_WIDTH / 2
+            image_box = SimEvent(top_left_x=center - width / 2, top_left_y=0.0, width=width, height=width)
+            if marker not in self.visible:
+                self.world.dispatch_event(cozmo.objects.EvtObjectAppeared, obj=marker, pose=marker.pose,
+                                          image_box=image_box, updated=set())
+            self.world.dispatch_event(cozmo.objects.EvtObjectObserved, obj=marker, pose=marker.pose,
+                                      image_box=image_box, updated=set())
+        self.visible = now_visible
+
+    # Starts an action of a SimAction class unless another one is running, as the robot does
+    def start_action(self, action_class, duration, motion=None, end_pose=None, in_parallel=False):
+        action = action_class(self, duration, end_pose, in_parallel)
+        with self.lock:
+            if not in_parallel and any(not running.in_parallel for running in self.actions):
+                raise cozmo.exceptions.RobotBusy("Robot is busy")
+            self.actions.append(action)
+            if motion is not None:
+                self.motion = motion
+        if self.on_loop() or not self.loop.is_running():
+            action.start()
+        else:
+            # from another thread, e.g. the action scheduler
+            started = threading.Event()
+            def start():
+                action.start()
+                started.set()
+            self.loop.call_soon_threadsafe(start)
+            started.wait()
+        return action
+
+    # Completes the oldest running action of a class as a replayed session says, returns False if none runs.
+    # Actions started before the replay began complete after their duration
+    def complete_recorded(self, name, succeeded):
+        with self.lock:
+            action = next((running for running in self.actions
+                           if type(running).__name__ == name and running.timer is None), None)
+        if action is None:
+            return False
+        action.complete(cozmo.action.ACTION_SUCCEEDED if succeeded else cozmo.action.ACTION_FAILED)
+        return True
+
+    def action_finished(self, action, succeeded):
+        with self.lock:
+            if action in self.actions:
+                self.actions.remove(action)
+            if action.end_pose is not None:
+                if succeeded:
+                    self.x, self.y, self.heading = action.end_pose
+                self.motion = None
+
+    def animation_duration(self, name):
+        return self.durations.get(name, ANIMATION_DURATION)
+
+    # Motors
+
+    # A coroutine on the loop like the SDK's, the wheels only get their speeds once it is awaited or
+    # scheduled, so code that forgets to do so does not drive the simulated robot either
+    def drive_wheels(self, l_wheel_speed, r_wheel_speed, l_wheel_acc=None, r_wheel_acc=None, duration=None):
+        if self.on_loop():
+            return self.drive_wheels_async(l_wheel_speed, r_wheel_speed, duration)
+        self.set_wheels(l_wheel_speed, r_wheel_speed, duration)
+
+    async def drive_wheels_async(self, l_wheel_speed, r_wheel_speed, duration=None):
+        self.set_wheels(l_wheel_speed, r_wheel_speed, duration)
+
+    def set_wheels(self, l_wheel_speed, r_wheel_speed, duration=None):
+        with self.lock:
+            self.l_wheel_speed = l_wheel_speed
+            self.r_wheel_speed = r_wheel_speed
+            self.wheel_messages += 1
+        if duration:
+            self.loop.call_soon_threadsafe(self.loop.call_later, duration, self.stop_all_motors)
+
+    def stop_all_motors(self):
+        with self.lock:
+            self.l_wheel_speed = 0.0
+            self.r_wheel_speed = 0.0
+            self.wheel_messages += 1
+
+    def abort_all_actions(self, log_abort_messages=False):
+        with self.lock:
+            actions = list(self.actions)
+        for action in actions:
+            if self.on_loop() or not self.loop.is_running():
+                action.abort()
+            else:
+                self.loop.call_soon_threadsafe(action.abort)
+
+    def move_lift(self, speed):
+        pass
+
+    def move_head(self, speed):
+        pass
+
+    def set_backpack_lights(self, light1, light2, light3, light4, light5):
+        self.backpack = [light1, light2, light3, light4, light5]
+        self.backpack_messages += 1
+
+    # Actions
+
+    def drive_straight(self, distance, speed, should_play_anim=True, in_parallel=False, num_retries=0):
+        mm = distance.distance_mm
+        mmps = abs(speed.speed_mmps) * (1 if mm >= 0 else -1)
+        end = (self.x + mm * math.cos(self.heading), self.y + mm * math.sin(self.heading), self.heading)
+        return self.start_action(DriveStraight, abs(mm / mmps) if mmps else 0.0, (mmps, 0.0), end, in_parallel)
+
+    def turn_in_place(self, angle, in_parallel=False, num_retries=0, speed=None, accel=None,
+                      angle_tolerance=None, is_absolute=False):
+        target = angle.radians if is_absolute else self.heading + angle.radians
+        delta = (target - self.heading + math.pi) % (2 * math.pi) - math.pi
+        turn_speed = speed.radians if speed is not None else TURN_SPEED
+        duration = abs(delta) / turn_speed
+        return self.start_action(TurnInPlace, duration, (0.0, math.copysign(turn_speed, delta)), (self.x, self.y, target),
+                                 in_parallel)
+
+    def go_to_pose(self, pose, relative_to_robot=False, in_parallel=False, num_retries=0):
+        x, y = pose.position.x, pose.position.y
+        heading = pose.rotation.angle_z.radians
+        if relative_to_robot:
+            x, y = (self.x + x * math.cos(self.heading) - y * math.sin(self.heading),
+                    self.y + x * math.sin(self.heading) + y * math.cos(self.heading))
+            heading += self.heading
+        duration = math.hypot(x - self.x, y - self.y) / GO_TO_SPEED + abs(heading - self.heading) / TURN_SPEED
+        return self.start_action(GoToPose, duration, (0.0, 0.0), (x, y, heading), in_parallel)
+
+    def go_to_object(self, target_object, distance_from_object, in_parallel=False, num_retries=0):
+        tx, ty = target_object.pose.position.x, target_object.pose.position.y
+        distance = math.hypot(tx - self.x, ty - self.y)
+        heading = math.atan2(ty - self.y, tx - self.x)
+        travel = max(0.0, distance - distance_from_object.distance_mm)
+        end = (self.x + travel * math.cos(heading), self.y + travel * math.sin(heading), heading)
+        return self.start_action(GoToObject, travel / GO_TO_SPEED, (0.0, 0.0), end, in_parallel)
+
+    def drive_off_charger_contacts(self, in_parallel=False, num_retries=0):
+        self.is_on_charger = False
+        return self.drive_straight(cozmo.util.distance_mm(60), cozmo.util.speed_mmps(50), in_parallel=in_parallel)
+
+    def set_head_angle(self, angle, accel=10.0, max_speed=10.0, duration=0.0, warn_on_clamp=True,
+                       in_parallel=False, num_retries=0):
+        return self.start_action(SetHeadAngle, duration or HEAD_LIFT_DURATION, in_parallel=in_parallel)
+
+    def set_lift_height(self, height, accel=10.0, max_speed=10.0, duration=0.0, in_parallel=False, num_retries=0):
+        return self.start_action(SetLiftHeight, duration or HEAD_LIFT_DURATION, in_parallel=in_parallel)
+
+    def play_anim(self, name, loop_count=1, in_parallel=False, num_retries=0, ignore_body_track=False,
+                  ignore_head_track=False, ignore_lift_track=False):
+        return self.start_action(Animation, self.animation_duration(name) * loop_count, in_parallel=in_parallel)
+
+    def play_anim_trigger(self, trigger, loop_count=1, in_parallel=False, num_retries=0, use_lift_safe=False,
+                          ignore_body_track=False, ignore_head_track=False, ignore_lift_track=False):
+        name = getattr(trigger, "name", str(trigger))
+        return self.start_action(AnimationTrigger, self.animation_duration(name) * loop_count, in_parallel=in_parallel)
+
+    def say_text(self, text, play_excited_animation=False, use_cozmo_voice=True, duration_scalar=1.0,
+                 voice_pitch=0.0, in_parallel=False, num_retries=0):
+        return self.start_action(SayText, len(text) * SPEECH_DURATION * duration_scalar, in_parallel=in_parallel)
+
+    def display_oled_face_image(self, screen_data, duration_ms, in_parallel=True):
+        return self.start_action(DisplayOledFaceImage, duration_ms / 1000.0, in_parallel=True)
+
+    def start_behavior(self, behavior_type):
+        return SimBehavior()
+
+    # Things people do with the robot and the cube
+
+    def tap_cube(self, intensity=1.0):
+        self.world.dispatch_event(cozmo.objects.EvtObjectTapped, obj=self.cube, tap_count=1,
+                                  tap_duration=0.1, tap_intensity=intensity)
+
+    def pick_up(self, picked_up=True):
+        self.is_picked_up = picked_up
@@ -0,0 +1,184 @@
+import asyncio
+import concurrent.futures
+import importlib
+import json
+import math
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')     # no sound card needed for the music of the game
+
+from Simulator.clock import VirtualClock, new_virtual_loop
+from Simulator.robot import SimRobot, SimCustomObject
+from Patrol.Track.track import Track
+from Patrol.patrol import COLOR_TO_BLDG, MARKER_NAME_TO_BLDG
+from Fleet import Fleet
+from Ticker import TICK_HZ
+from SessionRecorder import SessionRecorder, GAME_STREAM
+from CozmoWorld import CozmoWorld
+
+'''
+@class simulate
+Plays the whole game, CozmoWorld with its ticker, pizza spawner, proximity zones, autonomous patrol and
+action scheduler, against simulated robots in a simulated city, under a virtual clock that skips the time
+nobody is doing anything. Ten minutes of the game take a few seconds, and a seed gives the same pizzas and
+reactions again, so changes to the game can be compared by their numbers (deliveries, coins) instead of
+by watching a robot. sweep() runs many seeds and settings on all cores. With record, the session of the
+first robot is written to a log that Simulator/replay.py plays again.
+
+Run from the top folder:  python -m Simulator.simulation [seconds] [seeds] [robots]
+                          python -m Simulator.simulation --check
+@author - Wizards of Coz
+'''
+
+SIMULATED_SECONDS = 600.0   # ten minutes of the game
+TAP_INTERVAL = 1.5          # seconds between two taps on every cube, for the arcade game
+GARAGE = "GA"               # building id of the garage, where the robots start
+GARAGE_EXIT = 140.0         # mm from the garage to the road, driven by Patrol.start
+MARKER_SETBACK = 80.0       # mm from the end of the small lane of a building to its marker on the wall
+
+# Markers of the buildings on the track, each one on the wall past the end of the small lane of its building, the
+# object types come from the marker definitions of the world. extra: {building name: (x, y)} for the
+# buildings off the track (icecream, statue, arcade, carousel)
+def city_markers(world, track, extra=None):
+    object_types = {name: object_type for object_type, name in world.buildingMaps.items()}
+    buildings = dict(COLOR_TO_BLDG)
+    buildings.update(MARKER_NAME_TO_BLDG)
+    markers = []
+    for name, bldgId in buildings.items():
+        vertex = track.vertices.get(bldgId)
+        if vertex is None or name not in object_types:
+            continue
+        distance = vertex.d + MARKER_SETBACK
+        markers.append(SimCustomObject(object_types[name], vertex.x + vertex.lane[0] * distance,
+                                       vertex.y + vertex.lane[1] * distance))
+    for name, (x, y) in (extra or {}).items():
+        markers.append(SimCustomObject(object_types[name], x, y))
+    return markers
+
+# Pose in the garage, facing the road, where Patrol.start expects the robot
+def garage_pose(track):
+    vertex = track.vertices[GARAGE]
+    return (vertex.x + vertex.lane[0] * GARAGE_EXIT, vertex.y + vertex.lane[1] * GARAGE_EXIT,
+            math.atan2(-vertex.lane[1], -vertex.lane[0]))
+
+# Sets {"module.NAME": value} and returns what to restore, e.g. {"Patrol.patrol.FORWARD_SPEED": 80}
+def apply_overrides(overrides):
+    restore = {}
+    for path, value in overrides.items():
+        module_name, name = path.rsplit('.', 1)
+        module = importlib.import_module(module_name)
+        restore[path] = getattr(module, name)
+        setattr(module, name, value)
+    return restore
+
+# People tapping the cubes, with their own random so the game draws the same numbers whatever they do
+async def tap_cubes(sims, interval, rng):
+    while True:
+        await asyncio.sleep(interval)
+        for sim in sims:
+            sim.tap_cube(rng.uniform(0.2, 1.0))
+
+# As after the first fun thing, the robot delivers without asking for attention
+def make_happy(world):
+    world.autonomousInstance.change_mood(0)
+
+# Runs the game for seconds of simulated time and returns its numbers. record: path of a session log of the
+# first robot, None not to record
+def simulate(seconds=SIMULATED_SECONDS, seed=0, robots=1, overrides=None, durations=None, extra_markers=None,
+             autonomous=True, tap_interval=TAP_INTERVAL, arrivals=None, hz=TICK_HZ, happy=False, record=None):
+    random.seed(seed)
+    clock = VirtualClock()
+    loop = new_virtual_loop(clock)
+    asyncio.set_event_loop(loop)
+    restore = apply_overrides(overrides or {})
+    started = time.perf_counter()
+
+    try:
+        with clock.patched():
+            track = Track()
+            fleet = Fleet(arrivals, seed)
+            sims = []
+            recorder = None
+            for number in range(robots):
+                sim = SimRobot(loop, [], *garage_pose(track), durations=durations)
+                sim.start()
+                if record and number == 0:
+                    recorder = SessionRecorder(record, clock=loop.time)
+                    world = CozmoWorld(sim, fleet, recorder.random(GAME_STREAM, random.Random(seed)), recorder)
+                else:
+                    world = CozmoWorld(sim, fleet)
+                sim.markers = city_markers(world, track, extra_markers)
+                world.start_ticking(loop, hz)
+                if happy:
+                    make_happy(world)
+                # as the tablet does, into the recording
+                world.call_recorded(world.modechange, autonomous)
+                fleet.add(world)
+                sims.append(sim)
+            fleet.start_spawning(loop)
+            loop.create_task(tap_cubes(sims, tap_interval, random.Random(seed)))
+
+            loop.run_until_complete(asyncio.sleep(seconds - clock.now))
+
+            fleet.spawner.stop()
+            for world in fleet.worlds:
+                world.ticker.stop()
+                world.actions.stop()
+            all_tasks = asyncio.all_tasks if hasattr(asyncio, 'all_tasks') else asyncio.Task.all_tasks
+            for task in all_tasks(loop):
+                task.cancel()
+            loop.run_until_complete(asyncio.sleep(0))
+            ticks = [world.ticker.stats() for world in fleet.worlds]
+            if recorder:
+                recorder.close()
+    finally:
+        apply_overrides(restore)
+        loop.close()
+
+    real_seconds = time.perf_counter() - started
+    return {'seed': seed,
+            'robots': robots,
+            'overrides': overrides or {},
+            'simulated_seconds': clock.now,
+            'real_seconds': real_seconds,
+            'speedup': clock.now / real_seconds if real_seconds > 0 else math.inf,
+            'orders': fleet.spawner.spawned,
+            'deliveries': [world.deliveries for world in fleet.worlds],
+            'coins': [world.coins for world in fleet.worlds],
+            'wheel_messages': [sim.wheel_messages for sim in sims],
+            'ticks': ticks}
+
+# Runs the same seeded game twice and tells whether both gave the same numbers, with the speedup over
+# real time. The smoke test of the simulator, run after changing the game or the simulator
+def check(seconds=SIMULATED_SECONDS, seed=0, **kw):
+    results = [simulate(seconds, seed, **kw) for _ in range(2)]
+    numbers = [{key: value for key, value in result.items() if key not in ('real_seconds', 'speedup')}
+               for result in results]
+    return {'same': numbers[0] == numbers[1],
+            'deliveries': [result['deliveries'] for result in results],
+            'coins': [result['coins'] for result in results],
+            'speedup': [result['speedup'] for result in results]}
+
+def simulate_config(config):
+    return simulate(**config)
+
+# Runs every config ({keyword: value} of simulate) in its own process, the results in the same order
+def sweep(configs, workers=None):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(simulate_config, configs))
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--check']:
+        result = check()
+        print(json.dumps(result, sort_keys=True))
+        sys.exit(0 if result['same'] else 1)
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else SIMULATED_SECONDS
+    seeds = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    robots = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    configs = [{'seconds': seconds, 'seed': seed, 'robots': robots} for seed in range(seeds)]
+    results = sweep(configs) if seeds > 1 else [simulate(**configs[0])]
+    for result in results:
+        print(json.dumps(result, sort_keys=True))
@@ -0,0 +1,137 @@
+import asyncio
+import bisect
+import collections
+import math
+import random
+import time
+
+'''
+@class SpawnScheduler
+Spawns the pizza orders of the city, one after another in a plain loop on the event loop of the game, so a
+whole day of spawning keeps one coroutine and one timer. The time until the next order comes from an
+arrival process: UniformArrivals as the game always did, PoissonArrivals for a steady rate of customers, or
+DemandCurveArrivals for a rate that follows the hours of the day. The waits are drawn from one random.Random
+on the loop of the spawner, and each robot draws the pizzas of its orders from its own random.Random derived
+from the same seed, on its own loop, so a seed gives the same orders again however the loops of the robots
+interleave. Each order goes to the robot chosen by the fleet, on the loop of that robot.
+@author - Wizards of Coz
+'''
+
+FIRST_ORDER = (10, 20)      # seconds before the first order, as the game always did
+ORDER_GAP = (0, 90)         # seconds after an order before waiting for the next one
+HISTORY = 32                # last spawns kept for the stats
+
+# Wait of the game so far: a random number of seconds before the first order, then the gap and that wait again
+class UniformArrivals:
+    def __init__(self, first=FIRST_ORDER, gap=ORDER_GAP):
+        self.first = first
+        self.gap = gap
+        self.spawned = False
+
+    def next_delay(self, rng, now):
+        delay = rng.randint(*self.first)
+        if self.spawned:
+            delay += rng.randint(*self.gap)
+        self.spawned = True
+        return delay
+
+# Orders at a steady rate, exponentially distributed waits
+class PoissonArrivals:
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+
+    def next_delay(self, rng, now):
+        return rng.expovariate(self.per_minute / 60.0)
+
+# hour of the day in local time, with its fraction
+def local_hour(now):
+    local = time.localtime(now)
+    return local.tm_hour + local.tm_min / 60.0 + local.tm_sec / 3600.0
+
+# Orders at a rate that changes over the day. curve: [(hour, orders per minute), ...] sorted by hour, each
+# rate holds until the next hour of the curve. Waits are drawn at the highest rate and thinned to the rate
+# of the hour they end at.
+class DemandCurveArrivals:
+    def __init__(self, curve, hour_of=None):
+        self.hours = [hour for hour, _ in curve]
+        self.rates = [rate for _, rate in curve]
+        self.peak = max(self.rates)
+        self.hour_of = hour_of or local_hour
+
+    def rate_at(self, now):
+        index = bisect.bisect_right(self.hours, self.hour_of(now)) - 1
+        return self.rates[index]
+
+    def next_delay(self, rng, now):
+        if self.peak <= 0:
+            return math.inf
+        delay = 0.0
+        while True:
+            delay += rng.expovariate(self.peak / 60.0)
+            if rng.random() * self.peak < self.rate_at(now + delay):
+                return delay
+
+class SpawnScheduler:
+    def __init__(self, fleet, arrivals=None, seed=None, clock=None):
+        self.fleet = fleet
+        self.arrivals = arrivals or UniformArrivals()
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.robot_rngs = {}        # robot number -> random.Random of the pizzas of that robot
+        self.clock = clock          # time of day given to the arrival process, time.time() if None
+        self.running = False
+        self.task = None
+
+        self.spawned = 0
+        self.skipped = 0            # orders nobody could take
+        self.history = collections.deque(maxlen=HISTORY)    # (time, robot number) of the last spawns
+
+    # Schedules the spawning on the loop of the game, from any thread
+    def start(self, loop):
+        self.task = asyncio.run_coroutine_threadsafe(self.run(), loop)
+
+    def stop(self):
+        self.running = False
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        self.running = True
+        loop = asyncio.get_event_loop()
+        while self.running:
+            delay = self.arrivals.next_delay(self.rng, self.now())
+            if delay == math.inf:
+                return
+            await asyncio.sleep(delay)
+            self.spawn(loop)
+
+    def spawn(self, loop):
+        world = self.fleet.dispatch()
+        if world is None:
+            self.skipped += 1
+            return
+        number = self.fleet.worlds.index(world)
+        rng = self.robot_rng(number)
+        if world.loop is loop:
+            world.spawn_pizza(rng)
+        else:
+            # another robot connected on its own loop, its game state only changes there
+            world.loop.call_soon_threadsafe(world.spawn_pizza, rng)
+        self.spawned += 1
+        self.history.append((self.now(), number))
+
+    # Random of the pizzas of a robot, only drawn from on the loop of that robot
+    def robot_rng(self, number):
+        rng = self.robot_rngs.get(number)
+        if rng is None:
+            rng = self.robot_rngs[number] = random.Random(None if self.seed is None else "%s/%d" % (self.seed, number))
+        return rng
+
+    def now(self):
+        return self.clock() if self.clock else time.time()
+
+    def stats(self):
+        return {'arrivals': type(self.arrivals).__name__,
+                'spawned': self.spawned,
+                'skipped': self.skipped,
+                'recent': list(self.history)}
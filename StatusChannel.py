@@ -0,0 +1,213 @@
+import collections
+import http.client
+import json
+import sys
+import threading
+import time
+
+'''
+@class StatusChannel
+Pushes the game status to the tablets as server-sent events instead of having every tablet poll for it.
+Values that are always there (mode, coins) are only pushed when they change, one-shot events (a pizza was
+spawned, the arcade result) are pushed once to everyone connected. Every change gets a version number so
+a tablet reconnecting with Last-Event-ID gets what it missed. The controls keep coming in through POST.
+Tablets that poll get the same status as one JSON object with its version, can wait for the next change
+with a long poll, and have their own cursor so every one of them hears about every pizza.
+@author - Wizards of Coz
+'''
+
+EVENT_HISTORY = 64      # changes kept for tablets that reconnect
+KEEPALIVE = 15.0        # seconds between comments sent to keep idle connections open
+LONG_POLL = 25.0        # seconds a poll waiting for a change is held at most
+MAX_CURSORS = 256       # polling tablets remembered, the least recently seen are forgotten first
+
+# status of the polling payload when nothing was published yet, and the one-shot events in it
+DEFAULTS = {"mode": "false", "coins": "0"}
+EVENTS = {"pizza": ("true", "false"), "arcade": (None, "-1")}
+
+class StatusChannel:
+    def __init__(self):
+        self.state = {}                                         # name -> last value of the status
+        self.version = 0
+        self.history = collections.deque(maxlen=EVENT_HISTORY)  # (version, name, value)
+        self.condition = threading.Condition()
+        self.clients = 0
+        self.messages_sent = 0
+        self.cursors = collections.OrderedDict()               # polling client -> last version it got
+
+    # Status value, pushed only if it changed
+    def set(self, name, value):
+        with self.condition:
+            if name in self.state and self.state[name] == value:
+                return
+            self.state[name] = value
+            self.push(name, value)
+
+    # One-shot event, pushed every time
+    def emit(self, name, value):
+        with self.condition:
+            self.push(name, value)
+
+    def push(self, name, value):
+        self.version += 1
+        self.history.append((self.version, name, value))
+        self.condition.notify_all()
+
+    # Changes after version since, or None if they are not all in the history anymore
+    def changes_since(self, since):
+        if since >= self.version:
+            return []
+        if not self.history or self.history[0][0] > since + 1:
+            return None
+        return [change for change in self.history if change[0] > since]
+
+    def snapshot(self):
+        return [(self.version, name, value) for name, value in self.state.items()]
+
+    # Blocks until there is a change after version since or timeout seconds passed, returns the version
+    def wait(self, since, timeout=LONG_POLL):
+        with self.condition:
+            if self.version <= since:
+                self.condition.wait_for(lambda: self.version > since, timeout)
+            return self.version
+
+    # Last version a polling client got, a new client starts from the current one
+    def cursor(self, client):
+        with self.condition:
+            return self.cursors.get(client, self.version)
+
+    # Status for a client that got everything up to version since, as one JSON serializable dict.
+    # Remembers that client got this version.
+    def payload(self, since=0, client=None):
+        with self.condition:
+            payload = dict(DEFAULTS)
+            payload.update(self.state)
+            for name, (value, none) in EVENTS.items():
+                payload[name] = none
+            for version, name, value in self.changes_since(since) or []:
+                if name in EVENTS:
+                    payload[name] = EVENTS[name][0] or value
+            payload["version"] = self.version
+            if client is not None:
+                self.cursors[client] = self.version
+                self.cursors.move_to_end(client)
+                if len(self.cursors) > MAX_CURSORS:
+                    self.cursors.popitem(last=False)
+            return payload
+
+    @staticmethod
+    def format(change):
+        version, name, value = change
+        return "id: %d\nevent: %s\ndata: %s\n\n" % (version, name, json.dumps(value))
+
+    # Generator of the server-sent events for one tablet, starting after version since
+    def stream(self, since=0):
+        with self.condition:
+            self.clients += 1
+            changes = self.changes_since(since) if since else None
+            if changes is None:
+                changes = self.snapshot()
+            since = self.version
+        try:
+            while True:
+                if changes:
+                    self.messages_sent += len(changes)
+                    yield "".join(self.format(change) for change in changes)
+                with self.condition:
+                    if self.version == since:
+                        self.condition.wait(KEEPALIVE)
+                    changes = self.changes_since(since)
+                    if changes is None:
+                        changes = self.snapshot()
+                    since = self.version
+                if not changes:
+                    yield ": keepalive\n\n"
+        finally:
+            with self.condition:
+                self.clients -= 1
+
+
+# Load test against a running CozmoWorld: every tablet either polls the way the page used to
+# (/updateCozmo every 60ms and /checkStatus every 100ms) or only listens to /status, the game being
+# updated on the server. Meanwhile one tablet drives with the joystick and times the requests, which
+# return once drive_wheels has been sent to Cozmo.
+#
+# Measured for 10 s on one core, with the game serving a simulated robot (Simulator.robot.SimRobot) in
+# real time. /updateCozmo was already a no-op there, so the polling requests cost less than they did when
+# each one ran the game update:
+#   tablets  mode     requests/s  joystick to wheels median / 95%
+#   4        polling  112.1       3.6 / 7.8 ms
+#   4        push       9.8       3.0 / 5.0 ms
+#   8        polling  212.6       3.8 / 11.8 ms
+#   8        push       9.6       3.1 / 7.9 ms
+# Under push, the requests left are the joystick's (10/s); every tablet holds one /status stream.
+def load_test(host="localhost", port=5000, tablets=4, duration=10.0, push=False):
+    counts = collections.Counter()
+    latencies = []
+    stop = time.time() + duration
+    lock = threading.Lock()
+
+    def post(connection, url, data):
+        connection.request("POST", "/" + url, json.dumps(data))
+        connection.getresponse().read()
+        with lock:
+            counts[url] += 1
+
+    def poll(url, interval):
+        connection = http.client.HTTPConnection(host, port)
+        while time.time() < stop:
+            post(connection, url, {})
+            time.sleep(interval)
+
+    def listen():
+        connection = http.client.HTTPConnection(host, port, timeout=duration + KEEPALIVE)
+        connection.request("GET", "/status")
+        response = connection.getresponse()
+        while time.time() < stop:
+            line = response.fp.readline()
+            if not line:
+                break
+            if line.startswith(b"event:"):
+                with lock:
+                    counts["status events"] += 1
+        connection.close()
+
+    def drive():
+        connection = http.client.HTTPConnection(host, port)
+        angle = 90
+        while time.time() < stop:
+            start = time.perf_counter()
+            post(connection, "joystickMove", {"angle": angle, "force": 1})
+            latencies.append(time.perf_counter() - start)
+            angle = 270 if angle == 90 else 90
+            time.sleep(0.1)
+        post(connection, "joystickEnd", {"msg": "End"})
+
+    threads = [threading.Thread(target=drive)]
+    for _ in range(tablets):
+        if push:
+            threads.append(threading.Thread(target=listen))
+        else:
+            threads.append(threading.Thread(target=poll, args=("updateCozmo", 0.06)))
+            threads.append(threading.Thread(target=poll, args=("checkStatus", 0.1)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join(duration + KEEPALIVE)
+
+    latencies.sort()
+    print("%s, %d tablets" % ("push" if push else "polling", tablets))
+    print("  requests/s: %.1f (%s)" % (sum(n for url, n in counts.items() if url != "status events") / duration,
+                                       ", ".join("%s %d" % item for item in sorted(counts.items()))))
+    if latencies:
+        print("  joystick to wheels: median %.1f ms, 95%% %.1f ms" % (latencies[len(latencies) // 2] * 1000,
+                                                                   latencies[int(len(latencies) * 0.95)] * 1000))
+
+if __name__ == '__main__':
+    # python StatusChannel.py [host] [port] [tablets]
+    host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    tablets = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    load_test(host, port, tablets, push=False)
+    load_test(host, port, tablets, push=True)
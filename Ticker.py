@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+
+'''
+@class Ticker
+Calls the game update at a fixed rate on the asyncio loop of the Cozmo SDK, whatever number of tablets are
+connected. Each tick is scheduled from the time the previous one was due, not from when it finished, so
+late ticks do not add up. Measures how late every tick starts (jitter) and counts the ticks that took
+longer than a period (overruns); the ticks missed because of an overrun are skipped, not run in a burst.
+@author - Wizards of Coz
+'''
+
+log = logging.getLogger(__name__)
+
+TICK_HZ = 16.0      # about the 60ms the tablets used to update the game at
+
+class Ticker:
+    def __init__(self, callback, hz=TICK_HZ):
+        self.callback = callback
+        self.period = 1.0 / hz
+        self.running = False
+
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.total_jitter = 0.0
+        self.max_jitter = 0.0
+        self.max_duration = 0.0
+
+    async def run(self):
+        self.running = True
+        loop = asyncio.get_event_loop()
+        deadline = loop.time()
+        while self.running:
+            start = loop.time()
+            jitter = start - deadline
+            self.total_jitter += jitter
+            self.max_jitter = max(self.max_jitter, jitter)
+
+            try:
+                self.callback()
+            except Exception as e:
+                log.exception("Tick failed: %s", e)
+            self.ticks += 1
+
+            end = loop.time()
+            self.max_duration = max(self.max_duration, end - start)
+            deadline += self.period
+            if end > deadline:
+                # the tick took too long, carry on from the next period still ahead
+                self.overruns += 1
+                missed = int((end - deadline) / self.period) + 1
+                self.skipped += missed
+                deadline += missed * self.period
+            await asyncio.sleep(deadline - end)
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {'hz': 1.0 / self.period,
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'mean_jitter_ms': self.total_jitter / self.ticks * 1000 if self.ticks else 0.0,
+                'max_jitter_ms': self.max_jitter * 1000,
+                'max_duration_ms': self.max_duration * 1000}
+
+if __name__ == '__main__':
+    # Ticks a callback busy for 5ms at 16Hz for 3 seconds, with one tick of 200ms in the middle
+    def work():
+        busy = 0.2 if ticker.ticks == 24 else 0.005
+        until = time.perf_counter() + busy
+        while time.perf_counter() < until:
+            pass
+
+    ticker = Ticker(work)
+    loop = asyncio.get_event_loop()
+    loop.call_later(3.0, ticker.stop)
+    loop.run_until_complete(ticker.run())
+    print(ticker.stats())
@@ -1,15 +1,47 @@
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 import webbrowser
 from time import sleep
 from io import BytesIO
 try:
     from flask import make_response, send_file
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 except ImportError:
     sys.exit("Cannot import from flask: Do `pip3 install --user flask` to install")
 
 
+REQUEST_WORKERS = 64    # threads serving the requests, a tablet keeps one busy with its /status stream
+
+
+class PooledRequestHandler(WSGIRequestHandler):
+    # a connection per request, an idle keep-alive connection would hold a thread of the pool
+    protocol_version = "HTTP/1.0"
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    '''Werkzeug server handing every request to a fixed pool of threads, instead of starting a thread per
+       request. Requests wait for a free thread once all of them are busy.'''
+    multithread = True
+
+    def __init__(self, host, port, app, workers=REQUEST_WORKERS, **kw):
+        kw.setdefault('handler', PooledRequestHandler)
+        super().__init__(host, port, app, **kw)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
 
 def _delayed_open_web_browser(url, delay, new=0, autoraise=True, specific_browser=None):
     def _sleep_and_open_web_browser(url, delay, new, autoraise, specific_browser):
@@ -41,7 +73,13 @@ def run_flask(flask_app, host_ip="0.0.0.0", host_port=5000, enable_flask_logging
         # before the webpage requests any data
         _delayed_open_web_browser("http://" + host_ip + ":" + str(host_port), delay=open_page_delay)
 
-    flask_app.run(host=host_ip, port=host_port, use_evalex=False)
+    # the request threads only hand the calls into the game over to the SDK event loop
+    server = PooledWSGIServer(host_ip, host_port, flask_app)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.executor.shutdown(wait=False)
 
 
 def make_uncached_response(in_file):
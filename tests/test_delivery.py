@@ -0,0 +1,62 @@
+import itertools
+import unittest
+from Patrol.Track.track import Track
+from Patrol.delivery import DeliveryPlanner, expectedTip, AUTONOMOUS_COINS, TIMER_1, TIMER_2, TIMER_3, MAX_EXACT_STOPS
+
+'''
+Tests of the ordering of the deliveries in the bag.
+@author - Wizards of Coz
+'''
+
+SPEED = 50
+
+class ExpectedTipTest(unittest.TestCase):
+    def test_autonomous_coins_until_the_pizza_is_gone(self):
+        for age in (0, TIMER_1 + 1, TIMER_2 + 1, TIMER_3):
+            self.assertEqual(expectedTip(age), AUTONOMOUS_COINS)
+
+    def test_nothing_once_the_pizza_is_gone(self):
+        self.assertEqual(expectedTip(TIMER_3 + 1), 0.0)
+
+class DeliveryPlannerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.planner = DeliveryPlanner(Track())
+
+    def test_one_stop_is_kept(self):
+        self.assertEqual(self.planner.plan("PH", [("RB", 0.0)], SPEED, 0.0), [("RB", 0.0)])
+
+    def test_the_plan_is_a_permutation_of_the_stops(self):
+        stops = [("RB", -10.0), ("GB", -20.0), ("YB", -30.0), ("MB", -40.0), ("BB", -50.0)]
+        self.assertEqual(sorted(self.planner.plan("PH", stops, SPEED, 0.0)), sorted(stops))
+
+    def test_a_pizza_that_would_be_gone_is_delivered_first(self):
+        near, far = self.nearest_and_farthest()
+        # the far pizza only makes it if it goes first, the near one has all the time it needs
+        firstFar = self.planner.travelTime("PH", far, SPEED)
+        spawned = firstFar + self.planner.travelTime(far, near, SPEED) / 2 - TIMER_3
+        stops = [(near, 0.0), (far, spawned)]
+        order = self.planner.plan("PH", stops, SPEED, 0.0)
+        self.assertEqual(order[0][0], far)
+        self.assertEqual(self.planner.evaluate("PH", order, SPEED, 0.0)[0], 2 * AUTONOMOUS_COINS)
+
+    def test_the_exact_plan_is_the_best_order(self):
+        stops = [("RB", -200.0), ("GB", -50.0), ("YB", -150.0), ("MB", 0.0)]
+        self.assertLessEqual(len(stops), MAX_EXACT_STOPS)
+        best = max(self.planner.score("PH", order, SPEED, 0.0) for order in itertools.permutations(stops))
+        self.assertEqual(self.planner.score("PH", self.planner.plan("PH", stops, SPEED, 0.0), SPEED, 0.0), best)
+
+    def test_equally_good_orders_finish_earliest(self):
+        stops = [("RB", 0.0), ("GB", 0.0), ("YB", 0.0)]
+        order = self.planner.plan("PH", stops, SPEED, 0.0)
+        fastest = min(self.planner.evaluate("PH", o, SPEED, 0.0)[1] for o in itertools.permutations(stops))
+        self.assertEqual(self.planner.evaluate("PH", order, SPEED, 0.0)[1], fastest)
+
+    # customer buildings nearest to and farthest from the pizzeria
+    def nearest_and_farthest(self):
+        customers = ["RB", "GB", "YB", "MB", "BB"]
+        customers.sort(key=lambda bldgId: self.planner.travelTime("PH", bldgId, SPEED))
+        return customers[0], customers[-1]
+
+if __name__ == '__main__':
+    unittest.main()
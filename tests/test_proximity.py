@@ -0,0 +1,106 @@
+import asyncio
+import types
+import unittest
+from unittest import mock
+from Proximity import ProximityEngine, HYSTERESIS
+
+'''
+Tests of entering and leaving the zones of the buildings and of dispatching their handlers.
+@author - Wizards of Coz
+'''
+
+ENTER = 150
+
+def pose(x, y):
+    return types.SimpleNamespace(position=types.SimpleNamespace(x=x, y=y))
+
+class ProximityTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.robot = types.SimpleNamespace(pose=pose(0.0, 0.0))
+        self.world = types.SimpleNamespace(buildingMaps={"marker": "Arcade"}, is_autonomous_mode=False)
+        self.engine = ProximityEngine(self.robot, self.world)
+        self.marker = types.SimpleNamespace(object_type="marker", pose=pose(0.0, 0.0))
+        self.calls = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def handler(self, dist):
+        self.calls.append(dist)
+
+    # checks the marker at this distance and lets the dispatched handler run
+    def at(self, dist):
+        self.marker.pose = pose(dist, 0.0)
+
+        async def check():
+            self.engine.check(self.marker)
+            await asyncio.sleep(0)
+        self.loop.run_until_complete(check())
+
+    def test_entering_dispatches_once(self):
+        self.engine.add_zone("Arcade", self.handler, ENTER)
+        self.at(ENTER + 10)
+        self.assertEqual(self.calls, [])
+        self.at(ENTER - 10)
+        self.assertEqual(self.calls, [ENTER - 10])
+        self.assertIn("Arcade", self.engine.inside)
+
+    def test_staying_within_the_hysteresis_keeps_the_zone(self):
+        self.engine.add_zone("Arcade", self.handler, ENTER)
+        self.at(ENTER - 10)
+        self.at(ENTER + HYSTERESIS - 10)
+        self.assertIn("Arcade", self.engine.inside)
+        self.at(ENTER - 10)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_leaving_and_coming_back_dispatches_again(self):
+        self.engine.add_zone("Arcade", self.handler, ENTER)
+        self.at(ENTER - 10)
+        self.at(ENTER + HYSTERESIS + 10)
+        self.assertNotIn("Arcade", self.engine.inside)
+        self.at(ENTER - 10)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_a_repeating_zone_waits_for_its_interval(self):
+        self.engine.add_zone("Arcade", self.handler, ENTER, repeat=True, interval=0.5)
+        with mock.patch("time.time", return_value=1000.0) as now:
+            self.at(ENTER - 10)
+            now.return_value = 1000.4
+            self.at(ENTER - 10)
+            self.assertEqual(len(self.calls), 1)
+            now.return_value = 1000.5
+            self.at(ENTER - 10)
+            self.assertEqual(len(self.calls), 2)
+
+    def test_a_running_handler_is_not_dispatched_twice(self):
+        release = asyncio.Event()
+
+        async def slow(dist):
+            self.calls.append(dist)
+            await release.wait()
+        self.engine.add_zone("Arcade", slow, ENTER, repeat=True)
+        self.at(ENTER - 10)
+        self.at(ENTER - 10)
+        self.assertEqual(len(self.calls), 1)
+        release.set()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.at(ENTER - 10)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_the_autonomous_mode_has_its_own_distance(self):
+        self.engine.add_zone("Arcade", self.handler, ENTER, enter_autonomous=ENTER + 50)
+        self.world.is_autonomous_mode = True
+        self.at(ENTER + 10)
+        self.assertEqual(self.calls, [ENTER + 10])
+
+    def test_a_building_without_a_zone_is_ignored(self):
+        self.world.buildingMaps["marker"] = "Pizzeria"
+        self.engine.add_zone("Arcade", self.handler, ENTER)
+        self.at(0)
+        self.assertEqual((self.calls, self.engine.inside), ([], set()))
+
+if __name__ == '__main__':
+    unittest.main()
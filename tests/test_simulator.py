@@ -0,0 +1,26 @@
+import unittest
+from Simulator import replay, simulation
+
+'''
+Runs the game against the simulated robot, the same checks as python -m Simulator.simulation --check
+and python -m Simulator.replay --check.
+@author - Wizards of Coz
+'''
+
+class SimulationTest(unittest.TestCase):
+    def test_two_runs_of_a_seed_are_the_same(self):
+        result = simulation.check()
+        self.assertTrue(result['same'], result)
+        # the simulated robot does deliver pizzas and earn coins
+        for deliveries, coins in zip(result['deliveries'], result['coins']):
+            self.assertGreaterEqual(deliveries[0], 1, result)
+            self.assertGreater(coins[0], 0, result)
+
+class ReplayTest(unittest.TestCase):
+    def test_the_replay_of_a_recording_is_the_same_session(self):
+        result = replay.check()
+        self.assertTrue(result['same'], result)
+        self.assertFalse(any(result['replay']['draws_left'].values()), result)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import json
+import threading
+import types
+import unittest
+from unittest import mock
+import CozmoWorld
+from StatusChannel import StatusChannel
+
+'''
+Tests of the status a polling tablet gets from /checkStatus, its version and ETag.
+@author - Wizards of Coz
+'''
+
+class CheckStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.status = StatusChannel()
+        world = types.SimpleNamespace(status=self.status)
+        patcher = mock.patch.object(CozmoWorld.fleet, "world", lambda robot=0: world if robot == 0 else None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = CozmoWorld.flask_app.test_client()
+
+    def get(self, url="/checkStatus", **headers):
+        return self.client.get(url, headers=headers)
+
+    def test_the_status_and_its_version(self):
+        self.status.set("coins", "3")
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_etag(), ("1", False))
+        self.assertEqual(json.loads(response.data)["coins"], "3")
+        self.assertEqual(json.loads(response.data)["version"], 1)
+
+    def test_the_current_version_is_not_modified(self):
+        self.status.set("coins", "3")
+        for tag in ('"1"', 'W/"1"', '"0", "1"'):
+            response = self.get(**{"If-None-Match": tag})
+            self.assertEqual(response.status_code, 304, tag)
+            self.assertEqual(response.get_etag(), ("1", False))
+
+    def test_an_older_version_gets_what_it_missed(self):
+        self.status.emit("pizza", "spawned")
+        self.status.set("coins", "3")
+        response = self.get(**{"If-None-Match": '"0"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["pizza"], "true")
+        self.assertEqual(response.get_etag(), ("2", False))
+
+    def test_a_tag_that_is_not_a_version_uses_the_cursor(self):
+        self.get("/checkStatus?client=tablet")
+        self.status.emit("pizza", "spawned")
+        response = self.get("/checkStatus?client=tablet", **{"If-None-Match": '"abc"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["pizza"], "true")
+        # the cursor moved on, the same pizza is not heard twice
+        response = self.get("/checkStatus?client=tablet")
+        self.assertEqual(json.loads(response.data)["pizza"], "false")
+
+    def test_since_waits_for_the_next_change(self):
+        self.status.set("coins", "3")
+        timer = threading.Timer(0.1, self.status.set, ("coins", "5"))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        response = self.get("/checkStatus?since=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["coins"], "5")
+        self.assertEqual(response.get_etag(), ("2", False))
+
+    def test_since_without_a_change_is_not_modified(self):
+        self.status.set("coins", "3")
+        with mock.patch.object(self.status, "wait", return_value=1):
+            response = self.get("/checkStatus?since=1")
+        self.assertEqual(response.status_code, 304)
+
+    def test_a_robot_that_is_not_there(self):
+        self.assertEqual(self.get("/robot/3/checkStatus").data, b"{}")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from Patrol.Track import track
+from Patrol.Track.track import Track, EdgeEstimator, TRACK_FILE_PATH, MARKER_NOISE
+
+'''
+Tests of the position estimate along an edge and of the route cache of the track.
+@author - Wizards of Coz
+'''
+
+class EdgeEstimatorTest(unittest.TestCase):
+    def test_predict_moves_and_grows_the_variance(self):
+        estimator = EdgeEstimator()
+        estimator.predict(100.0)
+        self.assertEqual(estimator.position, 100.0)
+        self.assertGreater(estimator.variance, 0.0)
+
+    def test_correct_moves_towards_the_measurement_and_shrinks_the_variance(self):
+        estimator = EdgeEstimator()
+        estimator.predict(100.0)
+        variance = estimator.variance
+        estimator.updateOdometry(110.0)
+        self.assertGreater(estimator.position, 100.0)
+        self.assertLess(estimator.position, 110.0)
+        self.assertLess(estimator.variance, variance)
+
+    def test_a_marker_weighs_less_than_a_precise_odometry(self):
+        odometry = EdgeEstimator()
+        marker = EdgeEstimator()
+        for estimator in (odometry, marker):
+            estimator.predict(100.0)
+        odometry.updateOdometry(120.0)
+        marker.updateMarker(120.0)
+        self.assertGreater(odometry.position, marker.position)
+
+    def test_a_marker_pulls_a_drifted_estimate_back(self):
+        estimator = EdgeEstimator()
+        for _ in range(20):
+            estimator.predict(150.0)
+        self.assertGreater(estimator.variance, MARKER_NOISE ** 2)
+        estimator.updateMarker(2900.0)
+        self.assertLess(abs(estimator.position - 2900.0), abs(3000.0 - 2900.0) / 2)
+
+    def test_reset_knows_the_position_exactly(self):
+        estimator = EdgeEstimator()
+        estimator.predict(100.0)
+        estimator.reset()
+        self.assertEqual((estimator.position, estimator.variance), (0.0, 0.0))
+
+class RouteCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "track.json")
+        shutil.copy(os.path.join(os.path.dirname(track.__file__), TRACK_FILE_PATH), self.path)
+        self.cachePath = os.path.join(self.folder, "track.cache")
+        self.fresh = Track(self.path)
+        with open(self.cachePath, "rb") as cache_data:
+            self.cache = pickle.load(cache_data)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def sizes(self, t):
+        return len(t.vertices), len(t.edges), len(t.routes)
+
+    # a start with this cache plans the same track as without one
+    def assertRebuilt(self, content):
+        with open(self.cachePath, "wb") as cache_data:
+            cache_data.write(content)
+        t = Track(self.path)
+        self.assertEqual(self.sizes(t), self.sizes(self.fresh))
+        self.assertEqual(t.routes, self.fresh.routes)
+
+    def test_the_cache_restores_the_same_track(self):
+        t = Track(self.path)
+        self.assertEqual(self.sizes(t), self.sizes(self.fresh))
+        self.assertEqual(t.routes, self.fresh.routes)
+        self.assertEqual(t.getPath("GA", "PH", None).distance, self.fresh.getPath("GA", "PH", None).distance)
+
+    def test_bytes_that_are_not_a_pickle_are_a_miss(self):
+        self.assertRebuilt(b"not a pickle")
+
+    def test_an_object_of_another_shape_is_a_miss(self):
+        self.assertRebuilt(pickle.dumps([1, 2, 3]))
+
+    def test_an_older_version_is_a_miss(self):
+        self.assertRebuilt(pickle.dumps(dict(self.cache, version=self.cache["version"] - 1)))
+
+    def test_missing_keys_are_a_miss(self):
+        with self.assertLogs(track.log, "WARNING"):
+            self.assertRebuilt(pickle.dumps({"version": self.cache["version"], "digest": self.cache["digest"]}))
+
+    def test_misshapen_entries_are_a_miss(self):
+        self.assertRebuilt(pickle.dumps(dict(self.cache, edges=[(0,)])))
+        self.assertRebuilt(pickle.dumps(dict(self.cache, vertices=[None])))
+        self.assertRebuilt(pickle.dumps(dict(self.cache, routes=[([10 ** 6], True, False)])))
+
+if __name__ == '__main__':
+    unittest.main()